@@ -11,8 +11,15 @@
 
 from tmath import *
 from marshal import *
+from lrucache import LRUCache
 import copy
+import hashlib
+import linecache
 import logging
+import os
+import struct
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("aes.py")
@@ -25,7 +32,8 @@ Z2 = Z(2)
 POFZ2 = POF(Z2)
 
 # Reduction polynomial in POFZ2 as defined by Page 36 of the Rijndael book. MAGIC
-rp = POFZ2.fromInt(0x11b)
+ReductionPolynomial = 0x11b
+rp = POFZ2.fromInt(ReductionPolynomial)
 
 # Galois field over Z2 with reduction polynomial
 GFPOFZ2 = GFPOF(Z2, rp)
@@ -57,15 +65,18 @@ def fGen(a, mask):
     mask = rol(mask, 1, 8)
   return fromBin(res)
 
+# Affine map of the S-box and its inverse, Page 36 and 37 of the Rijndael
+# book. MAGIC
+AffineMask, AffineConstant = 0xF1, 0x63
+InvAffineMask, InvAffineConstant = 0xA4, 0x05
+
 def f(a):
   """f, as defined by the Rijndael book Page 36."""
-  # MAGIC
-  return fGen(a, 0xF1) ^ 0x63
+  return fGen(a, AffineMask) ^ AffineConstant
 
 def fInv(a):
   """f^-1, as defined by the Rijndael book Page 37."""
-  # MAGIC
-  return fGen(a, 0xA4) ^ 0x05
+  return fGen(a, InvAffineMask) ^ InvAffineConstant
 
 def g(a):
   """g, as defined by the Rijndael book Page 36.
@@ -75,17 +86,23 @@ def g(a):
   if a == 0: return 0
   return fromBin(POL2L(GFPOFZ2.fromInt(a).mulInv()))
 
+def gTable():
+  """g(a) for all bytes a, inverted in one batch."""
+  inverses = GFPOFZ2.batchMulInv([GFPOFZ2.fromInt(a) for a in range(0, 0x100)])
+  return [fromBin(POL2L(a)) for a in inverses]
+
 def SR(a):
+  if not TablesLoaded: loadTables()
   return STable[a]
 
 def SRInv(a):
+  if not TablesLoaded: loadTables()
   return SInvTable[a]
 
+# STable, SInvTable and the other derived tables are filled in place by
+# loadTables at the end of this module.
 STable = bytearray()
 SInvTable = bytearray()
-for i in range(0, 0x100):
-  STable.append(f(g(i)))
-  SInvTable.append(g(fInv(i)))
 
 RCCache = [0x00, 0x01]
 
@@ -101,6 +118,7 @@ def xtime(a):
   return fromBin(EL2L(newpol.toEL()))
 
 def keyExpansion(cipherKey, nr, nk, nb):
+  loadTables()
   expandedKey = []
   for j in range(0, nk):
     expandedKey.append(cipherKey[j])
@@ -121,6 +139,7 @@ def keyExpansion(cipherKey, nr, nk, nb):
 
 def SubBytes(state, function):
   """Sec 3.4.1 of the Rijndael book."""
+  loadTables()
   r = []
   for i in state:
     r.append(map(function, i))
@@ -169,9 +188,14 @@ def SingleMixColumn(stateSub, coeffs):
     localcoeffs = RORRay(localcoeffs, 1)
   return resStateSub
 
+# MAGIC
+MixColumnsCoeffs = [0x02, 0x03, 0x01, 0x01]
+InvMixColumnsCoeffs = [0x0E, 0x0B, 0x0D, 0x09]
+
 def MixColumns(state, coeffs):
   """Sec 3.4.3 of the Rijndael book."""
-  return map(lambda x: SingleMixColumn(x, coeffs), state)
+  with ProfileStage('m_col'):
+    return map(lambda x: SingleMixColumn(x, coeffs), state)
 
 def AddRoundKey(state, subkey):
   """Sec 3.4.4 of the Rijndael book."""
@@ -180,73 +204,655 @@ def AddRoundKey(state, subkey):
       lambda stateE, keyE: stateE^keyE, stateSL, keySL),
     state, subkey)
 
+# Flat state. The round functions below hold the state as one bytearray
+# of 4*nb bytes in column order, the layout of stateToArray, and modify
+# it in place. Index lists, ShiftRows permutations and multiplication
+# tables are computed once, so a round creates no new state objects.
+
+StateIndices = dict((nb, range(0, 4 * nb)) for nb in range(4, 9))
+ColumnStarts = dict((nb, range(0, 4 * nb, 4)) for nb in range(4, 9))
+
+def shiftRowsCycles(nb, amp):
+  """ShiftRows of a flat state as cycles of byte moves.
+
+  A cycle is (first, moves, last): the byte at first is saved, every
+  (dst, src) of moves copies one byte and the saved byte goes to last.
+  """
+  offsets = ShiftRowsOffsets[nb - 4]
+  cycles = []
+  for i in range(1, 4):
+    shift = (offsets[i] * amp) % nb
+    done = set()
+    for start in range(0, nb):
+      if shift == 0 or start in done:
+        continue
+      moves = []
+      j = start
+      while True:
+        done.add(j)
+        src = (j + shift) % nb
+        if src == start:
+          break
+        moves.append((4 * j + i, 4 * src + i))
+        j = src
+      cycles.append((4 * start + i, moves, 4 * j + i))
+  return cycles
+
+# ShiftRowsCycles[amp][nb] for both directions.
+ShiftRowsCycles = dict((amp, dict((nb, shiftRowsCycles(nb, amp))
+                                  for nb in range(4, 9)))
+                       for amp in (1, -1))
+
+# coeff * a for every MixColumns coefficient, filled by loadTables.
+MulTables = dict((c, bytearray())
+                 for c in set(MixColumnsCoeffs + InvMixColumnsCoeffs))
+MixColumnsMuls = [MulTables[c] for c in MixColumnsCoeffs]
+InvMixColumnsMuls = [MulTables[c] for c in InvMixColumnsCoeffs]
+
+def SubBytesFlat(state, table):
+  """SubBytes of a flat state through STable or SInvTable."""
+  for k in StateIndices[len(state) / 4]:
+    state[k] = table[state[k]]
+
+def ShiftRowsFlat(state, amp):
+  for first, moves, last in ShiftRowsCycles[amp][len(state) / 4]:
+    saved = state[first]
+    for dst, src in moves:
+      state[dst] = state[src]
+    state[last] = saved
+
+def MixColumnsFlat(state, muls):
+  """MixColumns of a flat state with MixColumnsMuls or InvMixColumnsMuls."""
+  m0, m1, m2, m3 = muls
+  for k in ColumnStarts[len(state) / 4]:
+    a0 = state[k]
+    a1 = state[k + 1]
+    a2 = state[k + 2]
+    a3 = state[k + 3]
+    state[k] = m0[a0] ^ m1[a1] ^ m2[a2] ^ m3[a3]
+    state[k + 1] = m3[a0] ^ m0[a1] ^ m1[a2] ^ m2[a3]
+    state[k + 2] = m2[a0] ^ m3[a1] ^ m0[a2] ^ m1[a3]
+    state[k + 3] = m1[a0] ^ m2[a1] ^ m3[a2] ^ m0[a3]
+
+def AddRoundKeyFlat(state, subkey):
+  for k in StateIndices[len(state) / 4]:
+    state[k] ^= subkey[k]
+
+# Round hooks. Every registered hook is called as hook(nr, stage, state)
+# after each step of the round functions below, where stage is one of
+# 'input', 'start', 's_box', 's_row', 'm_col', 'k_sch' and 'output' for
+# encryption and 'iinput', 'ik_add', 'im_col', 'is_row', 'is_box' and
+# 'ioutput' for decryption. The state is the flat state, for 'k_sch' it
+# is the flat round key. Hooks must not modify it and have to copy it to
+# keep it. With no hook registered, a round only pays for testing the
+# empty list. The T-table backend has no separate round steps and calls
+# no hooks.
+RoundHooks = []
+
+def addRoundHook(hook):
+  RoundHooks.append(hook)
+  return hook
+
+def removeRoundHook(hook):
+  RoundHooks.remove(hook)
+
+def emitRound(nr, stage, state):
+  for hook in RoundHooks:
+    hook(nr, stage, state)
+
+def traceHook(nr, stage, state):
+  """Logs the R[nn].stage trace lines of the Rijndael book's appendix."""
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("R[%02d].%-8s%s" % (nr, stage,
+                                      dumpStateHex(arrayToState(state))))
+
+class TimingHook(object):
+  """Accumulates the time spent in every stage.
+
+  The time between two consecutive hook calls of a block is charged to
+  the stage of the second call.
+  """
+  def __init__(self):
+    self.seconds = {}
+    self.calls = {}
+    self.last = None
+
+  def __call__(self, nr, stage, state):
+    now = time.time()
+    if stage not in ('input', 'iinput'):
+      self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self.last
+      self.calls[stage] = self.calls.get(stage, 0) + 1
+    self.last = now
+
+  def report(self):
+    return dict((stage, {'seconds': self.seconds[stage],
+                         'calls': self.calls[stage]})
+                for stage in self.seconds)
+
+class CaptureHook(object):
+  """Records (nr, stage, bytes) of every step for test vector debugging."""
+  def __init__(self):
+    self.trace = []
+
+  def __call__(self, nr, stage, state):
+    self.trace.append((nr, stage, bytearray(state)))
+
+  def get(self, nr, stage):
+    for n, s, state in self.trace:
+      if (n, s) == (nr, stage):
+        return state
+    return None
+
 def rnd(state, subkey, nr):
-  logger.debug("R[%02d].start   %s" % (nr, dumpStateHex(state)))
-  state = SubBytes(state, SR)
-  logger.debug("R[%02d].s_box   %s" % (nr, dumpStateHex(state)))
-  state = ShiftRows(state, 1)
-  logger.debug("R[%02d].s_row   %s" % (nr, dumpStateHex(state)))
-  # MAGIC
-  state = MixColumns(state, [0x02, 0x03, 0x01, 0x01])
-  logger.debug("R[%02d].m_col   %s" % (nr, dumpStateHex(state)))
-  state = AddRoundKey(state, subkey)
-  logger.debug("R[%02d].k_sch   %s" % (nr, dumpStateHex(subkey)))
+  if RoundHooks: emitRound(nr, 'start', state)
+  SubBytesFlat(state, STable)
+  if RoundHooks: emitRound(nr, 's_box', state)
+  ShiftRowsFlat(state, 1)
+  if RoundHooks: emitRound(nr, 's_row', state)
+  MixColumnsFlat(state, MixColumnsMuls)
+  if RoundHooks: emitRound(nr, 'm_col', state)
+  AddRoundKeyFlat(state, subkey)
+  if RoundHooks: emitRound(nr, 'k_sch', subkey)
   return state
 
 def invRnd(state, subkey, nr):
-  state = AddRoundKey(state, subkey)
-  # MAGIC
-  state = MixColumns(state, [0x0E, 0x0B, 0x0D, 0x09])
-  state = ShiftRows(state, -1)
-  state = SubBytes(state, SRInv)
+  AddRoundKeyFlat(state, subkey)
+  if RoundHooks: emitRound(nr, 'ik_add', state)
+  MixColumnsFlat(state, InvMixColumnsMuls)
+  if RoundHooks: emitRound(nr, 'im_col', state)
+  ShiftRowsFlat(state, -1)
+  if RoundHooks: emitRound(nr, 'is_row', state)
+  SubBytesFlat(state, SInvTable)
+  if RoundHooks: emitRound(nr, 'is_box', state)
   return state
 
 def finalRnd(state, key, nr):
-  logger.debug("R[%02d].start   %s" % (nr, dumpStateHex(state)))
-  state = SubBytes(state, SR)
-  logger.debug("R[%02d].s_box   %s" % (nr, dumpStateHex(state)))
-  state = ShiftRows(state, 1)
-  logger.debug("R[%02d].s_row   %s" % (nr, dumpStateHex(state)))
-  state = AddRoundKey(state, key)
-  logger.debug("R[%02d].k_sch   %s" % (nr, dumpStateHex(key)))
+  if RoundHooks: emitRound(nr, 'start', state)
+  SubBytesFlat(state, STable)
+  if RoundHooks: emitRound(nr, 's_box', state)
+  ShiftRowsFlat(state, 1)
+  if RoundHooks: emitRound(nr, 's_row', state)
+  AddRoundKeyFlat(state, key)
+  if RoundHooks: emitRound(nr, 'k_sch', key)
   return state
 
 def invFinalRnd(state, key, nr):
-  state = AddRoundKey(state, key)
-  state = ShiftRows(state, -1)
-  state = SubBytes(state, SRInv)
+  AddRoundKeyFlat(state, key)
+  if RoundHooks: emitRound(nr, 'ik_add', state)
+  ShiftRowsFlat(state, -1)
+  if RoundHooks: emitRound(nr, 'is_row', state)
+  SubBytesFlat(state, SInvTable)
+  if RoundHooks: emitRound(nr, 'is_box', state)
+  return state
+
+# Expanded keys of recently used keys, keyed on (key bytes, nb).
+KeyExpansionCache = LRUCache(64)
+
+def expandKey(key, nb):
+  """Returns the key schedule of key for block width nb.
+
+  The schedule is (nr, expandedKey, roundKeyWords, roundKeyBytes,
+  invRoundKeyWords). roundKeyBytes holds one flat round key per round
+  for the round functions above, invRoundKeyWords are the round keys of
+  tDecrypt. Results are memoized in KeyExpansionCache. The returned key
+  schedule is shared, so callers must not modify it.
+  """
+  loadTables()
+  cacheKey = (bytes(bytearray(key)), nb)
+  entry = KeyExpansionCache.get(cacheKey)
+  if entry is None:
+    cipherKey = arrayToState(key)
+    nk = len(cipherKey)
+    nr = max(nb, nk)+6
+    with ProfileStage('key_exp'):
+      expandedKey = keyExpansion(cipherKey, nr, nk, nb)
+    flat = stateToArray(expandedKey)
+    words = bytesToWords(flat)
+    entry = (nr, expandedKey, words,
+             [flat[4*nb*i:4*nb*(i+1)] for i in range(0, nr+1)],
+             invRoundKeyWords(words, nb, nr))
+    KeyExpansionCache.put(cacheKey, entry)
+  return entry
+
+def flatState(msg):
+  """A new flat state holding msg."""
+  state = bytearray(msg)
+  if len(state) / 4 not in StateIndices or len(state) % 4:
+    raise ValueError("unsupported block size %d" % len(state))
   return state
 
 def rijndael(msg, key):
-  state = arrayToState(msg)
-  cipherKey = arrayToState(key)
-  nb = len(state)
-  nk = len(cipherKey)
-  nr = max(nb, nk)+6
-  expandedKey = keyExpansion(cipherKey, nr, nk, nb)
-  logger.debug("R[00].input   %s" % dumpStateHex(state))
-  state = AddRoundKey(state, expandedKey[0:nb])
-  logger.debug("R[%02d].k_sch   %s" % (nr, dumpStateHex(expandedKey[0:nb])))
+  state = flatState(msg)
+  nb = len(state) / 4
+  nr, _, _, roundKeys, _ = expandKey(key, nb)
+  return cipher(state, roundKeys, nb, nr)
+
+def cipher(state, roundKeys, nb, nr):
+  """Encrypts the flat state in place, roundKeys as from expandKey."""
+  loadTables()
+  if RoundHooks: emitRound(0, 'input', state)
+  AddRoundKeyFlat(state, roundKeys[0])
+  if RoundHooks: emitRound(0, 'k_sch', roundKeys[0])
   for i in range(1, nr):
-    subkey = expandedKey[nb*i:nb*(i+1)]
-    state = rnd(state, expandedKey[nb*i:nb*(i+1)], i)
-  state = finalRnd(state, expandedKey[nb*(nr):nb*(nr+1)], nr)
-  logger.debug("R[%02d].output  %s" % (nr, dumpStateHex(state)))
-  return stateToArray(state)
+    rnd(state, roundKeys[i], i)
+  finalRnd(state, roundKeys[nr], nr)
+  if RoundHooks: emitRound(nr, 'output', state)
+  return state
 
 def invRijndael(msg, key):
-  state = arrayToState(msg)
-  cipherKey = arrayToState(key)
-  nb = len(state)
-  nk = len(cipherKey)
-  nr = max(nb, nk)+6
-  expandedKey = keyExpansion(cipherKey, nr, nk, nb)
-  state = invFinalRnd(state, expandedKey[nb * nr:nb*(nr + 1)], nr)
+  state = flatState(msg)
+  nb = len(state) / 4
+  nr, _, _, roundKeys, _ = expandKey(key, nb)
+  return invCipher(state, roundKeys, nb, nr)
+
+def invCipher(state, roundKeys, nb, nr):
+  """Decrypts the flat state in place, roundKeys as from expandKey."""
+  loadTables()
+  if RoundHooks: emitRound(nr, 'iinput', state)
+  invFinalRnd(state, roundKeys[nr], nr)
   for i in range(nr-1, 0, -1):
-    subkey = expandedKey[nb * i:nb * (i + 1)]
-    state = invRnd(state, expandedKey[nb * i:nb*(i + 1)], i)
-  state = AddRoundKey(state, expandedKey[0:nb])
-  return stateToArray(state)
+    invRnd(state, roundKeys[i], i)
+  AddRoundKeyFlat(state, roundKeys[0])
+  if RoundHooks: emitRound(0, 'ioutput', state)
+  return state
+
+# T-table backend. SubBytes, ShiftRows and MixColumns of one round are
+# merged into four lookup tables indexed by a state byte. The tables are
+# derived from STable and xtime by loadTables, so they are not MAGIC.
+#
+# Decryption uses the equivalent inverse cipher of Sec 5.3.3 of the
+# Rijndael book: the inverse steps are reordered to the order of
+# encryption, so a round is again four lookups in TInv0..TInv3, which
+# merge SInvTable and InvMixColumns. In exchange InvMixColumns has to be
+# applied to the round keys 1..nr-1 once per key.
+#
+# A column is packed into a 32-bit word with row 0 in the most
+# significant byte.
+
+XTimeTable = bytearray()
+T0, T1, T2, T3 = [], [], [], []
+TInv0, TInv1, TInv2, TInv3 = [], [], [], []
+
+def mulTable(coeff):
+  """Returns coeff * a in GFPOFZ2 for all bytes a.
+
+  coeff * a is the sum of the xtime powers of a selected by the bits of
+  coeff.
+  """
+  res = bytearray(0x100)
+  power = bytearray(range(0, 0x100))
+  while coeff:
+    if coeff & 1:
+      res = bytearray([r ^ p for r, p in zip(res, power)])
+    power = bytearray([XTimeTable[p] for p in power])
+    coeff = coeff >> 1
+  return res
+
+def tTables(sbox, coeffs):
+  """Merges an S-box and the MixColumns coefficients into four tables.
+
+  Table i maps the byte in row i of a column to its contribution to the
+  whole mixed column, so a mixed column is the XOR of four lookups.
+  """
+  muls = [mulTable(c) for c in coeffs]
+  tables = []
+  for i in range(0, 4):
+    m0, m1, m2, m3 = [muls[(i - j) % 4] for j in range(0, 4)]
+    tables.append([(m0[s] << 24) | (m1[s] << 16) | (m2[s] << 8) | m3[s]
+                   for s in sbox])
+  return tables
+
+def shiftRowsIndices(nb, amp):
+  """Column read by ShiftRows for every (column, row 1..3) as tuples."""
+  offsets = ShiftRowsOffsets[nb - 4]
+  return [tuple([j] + [(j + offsets[i] * amp) % nb for i in range(1, 4)])
+          for j in range(0, nb)]
+
+ShiftRowsIndices = dict((nb, shiftRowsIndices(nb, 1)) for nb in range(4, 9))
+InvShiftRowsIndices = dict((nb, shiftRowsIndices(nb, -1)) for nb in range(4, 9))
+
+def bytesToWords(array):
+  """Packs a byte buffer into a list of big-endian column words."""
+  if len(array) % 4 != 0:
+    raise ValueError("length %d is not a multiple of 4" % len(array))
+  return list(struct.unpack(">%dI" % (len(array) / 4), array))
+
+def bufferLength(buf):
+  """Size of a buffer-protocol object in bytes."""
+  return len(buf) * getattr(buf, 'itemsize', 1)
+
+def wordsToBytes(words):
+  return bytearray(struct.pack(">%dI" % len(words), *words))
+
+def tEncrypt(words, roundKeys, nb, nr):
+  """Encrypts a block given as nb words with the T-table backend."""
+  loadTables()
+  indices = ShiftRowsIndices[nb]
+  s = [w ^ k for w, k in zip(words, roundKeys)]
+  for r in range(1, nr):
+    k = r * nb
+    s = [T0[s[j] >> 24] ^ T1[(s[a] >> 16) & 0xff] ^
+         T2[(s[b] >> 8) & 0xff] ^ T3[s[c] & 0xff] ^ roundKeys[k + j]
+         for j, a, b, c in indices]
+  k = nr * nb
+  S = STable
+  return [((S[s[j] >> 24] << 24) | (S[(s[a] >> 16) & 0xff] << 16) |
+           (S[(s[b] >> 8) & 0xff] << 8) | S[s[c] & 0xff]) ^ roundKeys[k + j]
+          for j, a, b, c in indices]
+
+def tRijndael(msg, key):
+  """rijndael() on the T-table backend."""
+  words = bytesToWords(msg)
+  nb = len(words)
+  nr, _, roundKeys, _, _ = expandKey(key, nb)
+  return wordsToBytes(tEncrypt(words, roundKeys, nb, nr))
+
+def invMixColumnsWord(w):
+  """InvMixColumns of one column word.
+
+  TInvi[STable[a]] is the contribution of a in row i, as SInvTable
+  undoes STable.
+  """
+  S = STable
+  return (TInv0[S[w >> 24]] ^ TInv1[S[(w >> 16) & 0xff]] ^
+          TInv2[S[(w >> 8) & 0xff]] ^ TInv3[S[w & 0xff]])
+
+def invRoundKeyWords(roundKeys, nb, nr):
+  """Round keys of the equivalent inverse cipher."""
+  return (roundKeys[:nb] +
+          [invMixColumnsWord(w) for w in roundKeys[nb:nr * nb]] +
+          roundKeys[nr * nb:])
+
+def tDecrypt(words, invRoundKeys, nb, nr):
+  """Decrypts a block given as nb words with the equivalent inverse cipher."""
+  loadTables()
+  indices = InvShiftRowsIndices[nb]
+  s = [w ^ rk for w, rk in zip(words, invRoundKeys[nr * nb:])]
+  for r in range(nr - 1, 0, -1):
+    k = r * nb
+    s = [TInv0[s[j] >> 24] ^ TInv1[(s[a] >> 16) & 0xff] ^
+         TInv2[(s[b] >> 8) & 0xff] ^ TInv3[s[c] & 0xff] ^ invRoundKeys[k + j]
+         for j, a, b, c in indices]
+  S = SInvTable
+  return [((S[s[j] >> 24] << 24) | (S[(s[a] >> 16) & 0xff] << 16) |
+           (S[(s[b] >> 8) & 0xff] << 8) | S[s[c] & 0xff]) ^ invRoundKeys[j]
+          for j, a, b, c in indices]
+
+def tInvRijndael(msg, key):
+  """invRijndael() on the T-table backend."""
+  words = bytesToWords(msg)
+  nb = len(words)
+  nr, _, _, _, invRoundKeys = expandKey(key, nb)
+  return wordsToBytes(tDecrypt(words, invRoundKeys, nb, nr))
+
+# Unrolled T-table functions. For every geometry (nb, nk) the rounds of
+# tEncrypt and tDecrypt are written out as straight-line Python with the
+# ShiftRows columns as constants, compiled once and cached in
+# UnrolledFactories. A factory binds the tables and the round keys of one
+# key to default arguments, the fastest locals, of the function it
+# returns. unrolledSource() shows the generated code,
+# which is also registered with linecache for tracebacks and pdb.
+
+UnrolledFactories = {}
+
+def unrolledRound(out, s, tables, indices, keys):
+  """Source lines of one T-table round from s* into out*."""
+  t0, t1, t2, t3 = tables
+  return ["    %s%d = %s[%s%d >> 24] ^ %s[(%s%d >> 16) & 0xff] ^ "
+          "%s[(%s%d >> 8) & 0xff] ^ %s[%s%d & 0xff] ^ k%d" %
+          (out, j, t0, s, j, t1, s, a, t2, s, b, t3, s, c, keys + j)
+          for j, a, b, c in indices]
+
+def unrolledSource(nb, nk, decrypt=False):
+  """Source of the factory of the unrolled cipher of geometry (nb, nk)."""
+  nr = max(nb, nk) + 6
+  if decrypt:
+    indices = InvShiftRowsIndices[nb]
+    tables = ('TInv0', 'TInv1', 'TInv2', 'TInv3')
+    rounds = range(nr - 1, 0, -1)
+    first, last = nr * nb, 0
+  else:
+    indices = ShiftRowsIndices[nb]
+    tables = ('T0', 'T1', 'T2', 'T3')
+    rounds = range(1, nr)
+    first, last = 0, nr * nb
+  keys = ["k%d" % i for i in range(0, (nr + 1) * nb)]
+  lines = ["def factory(%s, S, roundKeys):" % ", ".join(tables),
+           "  (%s,) = roundKeys" % ", ".join(keys),
+           "  def %s(words, %s):" % (
+             "decrypt" if decrypt else "encrypt",
+             ", ".join(["%s=%s" % (k, k)
+                        for k in list(tables) + ['S'] + keys])),
+           "    %s, = words" % ", ".join(["s%d" % j for j in range(0, nb)])]
+  lines += ["    s%d ^= k%d" % (j, first + j) for j in range(0, nb)]
+  s, out = 's', 't'
+  for r in rounds:
+    lines.append("    # round %d" % r)
+    lines += unrolledRound(out, s, tables, indices, r * nb)
+    s, out = out, s
+  lines.append("    return [")
+  lines += ["      ((S[%s%d >> 24] << 24) | (S[(%s%d >> 16) & 0xff] << 16) | "
+            "(S[(%s%d >> 8) & 0xff] << 8) | S[%s%d & 0xff]) ^ k%d," %
+            (s, j, s, a, s, b, s, c, last + j) for j, a, b, c in indices]
+  lines += ["    ]",
+            "  return %s" % ("decrypt" if decrypt else "encrypt"), ""]
+  return "\n".join(lines)
+
+def unrolledFactory(nb, nk, decrypt=False):
+  """The compiled factory of unrolledSource(nb, nk, decrypt), cached."""
+  cacheKey = (nb, nk, decrypt)
+  factory = UnrolledFactories.get(cacheKey)
+  if factory is None:
+    source = unrolledSource(nb, nk, decrypt)
+    filename = "<aes unrolled %s nb=%d nk=%d>" % (
+      "decrypt" if decrypt else "encrypt", nb, nk)
+    linecache.cache[filename] = (len(source), None,
+                                 source.splitlines(True), filename)
+    namespace = {}
+    exec compile(source, filename, 'exec') in namespace
+    factory = namespace['factory']
+    UnrolledFactories[cacheKey] = factory
+  return factory
+
+def unrolledEncrypt(nb, nk, roundKeys):
+  """tEncrypt for one key, unrolled. roundKeys as from expandKey."""
+  loadTables()
+  return unrolledFactory(nb, nk)(T0, T1, T2, T3, STable, roundKeys)
+
+def unrolledDecrypt(nb, nk, invRoundKeys):
+  """tDecrypt for one key, unrolled."""
+  loadTables()
+  return unrolledFactory(nb, nk, True)(TInv0, TInv1, TInv2, TInv3, SInvTable,
+                                       invRoundKeys)
+
+class Rijndael(object):
+  """Cipher context that expands its key once.
+
+  Encryption and decryption run on the T-table backend, unrolled for the
+  geometry and key of the context.
+  """
+  def __init__(self, key, blockSize=16):
+    if blockSize % 4 or not 4 <= blockSize / 4 <= 8:
+      raise ValueError("unsupported block size %d" % blockSize)
+    if len(key) % 4 or not 4 <= len(key) / 4 <= 8:
+      raise ValueError("unsupported key size %d" % len(key))
+    self.blockSize = blockSize
+    self.nb = blockSize / 4
+    self.nk = len(key) / 4
+    (self.nr, self.expandedKey, self.roundKeys, self.roundKeyBytes,
+     self.invRoundKeys) = expandKey(key, self.nb)
+    self.specialize()
+
+  def specialize(self):
+    """Binds encryptWords and decryptWords to the unrolled functions.
+
+    Both take and return one block as nb column words.
+    """
+    self.encryptWords = unrolledEncrypt(self.nb, self.nk, self.roundKeys)
+    self.decryptWords = unrolledDecrypt(self.nb, self.nk, self.invRoundKeys)
+    # Reads and writes one block as words anywhere in a buffer.
+    self.blockStruct = struct.Struct(">%dI" % self.nb)
+
+  def __getstate__(self):
+    # Generated functions and Structs can't be pickled, the receiver
+    # regenerates them.
+    state = self.__dict__.copy()
+    del state['encryptWords'], state['decryptWords'], state['blockStruct']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    loadTables()
+    self.specialize()
+
+  def checkBlock(self, block):
+    if len(block) != self.blockSize:
+      raise ValueError("block has %d bytes, expected %d" %
+                       (len(block), self.blockSize))
+
+  def checkInto(self, data, out, offset, partial=False):
+    """Size of data in bytes, after checking that it fits into out."""
+    n = bufferLength(data)
+    if n % self.blockSize and not partial:
+      raise ValueError("data length %d is not a multiple of the block size %d"
+                       % (n, self.blockSize))
+    if offset < 0 or offset + n > bufferLength(out):
+      raise ValueError("%d bytes don't fit into %d bytes at offset %d" %
+                       (n, bufferLength(out), offset))
+    return n
+
+  def processInto(self, function, data, out, offset):
+    n = self.checkInto(data, out, offset)
+    unpack, pack = self.blockStruct.unpack_from, self.blockStruct.pack_into
+    for pos in xrange(0, n, self.blockSize):
+      pack(out, offset + pos, *function(unpack(data, pos)))
+    return n
+
+  def encrypt_into(self, data, out, offset=0):
+    """Encrypts every block of data into out from byte offset on.
+
+    data can be any buffer (str, bytearray, memoryview, array.array,
+    mmap) and out any writable one. Blocks are converted one at a time,
+    so out can be data itself for in-place encryption. Returns the number
+    of bytes written.
+    """
+    return self.processInto(self.encryptWords, data, out, offset)
+
+  def decrypt_into(self, data, out, offset=0):
+    """Decrypts every block of data into out, see encrypt_into."""
+    return self.processInto(self.decryptWords, data, out, offset)
+
+  def encrypt_block(self, block):
+    self.checkBlock(block)
+    return wordsToBytes(self.encryptWords(bytesToWords(block)))
+
+  def decrypt_block(self, block):
+    self.checkBlock(block)
+    return wordsToBytes(self.decryptWords(bytesToWords(block)))
+
+# Derived tables. They are computed from f, g and xtime, or read from an
+# on-disk cache written with marshal. Setting AES_TABLE_CACHE to a path
+# moves the cache, setting it to the empty string disables it. With
+# AES_LAZY_TABLES=1 importing this module does not load the tables; every
+# entry point that reads them calls loadTables() and so loads them on
+# first use. The round functions rely on cipher() and invCipher() for
+# that.
+
+TableCachePath = os.environ.get(
+  'AES_TABLE_CACHE',
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aes_tables.cache'))
+LazyTables = os.environ.get('AES_LAZY_TABLES', '') not in ('', '0')
+
+# Name and (in-place) storage of every derived table.
+DerivedTables = [
+  ('STable', STable),
+  ('SInvTable', SInvTable),
+  ('XTimeTable', XTimeTable),
+  ('T0', T0), ('T1', T1), ('T2', T2), ('T3', T3),
+  ('TInv0', TInv0), ('TInv1', TInv1), ('TInv2', TInv2), ('TInv3', TInv3),
+] + [('Mul%02X' % c, MulTables[c]) for c in sorted(MulTables)]
+
+def tableCacheKey():
+  """Everything the derived tables depend on."""
+  return (ReductionPolynomial, AffineMask, AffineConstant, InvAffineMask,
+          InvAffineConstant, tuple(MixColumnsCoeffs),
+          tuple(InvMixColumnsCoeffs),
+          tuple([name for name, _ in DerivedTables]))
+
+def computeTables():
+  with ProfileStage('g'):
+    inverses = gTable()
+  STable[:] = bytearray([f(inverses[i]) for i in range(0, 0x100)])
+  SInvTable[:] = bytearray([inverses[fInv(i)] for i in range(0, 0x100)])
+  with ProfileStage('xtime'):
+    XTimeTable[:] = bytearray([xtime(a) for a in range(0, 0x100)])
+  for c, table in MulTables.items():
+    table[:] = mulTable(c)
+  for table, values in zip((T0, T1, T2, T3),
+                           tTables(STable, MixColumnsCoeffs)):
+    table[:] = values
+  for table, values in zip((TInv0, TInv1, TInv2, TInv3),
+                           tTables(SInvTable, InvMixColumnsCoeffs)):
+    table[:] = values
+
+def readTableCache(path):
+  """Returns the cached tables by name, or None if missing or stale.
+
+  The file holds the cache key, the SHA-256 digest of the marshalled
+  tables and the marshalled tables themselves.
+  """
+  try:
+    with open(path, 'rb') as cacheFile:
+      key, digest, payload = loads(cacheFile.read())
+  except (IOError, OSError, EOFError, ValueError, TypeError):
+    return None
+  if key != tableCacheKey() or hashlib.sha256(payload).hexdigest() != digest:
+    logger.debug("table cache %s is stale" % path)
+    return None
+  return loads(payload)
+
+def writeTableCache(path):
+  """Writes the tables to path through a temporary file.
+
+  The temporary file is named after the process only, so threads must
+  not call this concurrently. loadTables calls it under TablesLock.
+  """
+  payload = dumps(dict((name, bytes(table) if isinstance(table, bytearray)
+                        else list(table)) for name, table in DerivedTables))
+  data = dumps((tableCacheKey(), hashlib.sha256(payload).hexdigest(), payload))
+  tmp = "%s.%d" % (path, os.getpid())
+  try:
+    with open(tmp, 'wb') as cacheFile:
+      cacheFile.write(data)
+    os.rename(tmp, path)
+  except (IOError, OSError) as e:
+    logger.debug("can't write table cache %s: %s" % (path, e))
+
+# TablesLoaded is set once every derived table is filled. Loading runs
+# under TablesLock, so a thread never sees a partly filled set.
+TablesLock = threading.Lock()
+TablesLoaded = False
+
+def loadTables():
+  """Fills the derived tables from the cache or computes them."""
+  global TablesLoaded
+  if TablesLoaded:
+    return
+  with TablesLock:
+    if TablesLoaded:
+      return
+    cached = readTableCache(TableCachePath) if TableCachePath else None
+    if cached is None:
+      computeTables()
+      if TableCachePath:
+        writeTableCache(TableCachePath)
+    else:
+      for name, table in DerivedTables:
+        values = cached[name]
+        if isinstance(table, bytearray):
+          values = bytearray(values)
+        table[:] = values
+    TablesLoaded = True
 
 def arrayToState(array):
   state = []
@@ -273,6 +879,9 @@ def dumpStateHex(state):
   s += "]"
   return s
 
+if not LazyTables:
+  loadTables()
+
 
 if __name__ == '__main__':
   # D.2 Rijndael test vectors
@@ -289,6 +898,7 @@ if __name__ == '__main__':
   ciphertext = bytearray([ 0x39, 0x25, 0x84, 0x1d, 0x02, 0xdc, 0x09, 0xfb,
                            0xdc, 0x11, 0x85, 0x97, 0x19, 0x6a, 0x0b, 0x32])
   logger.setLevel(logging.DEBUG)
+  addRoundHook(traceHook)
 
   enc = rijndael(plaintext, key)
   print "Test vector check: ", enc == ciphertext
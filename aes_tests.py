@@ -1,7 +1,17 @@
 # Test vectors from D.3 of the Rijndael book
 
 import aes
+import contextlib
+import linecache
 import logging
+import marshal
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 tests = [
@@ -61,9 +71,338 @@ class EncryptionTest(unittest.TestCase):
     self.assertEqual(c1, aes.invRijndael(c2_, key))
     self.assertEqual(msg, aes.invRijndael(c1_, key))
 
+class CipherContextTest(unittest.TestCase):
+  def testRoundTrip(self):
+    for keysize, c1, c2 in tests:
+      c1 = parseHex(c1.lower())
+      c2 = parseHex(c2.lower())
+      ctx = aes.Rijndael(bytearray(keysize / 8), len(c1))
+      self.assertEqual(c1, ctx.encrypt_block(bytearray(len(c1))))
+      self.assertEqual(c2, ctx.encrypt_block(c1))
+      self.assertEqual(c1, ctx.decrypt_block(c2))
+
+  def testWrongBlockSize(self):
+    ctx = aes.Rijndael(bytearray(16))
+    self.assertRaises(ValueError, ctx.encrypt_block, bytearray(20))
+    self.assertRaises(ValueError, aes.Rijndael, bytearray(12))
+
+  def testKeyExpansionCache(self):
+    aes.KeyExpansionCache.clear()
+    key = bytearray(range(16))
+    msg = bytearray(16)
+    aes.tRijndael(msg, key)
+    aes.tRijndael(msg, key)
+    aes.Rijndael(key)
+    self.assertEqual(1, aes.KeyExpansionCache.misses)
+    self.assertEqual(2, aes.KeyExpansionCache.hits)
+
+def unloadTables():
+  """Puts the tables into the state of AES_LAZY_TABLES=1 after import."""
+  for name, table in aes.DerivedTables:
+    del table[:]
+  aes.TablesLoaded = False
+
+@contextlib.contextmanager
+def unloadedTables(cachePath):
+  """Unloads the tables, which then load from cachePath."""
+  saved = [(table, table[:]) for name, table in aes.DerivedTables]
+  savedPath = aes.TableCachePath
+  aes.TableCachePath = cachePath
+  unloadTables()
+  try:
+    yield
+  finally:
+    aes.TableCachePath = savedPath
+    for table, values in saved:
+      table[:] = values
+    aes.TablesLoaded = True
+
+class TableCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'tables')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testRoundTrip(self):
+    self.assertEqual(None, aes.readTableCache(self.path))
+    aes.writeTableCache(self.path)
+    cached = aes.readTableCache(self.path)
+    for name, table in aes.DerivedTables:
+      self.assertEqual(list(table), list(bytearray(cached[name]))
+                       if isinstance(table, bytearray) else cached[name])
+
+  def testIntegrityCheck(self):
+    aes.writeTableCache(self.path)
+    with open(self.path, 'rb') as f:
+      key, digest, payload = marshal.loads(f.read())
+    with open(self.path, 'wb') as f:
+      f.write(marshal.dumps((key, digest, payload[:-1] + chr(ord(payload[-1]) ^ 1))))
+    self.assertEqual(None, aes.readTableCache(self.path))
+    with open(self.path, 'wb') as f:
+      f.write(marshal.dumps((key[1:], digest, payload)))
+    self.assertEqual(None, aes.readTableCache(self.path))
+    with open(self.path, 'wb') as f:
+      f.write('garbage')
+    self.assertEqual(None, aes.readTableCache(self.path))
+
+  def testLoadOnFirstUse(self):
+    key = bytearray(range(16))
+    msg = bytearray(range(16, 32))
+    nr, _, roundKeys, flatKeys, invRoundKeys = aes.expandKey(key, 4)
+    words = aes.bytesToWords(msg)
+    state = aes.arrayToState(msg)
+    calls = [
+      lambda: aes.SR(0x53),
+      lambda: aes.SRInv(0xed),
+      lambda: aes.SubBytes(state, aes.SR),
+      lambda: aes.keyExpansion(aes.arrayToState(key), nr, 4, 4),
+      lambda: aes.cipher(bytearray(msg), flatKeys, 4, nr),
+      lambda: aes.invCipher(bytearray(msg), flatKeys, 4, nr),
+      lambda: aes.tEncrypt(words, roundKeys, 4, nr),
+      lambda: aes.tDecrypt(words, invRoundKeys, 4, nr),
+      lambda: aes.unrolledEncrypt(4, 4, roundKeys)(words),
+      lambda: aes.unrolledDecrypt(4, 4, invRoundKeys)(words),
+    ]
+    expected = [call() for call in calls]
+    aes.writeTableCache(self.path)
+    with unloadedTables(self.path):
+      for call, result in zip(calls, expected):
+        self.assertEqual(result, call())
+        unloadTables()
+
+  def testLoadFromThreads(self):
+    roundKeys = aes.expandKey(bytearray(16), 4)[2]
+    expected = aes.tEncrypt([0, 0, 0, 0], roundKeys, 4, 10)
+    results = []
+    def encrypt(delay):
+      time.sleep(delay)
+      try:
+        results.append(aes.tEncrypt([0, 0, 0, 0], roundKeys, 4, 10))
+      except Exception as e:
+        results.append(e)
+    # STable is filled before the T-tables. Slowing down the T-tables
+    # makes sure that threads arrive in between.
+    tTables = aes.tTables
+    def slowTTables(sbox, coeffs):
+      time.sleep(0.02)
+      return tTables(sbox, coeffs)
+    aes.tTables = slowTTables
+    try:
+      with unloadedTables(''):
+        threads = [threading.Thread(target=encrypt, args=(0.01 * i,))
+                   for i in range(0, 8)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+    finally:
+      aes.tTables = tTables
+    self.assertEqual([expected] * 8, results)
+
+  def testTablesMatchDefinition(self):
+    for i in range(0, 0x100):
+      self.assertEqual(aes.f(aes.g(i)), aes.STable[i])
+      self.assertEqual(aes.g(aes.fInv(i)), aes.SInvTable[i])
+      self.assertEqual(aes.xtime(i), aes.XTimeTable[i])
+
+class RoundHookTest(unittest.TestCase):
+  # Appendix D.2 of the Rijndael book
+  key = parseHex("2b7e151628aed2a6abf7158809cf4f3c")
+  msg = parseHex("3243f6a8885a308d313198a2e0370734")
+
+  def tearDown(self):
+    del aes.RoundHooks[:]
+
+  def testCapture(self):
+    capture = aes.addRoundHook(aes.CaptureHook())
+    aes.rijndael(self.msg, self.key)
+    self.assertEqual(parseHex("d42711aee0bf98f1b8b45de51e415230"),
+                     capture.get(1, 's_box'))
+    self.assertEqual(parseHex("046681e5e0cb199a48f8d37a2806264c"),
+                     capture.get(1, 'm_col'))
+    self.assertEqual(parseHex("a0fafe1788542cb123a339392a6c7605"),
+                     capture.get(1, 'k_sch'))
+    self.assertEqual(parseHex("3925841d02dc09fbdc118597196a0b32"),
+                     capture.get(10, 'output'))
+    aes.removeRoundHook(capture)
+    aes.rijndael(self.msg, self.key)
+    self.assertEqual(2 + 9 * 5 + 4 + 1, len(capture.trace))
+
+  def testTiming(self):
+    timing = aes.addRoundHook(aes.TimingHook())
+    aes.invRijndael(aes.rijndael(self.msg, self.key), self.key)
+    report = timing.report()
+    self.assertEqual(9, report['m_col']['calls'])
+    self.assertEqual(9, report['im_col']['calls'])
+    self.assertEqual(11, report['k_sch']['calls'])
+    self.assertFalse('input' in report)
+
+class FlatStateTest(unittest.TestCase):
+  def testMatchesBookSteps(self):
+    for nb in range(4, 9):
+      msg = bytearray(range(7, 7 + 4 * nb))
+      state = aes.arrayToState(msg)
+      for amp in (1, -1):
+        flat = bytearray(msg)
+        aes.ShiftRowsFlat(flat, amp)
+        self.assertEqual(aes.stateToArray(aes.ShiftRows(state, amp)), flat)
+      for coeffs, muls in ((aes.MixColumnsCoeffs, aes.MixColumnsMuls),
+                           (aes.InvMixColumnsCoeffs, aes.InvMixColumnsMuls)):
+        flat = bytearray(msg)
+        aes.MixColumnsFlat(flat, muls)
+        self.assertEqual(aes.stateToArray(aes.MixColumns(state, coeffs)), flat)
+      flat = bytearray(msg)
+      aes.SubBytesFlat(flat, aes.STable)
+      self.assertEqual(aes.stateToArray(aes.SubBytes(state, aes.SR)), flat)
+
+  def testNoAllocations(self):
+    nr, _, _, roundKeys, _ = aes.expandKey(bytearray(32), 8)
+    state = bytearray(32)
+    def rounds():
+      same = True
+      for i in range(1, nr):
+        same = aes.rnd(state, roundKeys[i], i) is state and same
+        same = aes.invRnd(state, roundKeys[i], i) is state and same
+      return same
+    # Every function the round functions call, and every bytearray,
+    # list, dict, tuple or set they construct. Calls of types don't reach
+    # the profiler, so module globals shadowing them count those.
+    calls = set()
+    created = []
+    def profile(frame, event, arg):
+      if event == 'call':
+        caller, name = frame.f_back, frame.f_code.co_name
+      elif event == 'c_call':
+        caller, name = frame, arg.__name__
+      else:
+        return
+      if caller is not None and caller.f_globals is aes.__dict__:
+        calls.add(name)
+    def counting(constructor):
+      def construct(*args):
+        created.append(constructor.__name__)
+        return constructor(*args)
+      return construct
+    constructors = (bytearray, list, dict, tuple, set)
+    for constructor in constructors:
+      setattr(aes, constructor.__name__, counting(constructor))
+    sys.setprofile(profile)
+    try:
+      same = rounds()
+    finally:
+      sys.setprofile(None)
+      for constructor in constructors:
+        delattr(aes, constructor.__name__)
+    self.assertTrue(same)
+    self.assertEqual([], created)
+    self.assertEqual(set(['SubBytesFlat', 'ShiftRowsFlat', 'MixColumnsFlat',
+                          'AddRoundKeyFlat', 'len']), calls)
+    self.assertEqual(bytearray(32), state)
+
+class FieldProfileTest(unittest.TestCase):
+  def testStages(self):
+    state = aes.arrayToState(bytearray(range(16)))
+    with aes.FieldProfiler() as profiler:
+      aes.computeTables()
+      aes.MixColumns(state, aes.MixColumnsCoeffs)
+    stages = {}
+    for r in profiler.report()['calls']:
+      stages.setdefault(r['stage'], set()).add(r['operation'])
+    self.assertTrue('GFPOFElement.mulInv' in stages['g'])
+    self.assertTrue('GFPOFElement.xtime' in stages['xtime'])
+    self.assertTrue('GFPOF.mul' in stages['m_col'])
+    # The flat rounds only look up tables.
+    with aes.FieldProfiler() as profiler:
+      aes.rijndael(bytearray(16), bytearray(16))
+    self.assertEqual({}, profiler.totals())
+
+  def testFirstCipher(self):
+    # The first cipher computes the tables, inverting every byte.
+    with unloadedTables(''):
+      with aes.FieldProfiler() as profiler:
+        aes.Rijndael(bytearray(16)).encrypt_block(bytearray(16))
+    inversions = {}
+    for r in profiler.report()['calls']:
+      if r['operation'].endswith('ulInv'):
+        inversions[r['stage'], r['operation']] = r['calls']
+    self.assertEqual({('g', 'GFPOF.batchMulInv'): 1,
+                      ('g', 'GFPOFElement.mulInv'): 255}, inversions)
+
+class TTableTest(unittest.TestCase):
+  def testVectors(self):
+    for keysize, c1, c2 in tests:
+      c1 = parseHex(c1.lower())
+      c2 = parseHex(c2.lower())
+      key = bytearray(keysize / 8)
+      self.assertEqual(c1, aes.tRijndael(bytearray(len(c1)), key))
+      self.assertEqual(c2, aes.tRijndael(c1, key))
+
+  def testMatchesRijndael(self):
+    key = bytearray(range(24))
+    msg = bytearray(range(100, 132))
+    self.assertEqual(aes.rijndael(msg, key), aes.tRijndael(msg, key))
+
+  def testInverseVectors(self):
+    for keysize, c1, c2 in tests:
+      c1 = parseHex(c1.lower())
+      c2 = parseHex(c2.lower())
+      key = bytearray(keysize / 8)
+      self.assertEqual(c1, aes.tInvRijndael(c2, key))
+      self.assertEqual(bytearray(len(c1)), aes.tInvRijndael(c1, key))
+
+  def testInverseMatchesInvRijndael(self):
+    for nb in range(4, 9):
+      for nk in range(4, 9):
+        key = bytearray(range(nk * 4))
+        msg = bytearray(range(50, 50 + nb * 4))
+        self.assertEqual(aes.invRijndael(msg, key), aes.tInvRijndael(msg, key))
+
+  def testInvRoundKeys(self):
+    nr, _, words, roundKeys, invWords = aes.expandKey(bytearray(16), 4)
+    self.assertEqual(words[:4] + words[40:], invWords[:4] + invWords[40:])
+    for r in range(1, nr):
+      state = aes.arrayToState(roundKeys[r])
+      self.assertEqual(aes.bytesToWords(aes.stateToArray(
+        aes.MixColumns(state, aes.InvMixColumnsCoeffs))),
+                       invWords[4 * r:4 * (r + 1)])
+
+  def testUnrolledMatchesTTables(self):
+    for nb in range(4, 9):
+      for nk in range(4, 9):
+        nr, _, words, _, invWords = aes.expandKey(bytearray(range(nk * 4)), nb)
+        msg = range(0x01020304, 0x01020304 + nb)
+        encrypted = aes.tEncrypt(msg, words, nb, nr)
+        self.assertEqual(encrypted, aes.unrolledEncrypt(nb, nk, words)(msg))
+        self.assertEqual(msg, aes.unrolledDecrypt(nb, nk, invWords)(encrypted))
+    self.assertTrue((8, 8, True) in aes.UnrolledFactories)
+
+  def testUnrolledSource(self):
+    source = aes.unrolledSource(4, 4)
+    self.assertEqual(9, source.count("# round"))
+    self.assertTrue("^ k43," in source)
+    # Tracebacks and pdb find the generated lines.
+    aes.unrolledFactory(4, 4)
+    self.assertEqual(source.splitlines(True),
+                     linecache.getlines("<aes unrolled encrypt nb=4 nk=4>"))
+
+  def testPickledContext(self):
+    ctx = aes.Rijndael(bytearray(range(16)), 24)
+    copy = pickle.loads(pickle.dumps(ctx, pickle.HIGHEST_PROTOCOL))
+    msg = bytearray(range(24))
+    self.assertEqual(ctx.encrypt_block(msg), copy.encrypt_block(msg))
+    self.assertEqual(msg, copy.decrypt_block(ctx.encrypt_block(msg)))
+
 if __name__ == '__main__':
   ts = unittest.TestSuite()
   for t in tests:
     ts.addTest(EncryptionTest(t[0] / 8, parseHex(t[1].lower()), parseHex(t[2].lower())))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TTableTest))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(CipherContextTest))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TableCacheTest))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(RoundHookTest))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(FlatStateTest))
+  ts.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(FieldProfileTest))
   runner = unittest.TextTestRunner()
   runner.run(ts)
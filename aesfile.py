@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Streaming file encryption.
+#
+#   aesfile.py encrypt -k 000102...0f -i plain.bin -o cipher.bin
+#   cat cipher.bin | aesfile.py decrypt -k 000102...0f > plain.bin
+#
+# Regular input files are memory-mapped, pipes are read with read(). Both
+# are cut into fixed-size chunks that flow through a generator pipeline
+# and are written as soon as they are ready, so memory use does not depend
+# on the file size. The output starts with a random IV (CBC) or initial
+# counter block (CTR) of one block.
+
+from aes import Rijndael
+from modes import readExactly
+import modes
+import argparse
+import mmap
+import os
+import sys
+import time
+
+DefaultChunkSize = 1 << 16
+
+# Key and block sizes of Rijndael in bytes.
+Sizes = range(16, 33, 4)
+
+def fileChunks(f, chunkSize):
+  while True:
+    chunk = readExactly(f, chunkSize)
+    if not chunk:
+      return
+    yield chunk
+
+def mmapChunks(m, offset, chunkSize):
+  for start in range(offset, len(m), chunkSize):
+    yield m[start:start + chunkSize]
+
+def openInput(path):
+  """Returns (file, mmap) for path; '-' is stdin, mmap is None for pipes."""
+  if path == '-':
+    return sys.stdin, None
+  f = open(path, 'rb')
+  try:
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except (ValueError, mmap.error):
+    # Empty files and special files can't be mapped.
+    m = None
+  return f, m
+
+def inputChunks(f, m, offset, chunkSize):
+  if m is not None:
+    return mmapChunks(m, offset, chunkSize)
+  return fileChunks(f, chunkSize)
+
+def ctrChunks(cipher, chunks, iv, engine):
+  index = 0
+  for chunk in chunks:
+    yield modes.ctr(cipher, chunk,
+                    modes.counterAt(iv, index, cipher.blockSize), engine)
+    index += len(chunk) / cipher.blockSize
+
+def cbcEncryptChunks(cipher, chunks, iv):
+  # The last chunk is held back until the end is known, as it gets padded.
+  pending = ''
+  for chunk in chunks:
+    if pending:
+      out = modes.encrypt_blocks(cipher, pending, modes.CBC, iv)
+      iv = out[-cipher.blockSize:]
+      yield out
+    pending = chunk
+  yield modes.encrypt_blocks(cipher, pending, modes.CBC, iv, padding=True)
+
+def cbcDecryptChunks(cipher, chunks, iv):
+  pending = ''
+  for chunk in chunks:
+    if pending:
+      yield modes.decrypt_blocks(cipher, pending, modes.CBC, iv)
+      iv = pending[-cipher.blockSize:]
+    pending = chunk
+  yield modes.decrypt_blocks(cipher, pending, modes.CBC, iv, padding=True)
+
+def process(cipher, decrypt, mode, infile, outfile, chunkSize=DefaultChunkSize,
+            engine=modes.TTABLE):
+  """Encrypts or decrypts infile to outfile and returns the bytes written."""
+  blockSize = cipher.blockSize
+  if mode == modes.CBC and engine != modes.TTABLE:
+    raise ValueError("the %s engine supports CTR only" % engine)
+  if chunkSize < blockSize:
+    raise ValueError("chunk size %d is smaller than a block" % chunkSize)
+  chunkSize -= chunkSize % blockSize
+  f, m = openInput(infile)
+  out = sys.stdout if outfile == '-' else open(outfile, 'wb')
+  try:
+    if decrypt:
+      iv = m[:blockSize] if m is not None else readExactly(f, blockSize)
+      if len(iv) != blockSize:
+        raise ValueError("input is too short to hold the IV")
+      chunks = inputChunks(f, m, blockSize, chunkSize)
+    else:
+      iv = os.urandom(blockSize)
+      out.write(iv)
+      chunks = inputChunks(f, m, 0, chunkSize)
+    if mode == modes.CTR:
+      chunks = ctrChunks(cipher, chunks, iv, engine)
+    elif decrypt:
+      chunks = cbcDecryptChunks(cipher, chunks, iv)
+    else:
+      chunks = cbcEncryptChunks(cipher, chunks, iv)
+    written = 0 if decrypt else blockSize
+    for chunk in chunks:
+      out.write(bytes(chunk))
+      written += len(chunk)
+    out.flush()
+    return written
+  finally:
+    if m is not None:
+      m.close()
+    if f is not sys.stdin:
+      f.close()
+    if out is not sys.stdout:
+      out.close()
+
+def parseArgs(argv):
+  parser = argparse.ArgumentParser(
+    description="Encrypt or decrypt a file or stream with Rijndael.")
+  parser.add_argument('command', choices=['encrypt', 'decrypt'])
+  keys = parser.add_mutually_exclusive_group(required=True)
+  keys.add_argument('-k', '--key', help="key as hex string")
+  keys.add_argument('--key-file', help="file holding the raw key bytes")
+  parser.add_argument('-i', '--input', default='-',
+                      help="input file, '-' for stdin (default)")
+  parser.add_argument('-o', '--output', default='-',
+                      help="output file, '-' for stdout (default)")
+  parser.add_argument('-m', '--mode', choices=[modes.CTR, modes.CBC],
+                      default=modes.CTR)
+  parser.add_argument('-b', '--block-size', type=int, default=16)
+  parser.add_argument('-c', '--chunk-size', type=int, default=DefaultChunkSize)
+  parser.add_argument('-e', '--engine',
+                      choices=[modes.TTABLE, modes.NUMPY, modes.BITSLICE],
+                      default=modes.TTABLE)
+  parser.add_argument('-s', '--stats', action='store_true',
+                      help="report throughput on stderr")
+  args = parser.parse_args(argv)
+  if args.mode == modes.CBC and args.engine != modes.TTABLE:
+    parser.error("the %s engine supports CTR only" % args.engine)
+  if args.block_size not in Sizes:
+    parser.error("block size must be one of %s bytes, got %d" %
+                 (", ".join(map(str, Sizes)), args.block_size))
+  # args.key becomes the key bytes, from --key or --key-file.
+  if args.key is not None:
+    try:
+      args.key = bytearray(args.key.decode('hex'))
+    except TypeError:
+      parser.error("key %r is not a hex string" % args.key)
+  else:
+    try:
+      with open(args.key_file, 'rb') as keyFile:
+        args.key = bytearray(keyFile.read())
+    except IOError as e:
+      parser.error("can't read key file: %s" % e)
+  if len(args.key) not in Sizes:
+    parser.error("key must be one of %s bytes, got %d" %
+                 (", ".join(map(str, Sizes)), len(args.key)))
+  return args
+
+def main(argv=None):
+  args = parseArgs(argv)
+  cipher = Rijndael(args.key, args.block_size)
+  start = time.time()
+  written = process(cipher, args.command == 'decrypt', args.mode, args.input,
+                    args.output, args.chunk_size, args.engine)
+  elapsed = time.time() - start
+  if args.stats:
+    sys.stderr.write("%d bytes in %.3f s, %.3f MB/s\n" %
+                     (written, elapsed, written / max(elapsed, 1e-9) / 1e6))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,77 @@
+import aesfile
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+key = "000102030405060708090a0b0c0d0e0f"
+
+class AESFileTests(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def path(self, name):
+    return os.path.join(self.dir, name)
+
+  def roundTrip(self, data, *options):
+    with open(self.path('plain'), 'wb') as f:
+      f.write(data)
+    aesfile.main(['encrypt', '-k', key, '-i', self.path('plain'),
+                  '-o', self.path('cipher')] + list(options))
+    aesfile.main(['decrypt', '-k', key, '-i', self.path('cipher'),
+                  '-o', self.path('decrypted')] + list(options))
+    with open(self.path('decrypted'), 'rb') as f:
+      return f.read()
+
+  def test_ctr_file(self):
+    data = os.urandom(1000)
+    self.assertEqual(data, self.roundTrip(data, '-c', '64'))
+    self.assertEqual(1016, os.path.getsize(self.path('cipher')))
+
+  def test_cbc_file(self):
+    data = os.urandom(40)
+    self.assertEqual(data, self.roundTrip(data, '-m', 'CBC', '-c', '16'))
+    self.assertEqual(64, os.path.getsize(self.path('cipher')))
+
+  def test_cbc_needs_ttable(self):
+    with open(self.path('plain'), 'wb') as f:
+      f.write(os.urandom(32))
+    for engine in ('numpy', 'bitslice'):
+      self.assertRaises(ValueError, aesfile.process,
+                        aesfile.Rijndael(bytearray(16)), False, 'CBC',
+                        self.path('plain'), self.path('cipher'),
+                        engine=engine)
+      self.assertFalse(os.path.exists(self.path('cipher')))
+      self.assertRaises(SystemExit, aesfile.parseArgs,
+                        ['encrypt', '-k', key, '-m', 'CBC', '-e', engine])
+
+  def test_bad_arguments(self):
+    for options in (['-k', 'xyz'], ['-k', key[:-1]], ['-k', key[:-2]],
+                    ['--key-file', self.path('missing')],
+                    ['-k', key, '-b', '18'], ['-k', key, '-b', '36']):
+      self.assertRaises(SystemExit, aesfile.parseArgs, ['encrypt'] + options)
+    self.assertEqual(bytearray(key.decode('hex')),
+                     aesfile.parseArgs(['encrypt', '-k', key]).key)
+
+  def test_empty_file(self):
+    self.assertEqual('', self.roundTrip(''))
+
+  def test_pipe(self):
+    data = os.urandom(300)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'aesfile.py')
+    enc = subprocess.Popen([sys.executable, script, 'encrypt', '-k', key],
+                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    ciphertext = enc.communicate(data)[0]
+    dec = subprocess.Popen([sys.executable, script, 'decrypt', '-k', key],
+                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    self.assertEqual(data, dec.communicate(ciphertext)[0])
+
+if __name__ == '__main__':
+    unittest.main()
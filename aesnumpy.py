@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Vectorized Rijndael engine on numpy.
+#
+# N blocks are held as an (N, Nb, 4) uint8 array, so state[n][j] is column
+# j of block n just like in arrayToState. Every round step is a handful of
+# array operations, independent of N:
+#
+#   SubBytes     gather through STable
+#   ShiftRows    fancy-index permutation derived from ShiftRowsOffsets
+#   MixColumns   xtime gathers and XOR
+#   AddRoundKey  broadcast XOR of an (Nb, 4) round key
+#
+# MultiKeyEngine encrypts block n under key n. The key schedules of all
+# keys are expanded together, one column of all schedules per step, and
+# AddRoundKey XORs an (N, Nb, 4) array of round keys instead.
+
+from aes import STable, SInvTable, XTimeTable, ShiftRowsOffsets, \
+  MixColumnsCoeffs, InvMixColumnsCoeffs, RC, keyExpansion, arrayToState, \
+  loadTables
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def shiftRowsIndex(nb, amp):
+  """Column and row index arrays that implement ShiftRows as state[:, c, r]."""
+  offsets = ShiftRowsOffsets[nb - 4]
+  cols = numpy.array([[(j + offsets[i] * amp) % nb for i in range(0, 4)]
+                      for j in range(0, nb)])
+  rows = numpy.array([range(0, 4)] * nb)
+  return cols, rows
+
+class NumpyEngine(object):
+  """Encrypts and decrypts many blocks at once under one Rijndael context."""
+  def __init__(self, cipher):
+    self.initTables(cipher.nb)
+    self.nr = cipher.nr
+    self.roundKeys = numpy.array(
+      [list(c) for c in cipher.expandedKey], dtype=numpy.uint8).reshape(
+        self.nr + 1, self.nb, 4)
+
+  def initTables(self, nb):
+    if numpy is None:
+      raise RuntimeError("the numpy engine needs numpy to be installed")
+    self.nb = nb
+    self.blockSize = 4 * nb
+    self.sbox = numpy.frombuffer(bytes(STable), dtype=numpy.uint8)
+    self.sboxInv = numpy.frombuffer(bytes(SInvTable), dtype=numpy.uint8)
+    self.xtime = numpy.frombuffer(bytes(XTimeTable), dtype=numpy.uint8)
+    self.shift = shiftRowsIndex(self.nb, 1)
+    self.invShift = shiftRowsIndex(self.nb, -1)
+
+  def mixColumns(self, state, coeffs):
+    # powers[k][:, :, i] is row i multiplied by x^k.
+    powers = [state]
+    for k in range(1, max(coeffs).bit_length()):
+      powers.append(self.xtime[powers[-1]])
+    out = numpy.zeros_like(state)
+    for j in range(0, 4):
+      acc = out[:, :, j]
+      for i in range(0, 4):
+        c = coeffs[(i - j) % 4]
+        k = 0
+        while c:
+          if c & 1:
+            acc ^= powers[k][:, :, i]
+          c = c >> 1
+          k += 1
+    return out
+
+  def encrypt(self, blocks, roundKeys=None):
+    """Encrypts an (N, Nb, 4) uint8 array of blocks.
+
+    roundKeys[r] is the round key r of every block, an (Nb, 4) or
+    (N, Nb, 4) array. It defaults to the round keys of the context.
+    """
+    cols, rows = self.shift
+    rk = self.roundKeys if roundKeys is None else roundKeys
+    nr = len(rk) - 1
+    state = blocks ^ rk[0]
+    for r in range(1, nr):
+      state = self.sbox[state][:, cols, rows]
+      state = self.mixColumns(state, MixColumnsCoeffs)
+      state ^= rk[r]
+    state = self.sbox[state][:, cols, rows]
+    state ^= rk[nr]
+    return state
+
+  def decrypt(self, blocks, roundKeys=None):
+    """Decrypts an (N, Nb, 4) uint8 array of blocks, see encrypt."""
+    cols, rows = self.invShift
+    rk = self.roundKeys if roundKeys is None else roundKeys
+    nr = len(rk) - 1
+    state = blocks ^ rk[nr]
+    state = self.sboxInv[state[:, cols, rows]]
+    for r in range(nr - 1, 0, -1):
+      state ^= rk[r]
+      state = self.mixColumns(state, InvMixColumnsCoeffs)
+      state = self.sboxInv[state[:, cols, rows]]
+    state ^= rk[0]
+    return state
+
+  def toBlocks(self, data):
+    return numpy.frombuffer(bytes(data), dtype=numpy.uint8).reshape(
+      -1, self.nb, 4)
+
+  def counterBlocks(self, iv, count):
+    """count consecutive big-endian counter blocks starting at iv."""
+    start = int(bytes(iv).encode('hex'), 16)
+    low = numpy.uint64(start & 0xFFFFFFFFFFFFFFFF)
+    lows = low + numpy.arange(count, dtype=numpy.uint64)
+    # A wrap of the low 64 bits carries into the high part of the counter.
+    carry = (lows < low).astype(numpy.intp)
+    highBits = 8 * (self.blockSize - 8)
+    high = start >> 64
+    highs = numpy.array(
+      [bytearray(('%0*x' % (2 * (self.blockSize - 8),
+                            (high + c) % (1 << highBits))).decode('hex'))
+       for c in (0, 1)], dtype=numpy.uint8)
+    blocks = numpy.empty((count, self.blockSize), dtype=numpy.uint8)
+    blocks[:, :-8] = highs[carry]
+    blocks[:, -8:] = lows.astype('>u8').view(numpy.uint8).reshape(count, 8)
+    return blocks.reshape(count, self.nb, 4)
+
+  def ctr(self, data, iv):
+    """XORs data with the CTR keystream that starts at counter block iv."""
+    count = (len(data) + self.blockSize - 1) / self.blockSize
+    keystream = self.encrypt(self.counterBlocks(iv, count)).reshape(-1)
+    data = numpy.frombuffer(bytes(data), dtype=numpy.uint8)
+    return bytearray((data ^ keystream[:len(data)]).tobytes())
+
+
+class MultiKeyEngine(NumpyEngine):
+  """Encrypts and decrypts block n under key n for many pairs at once."""
+  def __init__(self, blockSize=16):
+    if blockSize % 4 or not 4 <= blockSize / 4 <= 8:
+      raise ValueError("unsupported block size %d" % blockSize)
+    loadTables()
+    self.initTables(blockSize / 4)
+
+  def expandKeys(self, keys):
+    """Round keys of an (N, 4 * Nk) uint8 array of keys.
+
+    Returns an (Nr + 1, N, Nb, 4) array, indexed like the round keys of
+    NumpyEngine. Each step computes one column of all N schedules as in
+    keyExpansion.
+    """
+    n, size = keys.shape
+    nk = size / 4
+    if size % 4 or not 4 <= nk <= 8:
+      raise ValueError("unsupported key size %d" % size)
+    nb = self.nb
+    nr = max(nb, nk) + 6
+    columns = numpy.empty((nb * (nr + 1), n, 4), dtype=numpy.uint8)
+    columns[:nk] = keys.reshape(n, nk, 4).transpose(1, 0, 2)
+    sbox = self.sbox
+    rotated = [1, 2, 3, 0]
+    for j in range(nk, nb * (nr + 1)):
+      if j % nk == 0:
+        t = sbox[columns[j - 1][:, rotated]]
+        t[:, 0] ^= RC(j / nk)
+        numpy.bitwise_xor(columns[j - nk], t, columns[j])
+      elif j % nk == 4 and nk > 6:
+        numpy.bitwise_xor(columns[j - nk], sbox[columns[j - 1]], columns[j])
+      else:
+        numpy.bitwise_xor(columns[j - nk], columns[j - 1], columns[j])
+    return columns.reshape(nr + 1, nb, n, 4).transpose(0, 2, 1, 3)
+
+  def run(self, keys, blocks, decrypt):
+    if len(keys) != len(blocks):
+      raise ValueError("%d keys but %d blocks" % (len(keys), len(blocks)))
+    blockSize = self.blockSize
+    data = ''.join([bytes(b) for b in blocks])
+    if len(data) != blockSize * len(blocks):
+      raise ValueError("all blocks must have %d bytes" % blockSize)
+    state = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+      -1, self.nb, 4)
+    out = numpy.empty_like(state)
+    # Keys of different sizes have schedules of different lengths, so
+    # every key size is a batch of its own.
+    groups = {}
+    for i, key in enumerate(keys):
+      groups.setdefault(len(key), []).append(i)
+    for size, indices in groups.items():
+      group = numpy.frombuffer(''.join([bytes(keys[i]) for i in indices]),
+                               dtype=numpy.uint8).reshape(-1, size)
+      roundKeys = self.expandKeys(group)
+      if decrypt:
+        out[indices] = self.decrypt(state[indices], roundKeys)
+      else:
+        out[indices] = self.encrypt(state[indices], roundKeys)
+    flat = out.tobytes()
+    return [bytearray(flat[i:i + blockSize])
+            for i in range(0, len(flat), blockSize)]
+
+  def encrypt_blocks(self, keys, blocks):
+    """Encrypts blocks[i] under keys[i], returns the results in order."""
+    return self.run(keys, blocks, False)
+
+  def decrypt_blocks(self, keys, blocks):
+    """Decrypts blocks[i] under keys[i], returns the results in order."""
+    return self.run(keys, blocks, True)
+
+def keyExpansionReport(nb, nk, counts):
+  """Key expansions per second of keyExpansion and of expandKeys."""
+  engine = MultiKeyEngine(4 * nb)
+  nr = max(nb, nk) + 6
+  report = []
+  for count in counts:
+    keys = numpy.random.randint(0, 256, (count, 4 * nk)).astype(numpy.uint8)
+    start = time.time()
+    for key in keys[:min(count, 64)]:
+      keyExpansion(arrayToState(bytearray(key.tobytes())), nr, nk, nb)
+    scalar = min(count, 64) / (time.time() - start)
+    start = time.time()
+    engine.expandKeys(keys)
+    report.append({'keys': count, 'keyExpansion/s': scalar,
+                   'expandKeys/s': count / (time.time() - start)})
+  return report
+
+
+if __name__ == '__main__':
+  for r in keyExpansionReport(4, 4, [1, 16, 256, 4096, 65536]):
+    print "%(keys)6d keys: keyExpansion %(keyExpansion/s)9.0f/s, " \
+      "expandKeys %(expandKeys/s)9.0f/s" % r
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Streaming CTR encryption off the calling thread.
+#
+# A reader is cut into chunks that are encrypted on a thread or process
+# pool while the caller keeps reading and writing. At most maxInFlight
+# chunks are submitted and not yet written, which caps memory use. The
+# writer is flushed after every chunk, so a slow consumer blocks the
+# pipeline instead of letting output pile up.
+#
+# Encryption holds the GIL, so a thread pool keeps the rest of the
+# process from running for up to one chunk at a time; a process pool
+# does not. LatencyMonitor measures that stall, the latency an event
+# loop in the same process would see, to tune the chunk size.
+
+from modes import readExactly
+import modes
+import parallel
+import collections
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import time
+
+DefaultChunkSize = 1 << 14
+
+THREAD = 'thread'
+PROCESS = 'process'
+
+class LatencyMonitor(object):
+  """Records how late a thread that sleeps for interval wakes up."""
+  def __init__(self, interval=0.005):
+    self.interval = interval
+    self.delays = []
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def run(self):
+    while not self.stopped.is_set():
+      start = time.time()
+      time.sleep(self.interval)
+      self.delays.append(time.time() - start - self.interval)
+
+  def report(self):
+    """Number of samples and mean, 99th percentile and max delay in s."""
+    delays = sorted(self.delays)
+    if not delays:
+      return {'samples': 0, 'mean': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {'samples': len(delays), 'mean': sum(delays) / len(delays),
+            'p99': delays[int(0.99 * (len(delays) - 1))], 'max': delays[-1]}
+
+  def __enter__(self):
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.stopped.set()
+    self.thread.join()
+
+
+class StreamCipher(object):
+  """CTR encryption of streams on a pool of threads or processes."""
+  def __init__(self, cipher, executor=THREAD, workers=None,
+               chunkSize=DefaultChunkSize, maxInFlight=4,
+               engine=modes.TTABLE):
+    if executor not in (THREAD, PROCESS):
+      raise ValueError("unsupported executor %r" % (executor,))
+    if chunkSize < cipher.blockSize:
+      raise ValueError("chunk size %d is smaller than a block" % chunkSize)
+    if maxInFlight < 1:
+      raise ValueError("maxInFlight must be positive, got %d" % maxInFlight)
+    self.cipher = cipher
+    self.executor = executor
+    self.engine = engine
+    self.chunkSize = chunkSize - chunkSize % cipher.blockSize
+    self.maxInFlight = maxInFlight
+    # Largest number of chunks in flight seen so far.
+    self.peakInFlight = 0
+    if executor == THREAD:
+      self.pool = multiprocessing.pool.ThreadPool(workers)
+    else:
+      self.pool = multiprocessing.Pool(workers, parallel.initWorker,
+                                       (cipher, engine))
+
+  def submit(self, chunk, iv):
+    if self.executor == THREAD:
+      return self.pool.apply_async(modes.ctr,
+                                   (self.cipher, chunk, iv, self.engine))
+    return self.pool.apply_async(parallel.runChunk,
+                                 ((True, modes.CTR, chunk, iv),))
+
+  def ctr(self, reader, writer, iv):
+    """XORs reader with the CTR keystream from iv into writer.
+
+    reader needs read(n), writer write() and optionally flush(). Returns
+    the number of bytes written. Encryption and decryption are the same
+    operation.
+    """
+    blockSize = self.cipher.blockSize
+    modes.checkInput(self.cipher, '', modes.CTR, iv, self.engine)
+    flush = getattr(writer, 'flush', None)
+    pending = collections.deque()
+    index = 0
+    written = 0
+    eof = False
+    while not eof or pending:
+      if not eof:
+        chunk = readExactly(reader, self.chunkSize)
+        if chunk:
+          pending.append(self.submit(
+            chunk, modes.counterAt(iv, index, blockSize)))
+          self.peakInFlight = max(self.peakInFlight, len(pending))
+          index += len(chunk) / blockSize
+        eof = len(chunk) < self.chunkSize
+      if pending and (eof or len(pending) >= self.maxInFlight):
+        out = bytes(pending.popleft().get())
+        writer.write(out)
+        if flush is not None:
+          flush()
+        written += len(out)
+    return written
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+class NullWriter(object):
+  def write(self, data):
+    pass
+
+class BytesReader(object):
+  def __init__(self, data):
+    self.data = data
+    self.offset = 0
+
+  def read(self, n):
+    part = self.data[self.offset:self.offset + n]
+    self.offset += len(part)
+    return part
+
+def latencyReport(cipher, size, chunkSizes, executor=THREAD, maxInFlight=4):
+  """Times a stream of size bytes for each chunk size.
+
+  Returns one dict per chunk size with the throughput and the mean,
+  99th percentile and max latency seen by another thread, in ms.
+  """
+  data = os.urandom(size)
+  iv = bytearray(cipher.blockSize)
+  report = []
+  for chunkSize in chunkSizes:
+    with StreamCipher(cipher, executor, chunkSize=chunkSize,
+                      maxInFlight=maxInFlight) as stream:
+      with LatencyMonitor() as monitor:
+        start = time.time()
+        stream.ctr(BytesReader(data), NullWriter(), iv)
+        elapsed = time.time() - start
+    latency = monitor.report()
+    report.append({'chunk': chunkSize, 'MB/s': size / elapsed / 1e6,
+                   'mean ms': latency['mean'] * 1e3,
+                   'p99 ms': latency['p99'] * 1e3,
+                   'max ms': latency['max'] * 1e3})
+  return report
+
+
+if __name__ == '__main__':
+  from aes import Rijndael
+  cipher = Rijndael(bytearray(range(16)))
+  for executor in (THREAD, PROCESS):
+    for r in latencyReport(cipher, 1 << 18, [1 << 10, 1 << 12, 1 << 14],
+                           executor):
+      print "%-7s chunk %6d: %.3f MB/s, latency mean %.1f ms, " \
+        "p99 %.1f ms, max %.1f ms" % ((executor, r['chunk'], r['MB/s'],
+                                       r['mean ms'], r['p99 ms'], r['max ms']))
@@ -0,0 +1,61 @@
+from modes_tests import key, iv
+import aes
+import aesstream
+import modes
+
+import os
+import unittest
+from StringIO import StringIO
+
+class FlushCounter(StringIO):
+  flushes = 0
+
+  def flush(self):
+    self.flushes += 1
+
+class AESStreamTests(unittest.TestCase):
+  def setUp(self):
+    self.cipher = aes.Rijndael(key)
+    self.data = os.urandom(16 * 37 + 5)
+
+  def test_thread_matches_modes(self):
+    out = FlushCounter()
+    with aesstream.StreamCipher(self.cipher, chunkSize=64,
+                                maxInFlight=3) as stream:
+      written = stream.ctr(StringIO(self.data), out, iv)
+      self.assertTrue(stream.peakInFlight <= 3)
+    self.assertEqual(len(self.data), written)
+    self.assertEqual(modes.ctr(self.cipher, self.data, iv),
+                     bytearray(out.getvalue()))
+    self.assertEqual(10, out.flushes)
+
+  def test_process_round_trip(self):
+    out = StringIO()
+    with aesstream.StreamCipher(self.cipher, aesstream.PROCESS, 2,
+                                chunkSize=100) as stream:
+      stream.ctr(StringIO(self.data), out, iv)
+      back = StringIO()
+      stream.ctr(StringIO(out.getvalue()), back, iv)
+    self.assertEqual(self.data, back.getvalue())
+
+  def test_empty_stream(self):
+    out = StringIO()
+    with aesstream.StreamCipher(self.cipher) as stream:
+      self.assertEqual(0, stream.ctr(StringIO(''), out, iv))
+    self.assertEqual('', out.getvalue())
+
+  def test_bad_arguments(self):
+    self.assertRaises(ValueError, aesstream.StreamCipher, self.cipher, 'fiber')
+    self.assertRaises(ValueError, aesstream.StreamCipher, self.cipher,
+                      maxInFlight=0)
+    with aesstream.StreamCipher(self.cipher) as stream:
+      self.assertRaises(ValueError, stream.ctr, StringIO(''), StringIO(),
+                        bytearray(3))
+
+  def test_latency_report(self):
+    report = aesstream.latencyReport(self.cipher, 512, [64, 256])
+    self.assertEqual([64, 256], [r['chunk'] for r in report])
+    self.assertTrue(all(r['max ms'] >= r['mean ms'] for r in report))
+
+if __name__ == '__main__':
+    unittest.main()
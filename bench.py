@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Benchmarks for the Rijndael primitives and the tmath field operations.
+#
+#   bench.py -o baseline.json                 run everything, save results
+#   bench.py --compare baseline.json          run again, flag regressions
+#   bench.py --filter 'MixColumns|GFPOF'      only matching benchmarks
+#
+# Every block cipher benchmark runs for all block/key size combinations of
+# aes_tests.tests. Results are JSON records with the operations per second
+# and two object counts per operation:
+#
+#   elements_per_op           field elements constructed, counted by a
+#                             tmath.FieldProfiler
+#   retained_objects_per_op   gc-tracked objects still alive afterwards
+#
+# Python 2 has no allocation hooks, so neither is a count of all
+# allocations. Element constructions are the allocations of the tmath
+# arithmetic and of the book's MixColumns. Temporary lists, bytearrays
+# and the like that are freed within an operation show up in neither
+# count.
+
+from aes_tests import tests, parseHex
+import aes
+import aesnumpy
+import gcm
+import tmath
+import argparse
+import gc
+import json
+import re
+import sys
+import time
+
+def opsPerSecond(func, minTime):
+  """Calls func in doubling batches until a batch takes minTime seconds."""
+  n = 1
+  while True:
+    start = time.time()
+    for i in xrange(n):
+      func()
+    elapsed = time.time() - start
+    if elapsed >= minTime:
+      return n / elapsed
+    n *= 2
+
+def objectCounts(func, n=16):
+  """Returns (elements_per_op, retained_objects_per_op) of func."""
+  func()
+  with tmath.FieldProfiler() as profiler:
+    for i in range(n):
+      func()
+  elements = sum(profiler.allocations.values())
+  gc.disable()
+  try:
+    before = gc.get_count()[0]
+    for i in range(n):
+      func()
+    after = gc.get_count()[0]
+  finally:
+    gc.enable()
+  return float(elements) / n, float(after - before) / n
+
+def geometries():
+  """(nb, nk) of every test vector in aes_tests.tests."""
+  return [(len(parseHex(c1)) / 4, keysize / 32) for keysize, c1, c2 in tests]
+
+# Keys per operation of the MultiKeyEngine benchmarks.
+MultiKeyBatch = 1024
+
+def cipherBenchmarks(nb, nk):
+  """(name, func) of the block cipher benchmarks for one geometry."""
+  aes.loadTables()
+  msg = bytearray(range(4 * nb))
+  key = bytearray(range(4 * nk))
+  state = aes.arrayToState(msg)
+  cipherKey = aes.arrayToState(key)
+  nr = max(nb, nk) + 6
+  subkey = aes.keyExpansion(cipherKey, nr, nk, nb)[nb:2*nb]
+  flat = bytearray(msg)
+  flatSubkey = aes.stateToArray(subkey)
+  ctx = aes.Rijndael(key, 4 * nb)
+  words = aes.bytesToWords(msg)
+  _, _, roundKeys, _, invRoundKeys = aes.expandKey(key, nb)
+  encrypt = aes.unrolledEncrypt(nb, nk, roundKeys)
+  decrypt = aes.unrolledDecrypt(nb, nk, invRoundKeys)
+  benchmarks = [
+    ('SubBytes', lambda: aes.SubBytes(state, aes.SR)),
+    ('ShiftRows', lambda: aes.ShiftRows(state, 1)),
+    ('MixColumns', lambda: aes.MixColumns(state, aes.MixColumnsCoeffs)),
+    ('AddRoundKey', lambda: aes.AddRoundKey(state, subkey)),
+    ('SubBytesFlat', lambda: aes.SubBytesFlat(flat, aes.STable)),
+    ('ShiftRowsFlat', lambda: aes.ShiftRowsFlat(flat, 1)),
+    ('MixColumnsFlat', lambda: aes.MixColumnsFlat(flat, aes.MixColumnsMuls)),
+    ('AddRoundKeyFlat', lambda: aes.AddRoundKeyFlat(flat, flatSubkey)),
+    ('rnd', lambda: aes.rnd(flat, flatSubkey, 1)),
+    ('keyExpansion', lambda: aes.keyExpansion(cipherKey, nr, nk, nb)),
+    ('rijndael', lambda: aes.rijndael(msg, key)),
+    ('invRijndael', lambda: aes.invRijndael(msg, key)),
+    ('tRijndael', lambda: aes.tRijndael(msg, key)),
+    ('tInvRijndael', lambda: aes.tInvRijndael(msg, key)),
+    ('tEncrypt', lambda: aes.tEncrypt(words, roundKeys, nb, nr)),
+    ('tEncrypt.unrolled', lambda: encrypt(words)),
+    ('tDecrypt', lambda: aes.tDecrypt(words, invRoundKeys, nb, nr)),
+    ('tDecrypt.unrolled', lambda: decrypt(words)),
+    ('Rijndael.encrypt_block', lambda: ctx.encrypt_block(msg)),
+    ('Rijndael.decrypt_block', lambda: ctx.decrypt_block(msg)),
+  ]
+  if aesnumpy.numpy is not None:
+    # One operation handles MultiKeyBatch keys.
+    multi = aesnumpy.MultiKeyEngine(4 * nb)
+    keys = aesnumpy.numpy.frombuffer(
+      bytes(bytearray(range(4 * nk))) * MultiKeyBatch,
+      dtype=aesnumpy.numpy.uint8).reshape(MultiKeyBatch, 4 * nk)
+    keyList = [bytes(key)] * MultiKeyBatch
+    blocks = [bytes(msg)] * MultiKeyBatch
+    benchmarks += [
+      ('MultiKeyEngine.expandKeys', lambda: multi.expandKeys(keys)),
+      ('MultiKeyEngine.encrypt_blocks',
+       lambda: multi.encrypt_blocks(keyList, blocks)),
+    ]
+  return benchmarks
+
+def fieldBenchmarks():
+  """(name, func) of the tmath field operation benchmarks."""
+  Z2 = tmath.Z(2)
+  Z251 = tmath.Z(251)
+  a, b = Z251.fromInt(17), Z251.fromInt(200)
+  POFZ2 = tmath.POF(Z2)
+  rp = POFZ2.fromInt(0x11b)
+  gf = tmath.GFPOF(Z2, rp)
+  generic = tmath.GFPOF(Z2, rp, logTables=False)
+  memoized = tmath.GFPOF(Z2, rp, logTables=False)
+  memoized.memoize()
+  x, y = gf.fromInt(0x57), gf.fromInt(0x83)
+  gx, gy = generic.fromInt(0x57), generic.fromInt(0x83)
+  mx = memoized.fromInt(0x57)
+  binary = tmath.BinaryGFPOF(Z2, tmath.BinaryPOF(Z2).fromInt((1 << 128) | 0x87))
+  bx = binary.fromInt(0x66e94bd4ef8a2c3b884cfa59ca342b2e)
+  by = binary.fromInt(0x0388dace60b6a392f328c2b971b2fe78)
+  elements = [binary.fromInt(0x66e94bd4ef8a2c3b884cfa59ca342b2e ^ i)
+              for i in range(1, 65)]
+  ghash = gcm.GHash(0x66e94bd4ef8a2c3b884cfa59ca342b2e)
+  dividend = POFZ2.fromInt(0x11b)
+  divisor = POFZ2.fromInt(0x1f)
+  return [
+    ('Z.plus', lambda: Z251.plus(a, b)),
+    ('Z.mul', lambda: Z251.mul(a, b)),
+    ('ZElement.mulInv', lambda: a.mulInv()),
+    ('POF.longDiv', lambda: POFZ2.longDiv(dividend, divisor)),
+    ('ExtEuclidean', lambda: tmath.ExtEuclidean(POFZ2, rp, gx)),
+    ('GFPOF.mul', lambda: gf.mul(x, y)),
+    ('GFPOF.mul.generic', lambda: generic.mul(gx, gy)),
+    ('GFPOFElement.mulInv', lambda: x.mulInv()),
+    ('GFPOFElement.mulInv.generic', lambda: gx.mulInv()),
+    ('GFPOFElement.mulInv.memoized', lambda: mx.mulInv()),
+    ('GFPOFElement.xtime', lambda: x.xtime()),
+    ('GFPOFElement.xtime.generic', lambda: gx.xtime()),
+    ('BinaryGFPOF.mul.128', lambda: binary.mul(bx, by)),
+    ('BinaryGFPOFElement.mulInv.128', lambda: bx.mulInv()),
+    ('BinaryGFPOF.batchMulInv.128x64', lambda: binary.batchMulInv(elements)),
+    ('GHash.mul', lambda: ghash.mul(0x0388dace60b6a392f328c2b971b2fe78)),
+    ('gcm.gfMul', lambda: gcm.gfMul(0x0388dace60b6a392f328c2b971b2fe78,
+                                    0x66e94bd4ef8a2c3b884cfa59ca342b2e)),
+  ]
+
+def allBenchmarks():
+  """Yields (name, nb, nk, func) for every benchmark."""
+  for name, func in fieldBenchmarks():
+    yield name, None, None, func
+  for nb, nk in geometries():
+    for name, func in cipherBenchmarks(nb, nk):
+      yield name, nb, nk, func
+
+def run(minTime=0.2, pattern=None, out=None):
+  results = []
+  for name, nb, nk, func in allBenchmarks():
+    if pattern and not re.search(pattern, name):
+      continue
+    elements, retained = objectCounts(func)
+    record = {'name': name, 'nb': nb, 'nk': nk,
+              'ops_per_sec': opsPerSecond(func, minTime),
+              'elements_per_op': elements,
+              'retained_objects_per_op': retained}
+    results.append(record)
+    if out:
+      out.write("%-32s %4s %4s %14.1f ops/s %10.1f elements/op "
+                "%6.1f retained/op\n" % (name, nb or '', nk or '',
+                                          record['ops_per_sec'], elements,
+                                          retained))
+  return {'python': sys.version.split()[0], 'results': results}
+
+def recordKey(record):
+  return (record['name'], record['nb'], record['nk'])
+
+def compare(baseline, current, threshold=0.1):
+  """Lists the benchmarks that regressed against baseline.
+
+  A benchmark regresses if its ops/sec dropped by more than threshold, or
+  if it constructs or retains more objects per operation than before.
+  """
+  base = dict((recordKey(r), r) for r in baseline['results'])
+  regressions = []
+  for r in current['results']:
+    b = base.get(recordKey(r))
+    if b is None:
+      continue
+    reasons = []
+    if r['ops_per_sec'] < b['ops_per_sec'] * (1 - threshold):
+      reasons.append("ops/sec %.1f -> %.1f" % (b['ops_per_sec'],
+                                                r['ops_per_sec']))
+    for field, label in (('elements_per_op', 'elements/op'),
+                         ('retained_objects_per_op', 'retained/op')):
+      if field in b and r[field] > b[field] + 0.5:
+        reasons.append("%s %.1f -> %.1f" % (label, b[field], r[field]))
+    if reasons:
+      regressions.append((r, reasons))
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark aes and tmath.")
+  parser.add_argument('-o', '--output', help="write results as JSON to file")
+  parser.add_argument('-c', '--compare', help="baseline JSON to compare with")
+  parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                      help="tolerated relative slowdown (default 0.1)")
+  parser.add_argument('-m', '--min-time', type=float, default=0.2,
+                      help="minimum seconds per measurement (default 0.2)")
+  parser.add_argument('-f', '--filter', help="regex on benchmark names")
+  args = parser.parse_args(argv)
+  results = run(args.min_time, args.filter, sys.stderr)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=1, sort_keys=True)
+  else:
+    json.dump(results, sys.stdout, indent=1, sort_keys=True)
+    sys.stdout.write("\n")
+  if args.compare:
+    with open(args.compare) as f:
+      regressions = compare(json.load(f), results, args.threshold)
+    for r, reasons in regressions:
+      sys.stderr.write("REGRESSION %s nb=%s nk=%s: %s\n" % (
+        r['name'], r['nb'], r['nk'], ", ".join(reasons)))
+    return 1 if regressions else 0
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,48 @@
+import bench
+import tmath
+
+import unittest
+
+class BenchTests(unittest.TestCase):
+  def test_geometries(self):
+    geometries = bench.geometries()
+    self.assertEqual(25, len(set(geometries)))
+    self.assertTrue((4, 4) in geometries and (8, 8) in geometries)
+
+  def test_run(self):
+    results = bench.run(0.001, '^(Z.mul|AddRoundKey)$')
+    names = set([r['name'] for r in results['results']])
+    self.assertEqual(set(['Z.mul', 'AddRoundKey']), names)
+    self.assertEqual(26, len(results['results']))
+    for r in results['results']:
+      self.assertTrue(r['ops_per_sec'] > 0)
+      self.assertTrue('elements_per_op' in r)
+      self.assertTrue('retained_objects_per_op' in r)
+
+  def test_compare(self):
+    record = {'name': 'x', 'nb': 4, 'nk': 4, 'elements_per_op': 0.0,
+              'retained_objects_per_op': 0.0}
+    baseline = {'results': [dict(record, ops_per_sec=100.0)]}
+    self.assertEqual([], bench.compare(
+      baseline, {'results': [dict(record, ops_per_sec=95.0)]}))
+    slower = bench.compare(
+      baseline, {'results': [dict(record, ops_per_sec=80.0)]})
+    self.assertEqual(1, len(slower))
+    for field in ('elements_per_op', 'retained_objects_per_op'):
+      regressions = bench.compare(baseline, {'results': [
+        dict(record, ops_per_sec=100.0, **{field: 3.0})]})
+      self.assertEqual(1, len(regressions))
+
+  def test_object_counts(self):
+    Z7 = tmath.Z(7)
+    pof = tmath.POF(Z7)
+    a, b = pof.fromInt(10), pof.fromInt(20)
+    elements, retained = bench.objectCounts(lambda: pof.mul(a, b))
+    self.assertTrue(elements >= 1)
+    self.assertEqual(0.0, retained)
+    kept = []
+    elements, retained = bench.objectCounts(lambda: kept.append([]))
+    self.assertEqual((0.0, 1.0), (elements, retained))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Bitsliced Rijndael engine on Python integers.
+#
+# A batch of N blocks is held as eight integers per byte position of a
+# block: bit n of slice b at position p is bit b of byte p of block n. A
+# bitwise operation on a slice acts on the same bit of all N blocks, and
+# a round is a fixed sequence of integer operations:
+#
+#   SubBytes     Boolean circuit of AND and XOR, see sbox
+#   ShiftRows    reordering of the byte positions
+#   MixColumns   XOR of slices, as multiplying by a constant is linear
+#   AddRoundKey  inverting the slices where the round key has a one
+#
+# The number of operations does not depend on N, so wide batches spread
+# the interpreter overhead over many blocks. The engine only encrypts,
+# which is all CTR needs.
+#
+# Nothing of the circuit is MAGIC. Multiplication and squaring are built
+# from ReductionPolynomial, inversion is the power 2^8 - 2 that g
+# computes, and the affine map is read off f.
+
+from aes import f, ReductionPolynomial, MixColumnsCoeffs, MulTables, \
+  ShiftRowsIndices
+from tmath import mulBits
+import binascii
+import os
+import time
+
+DefaultBatchSize = 4096
+
+FieldDegree = ReductionPolynomial.bit_length() - 1
+
+# Bits of x^FieldDegree reduced modulo the reduction polynomial.
+ReductionTaps = [t for t in range(0, FieldDegree)
+                 if ReductionPolynomial >> t & 1]
+
+def linearMap(func):
+  """Input bits that are XORed into each output bit of a linear func."""
+  images = [func(1 << j) for j in range(0, FieldDegree)]
+  return [[j for j in range(0, FieldDegree) if images[j] >> k & 1]
+          for k in range(0, FieldDegree)]
+
+def applyLinear(plan, a):
+  res = []
+  for terms in plan:
+    x = 0
+    for j in terms:
+      x ^= a[j]
+    res.append(x)
+  return res
+
+def squareInt(a, k):
+  """a^(2^k) of a byte."""
+  for i in range(0, k):
+    a = mulBits(a, a, ReductionPolynomial, FieldDegree)
+  return a
+
+# SquareMaps[k] raises to the power 2^k, which is linear over Z2.
+SquareMaps = dict((k, linearMap(lambda a, k=k: squareInt(a, k)))
+                  for k in range(1, FieldDegree))
+
+AffineMap = linearMap(lambda a: f(a) ^ f(0))
+AffineConstant = f(0)
+
+def mulSlices(a, b):
+  """Schoolbook product of two sliced field elements, reduced."""
+  n = FieldDegree
+  p = [0] * (2 * n - 1)
+  for i in range(0, n):
+    ai = a[i]
+    for j in range(0, n):
+      p[i + j] ^= ai & b[j]
+  for d in range(2 * n - 2, n - 1, -1):
+    for t in ReductionTaps:
+      p[d - n + t] ^= p[d]
+  return p[:n]
+
+def powTwoMinusOne(a, k):
+  """a^(2^k - 1) of a sliced element with an Itoh-Tsujii addition chain."""
+  if k == 1:
+    return a
+  if k % 2:
+    return mulSlices(applyLinear(SquareMaps[1], powTwoMinusOne(a, k - 1)), a)
+  t = powTwoMinusOne(a, k / 2)
+  return mulSlices(applyLinear(SquareMaps[k / 2], t), t)
+
+def invSlices(a):
+  """g on a sliced element: a^(2^n - 2), which maps 0 to 0."""
+  return applyLinear(SquareMaps[1], powTwoMinusOne(a, FieldDegree - 1))
+
+def sbox(a, ones):
+  """f(g(a)) on a sliced element, ones has a bit set for every block."""
+  res = applyLinear(AffineMap, invSlices(a))
+  for k in range(0, FieldDegree):
+    if AffineConstant >> k & 1:
+      res[k] ^= ones
+  return res
+
+def mixColumnsPlan(coeffs):
+  """(row, bit) inputs XORed into each bit of each row of a mixed column."""
+  plan = []
+  for r in range(0, 4):
+    rows = [MulTables[coeffs[(i - r) % 4]] for i in range(0, 4)]
+    plan.append([[(i, j) for i in range(0, 4) for j in range(0, 8)
+                  if rows[i][1 << j] >> k & 1] for k in range(0, 8)])
+  return plan
+
+# BitChars[b] maps a byte to '1' if bit b is set and to '0' otherwise,
+# BitBytes[b] maps '1' back to a byte with just bit b set.
+BitChars = [''.join(['01'[v >> b & 1] for v in range(0, 0x100)])
+            for b in range(0, 8)]
+BitBytes = [''.join([chr(1 << b) if c == '1' else '\0'
+                     for c in map(chr, range(0, 0x100))]) for b in range(0, 8)]
+
+class BitslicedEngine(object):
+  """Encrypts batches of up to batchSize blocks under one Rijndael context."""
+  def __init__(self, cipher, batchSize=DefaultBatchSize):
+    if batchSize < 1:
+      raise ValueError("batch size must be positive, got %d" % batchSize)
+    self.nb = cipher.nb
+    self.nr = cipher.nr
+    self.blockSize = cipher.blockSize
+    self.batchSize = batchSize
+    self.shift = [4 * cols[i] + i for cols in ShiftRowsIndices[self.nb]
+                  for i in range(0, 4)]
+    self.mix = mixColumnsPlan(MixColumnsCoeffs)
+    # (position, bit) of every one bit of each round key.
+    self.keyBits = [[(p, b) for p in range(0, self.blockSize)
+                     for b in range(0, 8) if rk[p] >> b & 1]
+                    for rk in cipher.roundKeyBytes]
+
+  def toSlices(self, data):
+    bs = self.blockSize
+    data = bytes(data)
+    return [[int(data[p::bs].translate(BitChars[b])[::-1], 2)
+             for b in range(0, 8)] for p in range(0, bs)]
+
+  def fromSlices(self, state, n):
+    bs = self.blockSize
+    out = bytearray(n * bs)
+    for p in range(0, bs):
+      v = 0
+      for b in range(0, 8):
+        bits = format(state[p][b], '0%db' % n)[::-1]
+        v |= int(binascii.hexlify(bits.translate(BitBytes[b])), 16)
+      out[p::bs] = binascii.unhexlify('%0*x' % (2 * n, v))
+    return out
+
+  def mixColumns(self, state):
+    out = []
+    for c in range(0, len(state), 4):
+      column = state[c:c + 4]
+      for rowPlan in self.mix:
+        row = []
+        for terms in rowPlan:
+          x = 0
+          for i, j in terms:
+            x ^= column[i][j]
+          row.append(x)
+        out.append(row)
+    return out
+
+  def encryptSlices(self, state, ones):
+    for p, b in self.keyBits[0]:
+      state[p][b] ^= ones
+    for r in range(1, self.nr + 1):
+      state = [sbox(a, ones) for a in state]
+      state = [state[p] for p in self.shift]
+      if r < self.nr:
+        state = self.mixColumns(state)
+      for p, b in self.keyBits[r]:
+        state[p][b] ^= ones
+    return state
+
+  def encrypt(self, data):
+    """Encrypts whole blocks, batchSize blocks at a time."""
+    bs = self.blockSize
+    if len(data) % bs:
+      raise ValueError("data length %d is not a multiple of the block size %d"
+                       % (len(data), bs))
+    out = bytearray()
+    step = self.batchSize * bs
+    for start in range(0, len(data), step):
+      batch = data[start:start + step]
+      n = len(batch) / bs
+      state = self.encryptSlices(self.toSlices(batch), (1 << n) - 1)
+      out += self.fromSlices(state, n)
+    return out
+
+  def counterBlocks(self, iv, count):
+    """count consecutive big-endian counter blocks starting at iv."""
+    bs = self.blockSize
+    start = int(binascii.hexlify(bytes(iv)), 16)
+    mod = 1 << (8 * bs)
+    return binascii.unhexlify(''.join(['%0*x' % (2 * bs, (start + i) % mod)
+                                       for i in range(0, count)]))
+
+  def ctr(self, data, iv):
+    """XORs data with the CTR keystream that starts at counter block iv."""
+    if not len(data):
+      return bytearray()
+    count = (len(data) + self.blockSize - 1) / self.blockSize
+    keystream = self.encrypt(self.counterBlocks(iv, count))[:len(data)]
+    x = int(binascii.hexlify(bytes(data)), 16) ^ \
+        int(binascii.hexlify(bytes(keystream)), 16)
+    return bytearray(binascii.unhexlify('%0*x' % (2 * len(data), x)))
+
+def batchReport(cipher, size, batchSizes):
+  """Times CTR over size bytes for each batch size, as dicts."""
+  data = bytearray(os.urandom(size))
+  iv = bytearray(cipher.blockSize)
+  report = []
+  for batchSize in batchSizes:
+    engine = BitslicedEngine(cipher, batchSize)
+    start = time.time()
+    engine.ctr(data, iv)
+    elapsed = time.time() - start
+    report.append({'batch': batchSize, 'seconds': elapsed,
+                   'MB/s': size / elapsed / 1e6})
+  return report
+
+
+if __name__ == '__main__':
+  from aes import Rijndael
+  cipher = Rijndael(bytearray(range(16)))
+  for r in batchReport(cipher, 1 << 16, [1, 8, 64, 256, 1024, 4096]):
+    print "batch %(batch)5d: %(MB/s).3f MB/s" % r
@@ -0,0 +1,57 @@
+from modes_tests import key, plaintext, ctrIV, ctrCiphertext
+from aes_tests import parseHex
+import aes
+import bitslice
+import modes
+
+import os
+import unittest
+
+class BitsliceTests(unittest.TestCase):
+  def test_sbox_circuit(self):
+    engine = bitslice.BitslicedEngine(aes.Rijndael(key))
+    # 16 blocks of 16 bytes hold every byte value once.
+    state = engine.toSlices(bytearray(range(0x100)))
+    out = engine.fromSlices([bitslice.sbox(a, 0xFFFF) for a in state], 16)
+    self.assertEqual(aes.STable, out)
+
+  def test_inverse(self):
+    engine = bitslice.BitslicedEngine(aes.Rijndael(key))
+    state = engine.toSlices(bytearray(range(0x100)))
+    out = engine.fromSlices([bitslice.invSlices(a) for a in state], 16)
+    self.assertEqual(bytearray([aes.g(a) for a in range(0x100)]), out)
+
+  def test_encrypt_matches_ttable(self):
+    for blockSize, keySize in [(16, 16), (20, 32), (24, 20), (32, 24)]:
+      cipher = aes.Rijndael(bytearray(os.urandom(keySize)), blockSize)
+      data = bytearray(os.urandom(7 * blockSize))
+      for batchSize in (1, 3, 64):
+        engine = bitslice.BitslicedEngine(cipher, batchSize)
+        self.assertEqual(modes.encrypt_blocks(cipher, data),
+                         engine.encrypt(data))
+
+  def test_ctr(self):
+    cipher = aes.Rijndael(key)
+    self.assertEqual(ctrCiphertext, modes.encrypt_blocks(
+      cipher, plaintext, modes.CTR, ctrIV, engine=modes.BITSLICE))
+    # The counter wraps around at the block size.
+    iv = parseHex("fffffffffffffffffffffffffffffffe")
+    data = bytearray(os.urandom(83))
+    engine = bitslice.BitslicedEngine(cipher, 2)
+    self.assertEqual(modes.ctr(cipher, data, iv), engine.ctr(data, iv))
+    self.assertEqual(bytearray(), engine.ctr(bytearray(), iv))
+
+  def test_bad_input(self):
+    cipher = aes.Rijndael(key)
+    self.assertRaises(ValueError, bitslice.BitslicedEngine, cipher, 0)
+    self.assertRaises(ValueError, bitslice.BitslicedEngine(cipher).encrypt,
+                      bytearray(15))
+    self.assertRaises(ValueError, modes.encrypt_blocks, cipher, plaintext,
+                      engine=modes.BITSLICE)
+
+  def test_batch_report(self):
+    report = bitslice.batchReport(aes.Rijndael(key), 256, [1, 16])
+    self.assertEqual([1, 16], [r['batch'] for r in report])
+
+if __name__ == '__main__':
+    unittest.main()
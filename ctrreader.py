@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Random access into CTR-encrypted files.
+#
+# CTRReader wraps a seekable file of CTR ciphertext and reads plaintext
+# at any offset. Only the blocks under a read are decrypted: the counter
+# block of an offset is iv + offset / blockSize, computed directly by
+# modes.counterAt. The keystream of the latest window of blocks is kept,
+# so a run of small sequential reads encrypts every counter block once.
+
+from modes import readExactly
+import modes
+import binascii
+import os
+
+DefaultWindowBlocks = 64
+
+def xorStrings(a, b):
+  """XOR of two byte strings of the same length."""
+  if not a:
+    return ''
+  n = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+  return binascii.unhexlify('%0*x' % (2 * len(a), n))
+
+class CTRReader(object):
+  """File-like plaintext view of a file encrypted with CTR from iv."""
+  def __init__(self, f, cipher, iv, windowBlocks=DefaultWindowBlocks,
+               engine=modes.TTABLE):
+    modes.checkInput(cipher, '', modes.CTR, iv, engine)
+    if windowBlocks < 1:
+      raise ValueError("windowBlocks must be positive, got %d" % windowBlocks)
+    self.f = f
+    self.cipher = cipher
+    self.iv = bytes(iv)
+    self.engine = engine
+    self.windowBlocks = windowBlocks
+    self.offset = 0
+    # Keystream of the blocks from windowStart on.
+    self.windowStart = 0
+    self.window = ''
+    # Number of counter blocks encrypted so far.
+    self.blocksGenerated = 0
+
+  def keystream(self, offset, length, ahead=True):
+    """length bytes of keystream from byte offset on.
+
+    With ahead, a window of windowBlocks is generated even if the read
+    needs fewer blocks.
+    """
+    if not length:
+      return ''
+    blockSize = self.cipher.blockSize
+    start = self.windowStart * blockSize
+    if start <= offset and offset + length <= start + len(self.window):
+      return self.window[offset - start:offset - start + length]
+    first = offset / blockSize
+    blocks = -(-(offset + length) / blockSize) - first
+    if ahead:
+      blocks = max(blocks, self.windowBlocks)
+    stream = bytes(modes.ctr(self.cipher, '\0' * (blocks * blockSize),
+                             modes.counterAt(self.iv, first, blockSize),
+                             self.engine))
+    self.blocksGenerated += blocks
+    # Long reads only keep their last window.
+    keep = min(blocks, self.windowBlocks)
+    self.windowStart = first + blocks - keep
+    self.window = stream[(blocks - keep) * blockSize:]
+    skip = offset - first * blockSize
+    return stream[skip:skip + length]
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.offset
+    elif whence == os.SEEK_END:
+      self.f.seek(0, os.SEEK_END)
+      offset += self.f.tell()
+    elif whence != os.SEEK_SET:
+      raise ValueError("invalid whence %r" % (whence,))
+    if offset < 0:
+      raise ValueError("negative seek offset %d" % offset)
+    self.offset = offset
+
+  def tell(self):
+    return self.offset
+
+  def read(self, n=-1):
+    """Reads and decrypts up to n bytes, or up to the end if n < 0."""
+    self.f.seek(self.offset)
+    data = self.f.read() if n < 0 else readExactly(self.f, n)
+    # Nothing follows a read that reached the end of the file.
+    ahead = 0 <= n == len(data)
+    out = xorStrings(data, self.keystream(self.offset, len(data), ahead))
+    self.offset += len(data)
+    return out
+
+  def close(self):
+    self.f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
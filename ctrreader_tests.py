@@ -0,0 +1,74 @@
+from modes_tests import key, iv
+from aes_tests import parseHex
+import aes
+import ctrreader
+import modes
+
+import os
+import unittest
+from StringIO import StringIO
+
+class CTRReaderTests(unittest.TestCase):
+  def setUp(self):
+    self.cipher = aes.Rijndael(key)
+    self.plain = os.urandom(16 * 300 + 7)
+    self.ciphertext = bytes(modes.ctr(self.cipher, self.plain, iv))
+
+  def reader(self, windowBlocks=8):
+    return ctrreader.CTRReader(StringIO(self.ciphertext), self.cipher, iv,
+                               windowBlocks)
+
+  def test_ctr_at(self):
+    for offset in (0, 5, 16, 4000):
+      self.assertEqual(self.ciphertext[offset:offset + 100], bytes(
+        modes.ctrAt(self.cipher, self.plain[offset:offset + 100], iv, offset)))
+    # The counter wraps around at the block size.
+    top = parseHex("ffffffffffffffffffffffffffffffff")
+    self.assertEqual(modes.ctr(self.cipher, self.plain[:64], top)[20:],
+                     modes.ctrAt(self.cipher, self.plain[20:64], top, 20))
+
+  def test_random_access(self):
+    reader = self.reader()
+    for offset, n in [(4000, 100), (3, 20), (16 * 300, 100), (17, 0),
+                      (len(self.plain) - 1, 5), (len(self.plain) + 3, 5)]:
+      reader.seek(offset)
+      self.assertEqual(self.plain[offset:offset + n], reader.read(n))
+    reader.seek(-10, os.SEEK_END)
+    self.assertEqual(self.plain[-10:], reader.read())
+    reader.seek(100)
+    reader.seek(-50, os.SEEK_CUR)
+    self.assertEqual(50, reader.tell())
+    self.assertEqual(self.plain[50:], reader.read())
+    self.assertRaises(ValueError, reader.seek, -1)
+
+  def test_sequential_reads_use_window(self):
+    reader = self.reader(windowBlocks=8)
+    out = ''.join([reader.read(5) for i in range(0, 25)])
+    self.assertEqual(self.plain[:125], out)
+    self.assertEqual(8, reader.blocksGenerated)
+    # A read longer than the window generates exactly its blocks.
+    reader.seek(1000)
+    self.assertEqual(self.plain[1000:1400], reader.read(400))
+    self.assertEqual(8 + 26, reader.blocksGenerated)
+    self.assertEqual(self.plain[1400:1410], reader.read(10))
+    self.assertEqual(8 + 26 + 8, reader.blocksGenerated)
+
+  def test_reads_at_end_generate_no_window(self):
+    reader = self.reader(windowBlocks=8)
+    reader.seek(0, os.SEEK_END)
+    self.assertEqual('', reader.read(0))
+    self.assertEqual('', reader.read(10))
+    self.assertEqual(0, reader.blocksGenerated)
+    # Only the last, partial block lies under a read across the end.
+    reader.seek(-3, os.SEEK_END)
+    self.assertEqual(self.plain[-3:], reader.read(100))
+    self.assertEqual(1, reader.blocksGenerated)
+
+  def test_bad_input(self):
+    self.assertRaises(ValueError, ctrreader.CTRReader, StringIO(''),
+                      self.cipher, bytearray(3))
+    self.assertRaises(ValueError, ctrreader.CTRReader, StringIO(''),
+                      self.cipher, iv, 0)
+
+if __name__ == '__main__':
+    unittest.main()
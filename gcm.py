@@ -0,0 +1,234 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Galois/Counter Mode, NIST SP 800-38D, for Rijndael with 128-bit blocks.
+#
+# GHASH multiplies by the hash key H in GF(2^128) modulo GCMPolynomial.
+# GCM keeps the coefficient of x^0 in the most significant bit of a
+# block, so a block read as a big-endian integer is the bit reflection of
+# the polynomial encoding of tmath, and multiplying by x is a right
+# shift.
+#
+# GHash uses Shoup's tables: per hash key the products of H with every
+# value of one digit of 4 or 8 bits, and the reduction that goes with a
+# shift by one digit. A multiplication then takes 128/bits lookups.
+#
+# GCM.update() encrypts and hashes every block in the same loop, and can
+# be called with pieces of any length.
+
+from aes import bytesToWords, wordsToBytes
+import binascii
+import hmac
+
+# x^128 + x^7 + x^2 + x + 1, Sec 6.3 of SP 800-38D. MAGIC
+GCMPolynomial = (1 << 128) | 0x87
+
+def reflect(a, n=128):
+  """Reverses the order of the n low bits of a."""
+  return int(format(a, '0%db' % n)[::-1], 2)
+
+# Length limits in bytes, Sec 5.2.1.1 of SP 800-38D: 2^39 - 256 bits of
+# text, so the 32-bit counter never wraps, and 2^64 - 1 bits of AAD and
+# IV.
+MaxTextLength = (1 << 36) - 32
+MaxAADLength = (1 << 61) - 1
+MaxIVLength = (1 << 61) - 1
+
+# x^128 modulo GCMPolynomial in GCM bit order.
+Reduction = reflect(GCMPolynomial & ((1 << 128) - 1))
+
+def mulX(a):
+  """a * x in GCM bit order."""
+  if a & 1:
+    return (a >> 1) ^ Reduction
+  return a >> 1
+
+def gfMul(a, b):
+  """a * b in GCM bit order, one bit of a at a time."""
+  z = 0
+  for i in range(127, -1, -1):
+    if a >> i & 1:
+      z ^= b
+    b = mulX(b)
+  return z
+
+def bytesToInt(data):
+  return int(binascii.hexlify(bytes(data)), 16) if len(data) else 0
+
+def intToBytes(a, n=16):
+  return bytearray(binascii.unhexlify('%0*x' % (2 * n, a)))
+
+class GHash(object):
+  """Multiplication by the hash key h with Shoup tables of bits-bit digits."""
+  def __init__(self, h, bits=8):
+    if bits not in (4, 8):
+      raise ValueError("table digits must have 4 or 8 bits, not %d" % bits)
+    self.bits = bits
+    self.mask = (1 << bits) - 1
+    self.shifts = range(0, 128, bits)
+    # products[d] is h times the digit d in the x^0 end of a block.
+    self.products = [0] * (1 << bits)
+    v = h
+    for j in range(bits - 1, -1, -1):
+      self.products[1 << j] = v
+      v = mulX(v)
+    for d in range(1, 1 << bits):
+      low = d & -d
+      self.products[d] = self.products[d ^ low] ^ self.products[low]
+    # reductions[r] is r * x^bits, what shifting out the digit r adds.
+    self.reductions = []
+    for r in range(0, 1 << bits):
+      for i in range(0, bits):
+        r = mulX(r)
+      self.reductions.append(r)
+
+  def mul(self, a):
+    """a * h, Horner's rule over the digits of a from x^127 down."""
+    bits, mask = self.bits, self.mask
+    products, reductions = self.products, self.reductions
+    z = 0
+    for shift in self.shifts:
+      z = (z >> bits) ^ reductions[z & mask] ^ products[(a >> shift) & mask]
+    return z
+
+  def absorb(self, y, data):
+    """GHASH state y after the blocks of data, zero padded."""
+    data = bytes(data)
+    data += '\0' * (-len(data) % 16)
+    for i in range(0, len(data), 16):
+      y = self.mul(y ^ bytesToInt(data[i:i + 16]))
+    return y
+
+
+class GCM(object):
+  """One GCM encryption or decryption with nonce iv under cipher.
+
+  update() returns the output for every piece of input, finalize() the
+  tag of encryption and verify() checks the tag of decryption.
+  """
+  def __init__(self, cipher, iv, aad='', decrypt=False, tableBits=8):
+    if cipher.blockSize != 16:
+      raise ValueError("GCM needs 16-byte blocks, not %d" % cipher.blockSize)
+    if not len(iv):
+      raise ValueError("GCM needs a non-empty IV")
+    if len(iv) > MaxIVLength:
+      raise ValueError("IV of %d bytes exceeds the GCM limit" % len(iv))
+    if len(aad) > MaxAADLength:
+      raise ValueError("AAD of %d bytes exceeds the GCM limit" % len(aad))
+    self.encryptWords = cipher.encryptWords
+    self.decrypt = decrypt
+    self.ghash = GHash(bytesToInt(wordsToBytes(self.encryptWords([0] * 4))),
+                       tableBits)
+    if len(iv) == 12:
+      j0 = bytesToInt(iv) << 32 | 1
+    else:
+      j0 = self.ghash.absorb(self.ghash.absorb(0, iv),
+                             intToBytes(8 * len(iv)))
+    self.j0 = bytesToWords(intToBytes(j0))
+    self.counter = self.j0[3]
+    self.y = self.ghash.absorb(0, aad)
+    self.aadLength = len(aad)
+    self.length = 0
+    # Unused keystream and not yet hashed ciphertext of a partial block.
+    self.keystream = ''
+    self.partial = ''
+    self.done = False
+
+  def nextKeystream(self):
+    self.counter = (self.counter + 1) & 0xFFFFFFFF
+    words = self.encryptWords(self.j0[:3] + [self.counter])
+    return bytes(wordsToBytes(words))
+
+  def hashPartial(self):
+    if len(self.partial) == 16:
+      self.y = self.ghash.mul(self.y ^ bytesToInt(self.partial))
+      self.partial = ''
+
+  def blocks(self, data):
+    """Encrypts or decrypts whole blocks and hashes their ciphertext."""
+    words = bytesToWords(data)
+    out = [0] * len(words)
+    encrypt, mul, decrypt = self.encryptWords, self.ghash.mul, self.decrypt
+    c0, c1, c2 = self.j0[:3]
+    n, y = self.counter, self.y
+    for i in range(0, len(words), 4):
+      n = (n + 1) & 0xFFFFFFFF
+      k0, k1, k2, k3 = encrypt([c0, c1, c2, n])
+      w0, w1, w2, w3 = words[i:i + 4]
+      o0, o1, o2, o3 = w0 ^ k0, w1 ^ k1, w2 ^ k2, w3 ^ k3
+      out[i:i + 4] = [o0, o1, o2, o3]
+      if decrypt:
+        y = mul(y ^ (w0 << 96 | w1 << 64 | w2 << 32 | w3))
+      else:
+        y = mul(y ^ (o0 << 96 | o1 << 64 | o2 << 32 | o3))
+    self.counter, self.y = n, y
+    return wordsToBytes(out)
+
+  def update(self, data):
+    if self.done:
+      raise ValueError("GCM operation is already finalized")
+    if self.length + len(data) > MaxTextLength:
+      raise ValueError("more than %d bytes of text in one GCM operation" %
+                       MaxTextLength)
+    data = bytes(data)
+    self.length += len(data)
+    out = bytearray()
+    if self.keystream:
+      n = min(len(data), len(self.keystream))
+      head = xorBytes(data[:n], self.keystream[:n])
+      self.keystream = self.keystream[n:]
+      self.partial += data[:n] if self.decrypt else head
+      self.hashPartial()
+      out += head
+      data = data[n:]
+    full = len(data) - len(data) % 16
+    if full:
+      out += self.blocks(data[:full])
+    if full < len(data):
+      tail = data[full:]
+      keystream = self.nextKeystream()
+      head = xorBytes(tail, keystream[:len(tail)])
+      self.keystream = keystream[len(tail):]
+      self.partial = tail if self.decrypt else head
+      out += head
+    return out
+
+  def finalize(self):
+    """Returns the 16-byte tag."""
+    self.done = True
+    y = self.ghash.absorb(self.y, self.partial)
+    y = self.ghash.mul(y ^ (8 * self.aadLength << 64 | 8 * self.length))
+    return xorBytes(intToBytes(y), wordsToBytes(self.encryptWords(self.j0)))
+
+  def verify(self, tag):
+    """Raises ValueError unless tag is a prefix of the expected tag."""
+    if len(tag) not in (4, 8, 12, 13, 14, 15, 16):
+      raise ValueError("unsupported tag length %d" % len(tag))
+    if not hmac.compare_digest(self.finalize()[:len(tag)], bytes(tag)):
+      raise ValueError("GCM tag mismatch")
+
+def xorBytes(a, b):
+  return bytes(bytearray([x ^ y for x, y in zip(bytearray(a), bytearray(b))]))
+
+def encrypt(cipher, iv, plaintext, aad='', tagSize=16):
+  """Returns (ciphertext, tag)."""
+  gcm = GCM(cipher, iv, aad)
+  ciphertext = gcm.update(plaintext)
+  return ciphertext, bytearray(gcm.finalize()[:tagSize])
+
+def decrypt(cipher, iv, ciphertext, tag, aad=''):
+  """Returns the plaintext, or raises ValueError for a wrong tag."""
+  gcm = GCM(cipher, iv, aad, decrypt=True)
+  plaintext = gcm.update(ciphertext)
+  gcm.verify(tag)
+  return plaintext
+
+
+if __name__ == '__main__':
+  from aes import Rijndael
+  from modes import throughput
+  cipher = Rijndael(bytearray(range(16)))
+  iv = bytearray(12)
+  for bits in (4, 8):
+    print "GCM encrypt, %d-bit tables: %.3f MB/s" % (bits, throughput(
+      lambda d: GCM(cipher, iv, tableBits=bits).update(d), 1 << 16))
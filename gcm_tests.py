@@ -0,0 +1,125 @@
+from aes_tests import parseHex
+from tmath import Z, POF, GFPOF, BinaryPOF, BinaryGFPOF
+import aes
+import gcm
+
+import os
+import unittest
+
+# Test cases 1 to 6 of the GCM specification by McGrew and Viega
+K0 = parseHex("00000000000000000000000000000000")
+K1 = parseHex("feffe9928665731c6d6a8f9467308308")
+P = parseHex("d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72"
+             "1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255")
+A = parseHex("feedfacedeadbeeffeedfacedeadbeefabaddad2")
+vectors = [
+  # key, iv, plaintext, aad, ciphertext, tag
+  (K0, parseHex("000000000000000000000000"), bytearray(), bytearray(),
+   bytearray(), parseHex("58e2fccefa7e3061367f1d57a4e7455a")),
+  (K0, parseHex("000000000000000000000000"), bytearray(16), bytearray(),
+   parseHex("0388dace60b6a392f328c2b971b2fe78"),
+   parseHex("ab6e47d42cec13bdf53a67b21257bddf")),
+  (K1, parseHex("cafebabefacedbaddecaf888"), P, bytearray(),
+   parseHex("42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e"
+            "21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091473f5985"),
+   parseHex("4d5c2af327cd64a62cf35abd2ba6fab4")),
+  (K1, parseHex("cafebabefacedbaddecaf888"), P[:60], A,
+   parseHex("42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e"
+            "21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091"),
+   parseHex("5bc94fbc3221a5db94fae95ae7121a47")),
+  (K1, parseHex("cafebabefacedbad"), P[:60], A,
+   parseHex("61353b4c2806934a777ff51fa22a4755699b2a714fcdc6f83766e5f97b6c7423"
+            "73806900e49f24b22b097544d4896b424989b5e1ebac0f07c23f4598"),
+   parseHex("3612d2e79e3b0785561be14aaca2fccb")),
+  (K1, parseHex("9313225df88406e555909c5aff5269aa6a7a9538534f7da1e4c303d2a318a728"
+                "c3c0c95156809539fcf0e2429a6b525416aedbf5a0de6a57a637b39b"),
+   P[:60], A,
+   parseHex("8ce24998625615b603a033aca13fb894be9112a5c3a211a8ba262a3cca7e2ca7"
+            "01e4a9a4fba43c90ccdcb281d48c7c6fd62875d2aca417034c34aee5"),
+   parseHex("619cc5aefffe0bfa462af43c1699d050")),
+]
+
+class GCMTests(unittest.TestCase):
+  def test_vectors(self):
+    for key, iv, p, a, c, t in vectors:
+      cipher = aes.Rijndael(key)
+      for bits in (4, 8):
+        gcm_ = gcm.GCM(cipher, iv, a, tableBits=bits)
+        self.assertEqual(c, gcm_.update(p))
+        self.assertEqual(t, bytearray(gcm_.finalize()))
+      self.assertEqual(p, gcm.decrypt(cipher, iv, c, t, a))
+
+  def test_ghash_matches_tmath(self):
+    Z2 = Z(2)
+    generic = GFPOF(Z2, POF(Z2).fromInt(gcm.GCMPolynomial))
+    binary = BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt(gcm.GCMPolynomial))
+    h = 0x66e94bd4ef8a2c3b884cfa59ca342b2e
+    x = 0x0388dace60b6a392f328c2b971b2fe78
+    expected = generic.mul(generic.fromInt(gcm.reflect(x)),
+                           generic.fromInt(gcm.reflect(h)))
+    self.assertEqual(generic.fromInt(gcm.reflect(gcm.GHash(h).mul(x))),
+                     expected)
+    for i in range(0, 20):
+      h = int(os.urandom(16).encode('hex'), 16)
+      x = int(os.urandom(16).encode('hex'), 16)
+      product = binary.mul(binary.fromInt(gcm.reflect(x)),
+                           binary.fromInt(gcm.reflect(h))).bits
+      for bits in (4, 8):
+        self.assertEqual(gcm.reflect(product), gcm.GHash(h, bits).mul(x))
+      self.assertEqual(gcm.reflect(product), gcm.gfMul(x, h))
+
+  def test_incremental_update(self):
+    key, iv, p, a, c, t = vectors[3]
+    for pieces in ([1] * 60, [15, 1, 17, 27], [0, 60], [33, 0, 27]):
+      gcm_ = gcm.GCM(aes.Rijndael(key), iv, a)
+      out = bytearray()
+      offset = 0
+      for n in pieces:
+        out += gcm_.update(p[offset:offset + n])
+        offset += n
+      self.assertEqual(c, out)
+      self.assertEqual(t, bytearray(gcm_.finalize()))
+      gcm_ = gcm.GCM(aes.Rijndael(key), iv, a, decrypt=True)
+      out = bytearray()
+      offset = 0
+      for n in pieces:
+        out += gcm_.update(c[offset:offset + n])
+        offset += n
+      self.assertEqual(p, out)
+      gcm_.verify(t)
+
+  def test_tag_mismatch(self):
+    key, iv, p, a, c, t = vectors[3]
+    cipher = aes.Rijndael(key)
+    self.assertRaises(ValueError, gcm.decrypt, cipher, iv, c, t, a[1:])
+    bad = bytearray(t)
+    bad[0] ^= 1
+    self.assertRaises(ValueError, gcm.decrypt, cipher, iv, c, bad, a)
+    self.assertEqual(p, gcm.decrypt(cipher, iv, c, t[:12], a))
+    self.assertRaises(ValueError, gcm.decrypt, cipher, iv, c, t[:3], a)
+
+  def test_bad_input(self):
+    self.assertRaises(ValueError, gcm.GCM, aes.Rijndael(K0, 20), bytearray(12))
+    self.assertRaises(ValueError, gcm.GCM, aes.Rijndael(K0), bytearray())
+    self.assertRaises(ValueError, gcm.GHash, 1, 5)
+    gcm_ = gcm.GCM(aes.Rijndael(K0), bytearray(12))
+    gcm_.finalize()
+    self.assertRaises(ValueError, gcm_.update, bytearray(1))
+
+  def test_length_limits(self):
+    class Huge(object):
+      def __len__(self):
+        return 1 << 61
+    cipher = aes.Rijndael(K0)
+    self.assertRaises(ValueError, gcm.GCM, cipher, Huge())
+    self.assertRaises(ValueError, gcm.GCM, cipher, bytearray(12), Huge())
+    gcm_ = gcm.GCM(cipher, bytearray(12))
+    gcm_.update(bytearray(16))
+    # As if 2^32 - 3 blocks were done, one block before the limit.
+    gcm_.length = gcm.MaxTextLength - 16
+    gcm_.update(bytearray(16))
+    self.assertRaises(ValueError, gcm_.update, bytearray(1))
+    self.assertEqual(gcm.MaxTextLength, gcm_.length)
+
+if __name__ == '__main__':
+    unittest.main()
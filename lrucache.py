@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+from collections import OrderedDict
+import threading
+
+
+class LRUCache(object):
+  """Bounded mapping that evicts the least recently used entry.
+
+  hits and misses count the lookups done through get(), so the capacity
+  can be sized from real workloads. All methods take a lock, so threads
+  may share a cache.
+  """
+  def __init__(self, capacity):
+    if capacity < 1:
+      raise ValueError("capacity must be at least 1, got %d" % capacity)
+    self.capacity = capacity
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    # OrderedDict keeps its order in a linked list that concurrent
+    # updates can corrupt.
+    self.lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self.lock:
+      try:
+        value = self.entries.pop(key)
+      except KeyError:
+        self.misses += 1
+        return default
+      self.entries[key] = value
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = value
+      while len(self.entries) > self.capacity:
+        self.entries.popitem(last=False)
+
+  def resize(self, capacity):
+    if capacity < 1:
+      raise ValueError("capacity must be at least 1, got %d" % capacity)
+    with self.lock:
+      self.capacity = capacity
+      while len(self.entries) > self.capacity:
+        self.entries.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def hitRate(self):
+    lookups = self.hits + self.misses
+    return float(self.hits) / lookups if lookups else 0.0
+
+  def stats(self):
+    with self.lock:
+      return {'hits': self.hits, 'misses': self.misses,
+              'size': len(self.entries), 'capacity': self.capacity,
+              'hitRate': self.hitRate()}
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
@@ -0,0 +1,53 @@
+from lrucache import LRUCache
+
+import threading
+import unittest
+
+class LRUCacheTests(unittest.TestCase):
+  def test_eviction_order(self):
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    self.assertEqual(1, cache.get('a'))
+    cache.put('c', 3)
+    self.assertTrue('a' in cache)
+    self.assertFalse('b' in cache)
+    self.assertEqual(2, len(cache))
+
+  def test_counters(self):
+    cache = LRUCache(4)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    self.assertEqual(1, cache.hits)
+    self.assertEqual(1, cache.misses)
+    self.assertEqual(0.5, cache.hitRate())
+
+  def test_resize(self):
+    cache = LRUCache(3)
+    for k in 'abc':
+      cache.put(k, k)
+    cache.resize(1)
+    self.assertEqual(['c'], list(cache.entries))
+    self.assertRaises(ValueError, cache.resize, 0)
+
+  def test_threads(self):
+    cache = LRUCache(8)
+    def work(offset):
+      for i in range(0, 2000):
+        key = (i * 7 + offset) % 13
+        if cache.get(key) is None:
+          cache.put(key, key)
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(0, 4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(8000, cache.hits + cache.misses)
+    self.assertEqual(8, len(cache))
+    self.assertEqual(8, len(list(cache.entries)))
+    for key in list(cache.entries):
+      self.assertEqual(key, cache.get(key))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Multi-block modes of operation on top of the Rijndael cipher context.
+#
+# A whole buffer is converted into column words with a single struct call,
+# and the output words are collected in one preallocated list, so there is
+# no per-block arrayToState/stateToArray conversion.
+
+from aes import Rijndael, bytesToWords, wordsToBytes
+from aesnumpy import NumpyEngine
+from bitslice import BitslicedEngine
+import os
+import struct
+import time
+
+ECB = 'ECB'
+CBC = 'CBC'
+CTR = 'CTR'
+
+# Block engines. TTABLE runs one block at a time on aes.tEncrypt, NUMPY
+# runs all blocks of a call at once on aesnumpy.NumpyEngine and BITSLICE
+# runs batches of blocks on bitslice.BitslicedEngine.
+TTABLE = 'ttable'
+NUMPY = 'numpy'
+BITSLICE = 'bitslice'
+
+def pkcs7Pad(data, blockSize):
+  """Appends PKCS#7 padding, always adding between 1 and blockSize bytes."""
+  n = blockSize - len(data) % blockSize
+  return bytearray(data) + bytearray([n] * n)
+
+def pkcs7Unpad(data, blockSize):
+  data = bytearray(data)
+  if not data or len(data) % blockSize:
+    raise ValueError("padded data must be a non-empty multiple of %d bytes" %
+                     blockSize)
+  n = data[-1]
+  if not 1 <= n <= blockSize or data[-n:] != bytearray([n] * n):
+    raise ValueError("invalid PKCS#7 padding")
+  return data[:-n]
+
+def readExactly(f, n):
+  """Reads up to n bytes, only returning less at the end of the file."""
+  parts = []
+  while n:
+    part = f.read(n)
+    if not part:
+      break
+    parts.append(part)
+    n -= len(part)
+  return ''.join(parts)
+
+def checkInput(cipher, data, mode, iv, engine):
+  if mode not in (ECB, CBC, CTR):
+    raise ValueError("unsupported mode %r" % (mode,))
+  if engine not in (TTABLE, NUMPY, BITSLICE):
+    raise ValueError("unsupported engine %r" % (engine,))
+  if engine == NUMPY and mode == CBC:
+    raise ValueError("the numpy engine supports ECB and CTR only")
+  if engine == BITSLICE and mode != CTR:
+    raise ValueError("the bitslice engine supports CTR only")
+  if mode != CTR and len(data) % cipher.blockSize:
+    raise ValueError("data length %d is not a multiple of the block size %d" %
+                     (len(data), cipher.blockSize))
+  if mode != ECB and (iv is None or len(iv) != cipher.blockSize):
+    raise ValueError("%s needs an IV of %d bytes" % (mode, cipher.blockSize))
+
+def counterWords(counter, nb):
+  """Words of the counter block for counter, wrapping at the block size."""
+  return [(counter >> (32 * (nb - 1 - j))) & 0xFFFFFFFF for j in range(0, nb)]
+
+def counterAt(iv, index, blockSize):
+  """The counter block index blocks after iv."""
+  counter = (int(bytes(iv).encode('hex'), 16) + index) % (1 << (8 * blockSize))
+  return ('%0*x' % (2 * blockSize, counter)).decode('hex')
+
+def ctr(cipher, data, iv, engine=TTABLE):
+  """XORs data with the keystream of counter blocks iv, iv + 1, ...
+
+  data does not need to be a multiple of the block size. Encryption and
+  decryption are the same operation.
+  """
+  if engine == NUMPY:
+    return NumpyEngine(cipher).ctr(data, iv)
+  if engine == BITSLICE:
+    return BitslicedEngine(cipher).ctr(data, iv)
+  nb = cipher.nb
+  encrypt = cipher.encryptWords
+  tail = -len(data) % cipher.blockSize
+  words = bytesToWords(bytes(data) + '\0' * tail)
+  out = [0] * len(words)
+  counter = int(bytes(iv).encode('hex'), 16)
+  for i in range(0, len(words), nb):
+    block = encrypt(counterWords(counter + i / nb, nb))
+    out[i:i+nb] = [w ^ k for w, k in zip(words[i:i+nb], block)]
+  return wordsToBytes(out)[:len(data)]
+
+def ctrAt(cipher, data, iv, offset, engine=TTABLE):
+  """CTR of data that starts offset bytes into the stream of iv.
+
+  The counter block of offset is computed directly, so this costs the
+  same anywhere in the stream.
+  """
+  blockSize = cipher.blockSize
+  skip = offset % blockSize
+  return ctr(cipher, '\0' * skip + bytes(data),
+             counterAt(iv, offset / blockSize, blockSize), engine)[skip:]
+
+def encrypt_blocks(cipher, data, mode=ECB, iv=None, padding=False,
+                   engine=TTABLE):
+  """Encrypts a whole buffer with cipher, a Rijndael context."""
+  if padding:
+    data = pkcs7Pad(data, cipher.blockSize)
+  checkInput(cipher, data, mode, iv, engine)
+  if mode == CTR:
+    return ctr(cipher, data, iv, engine)
+  if engine == NUMPY:
+    numpyEngine = NumpyEngine(cipher)
+    return bytearray(numpyEngine.encrypt(numpyEngine.toBlocks(data)).tobytes())
+  nb = cipher.nb
+  encrypt = cipher.encryptWords
+  words = bytesToWords(data)
+  out = [0] * len(words)
+  if mode == ECB:
+    for i in range(0, len(words), nb):
+      out[i:i+nb] = encrypt(words[i:i+nb])
+  else:
+    chain = bytesToWords(iv)
+    for i in range(0, len(words), nb):
+      chain = encrypt([w ^ c for w, c in zip(words[i:i+nb], chain)])
+      out[i:i+nb] = chain
+  return wordsToBytes(out)
+
+def ctrInto(cipher, data, out, offset, iv):
+  n = cipher.checkInto(data, out, offset, partial=True)
+  nb, blockSize = cipher.nb, cipher.blockSize
+  encrypt = cipher.encryptWords
+  unpack, pack = cipher.blockStruct.unpack_from, cipher.blockStruct.pack_into
+  counter = int(bytes(iv).encode('hex'), 16)
+  full = n - n % blockSize
+  for pos in xrange(0, full, blockSize):
+    block = encrypt(counterWords(counter + pos / blockSize, nb))
+    pack(out, offset + pos, *[w ^ k for w, k in
+                              zip(unpack(data, pos), block)])
+  if full < n:
+    tail = struct.Struct("%dB" % (n - full))
+    keystream = wordsToBytes(encrypt(counterWords(counter + full / blockSize,
+                                                  nb)))
+    tail.pack_into(out, offset + full, *[b ^ k for b, k in
+                                         zip(tail.unpack_from(data, full),
+                                             keystream)])
+  return n
+
+def encrypt_into(cipher, data, out, offset=0, mode=ECB, iv=None):
+  """encrypt_blocks() from any buffer into out at byte offset.
+
+  See Rijndael.encrypt_into for the buffers. Memory use does not depend
+  on the size of data, and out can be data itself. Returns the number of
+  bytes written.
+  """
+  checkInput(cipher, '', mode, iv, TTABLE)
+  if mode == ECB:
+    return cipher.encrypt_into(data, out, offset)
+  if mode == CTR:
+    return ctrInto(cipher, data, out, offset, iv)
+  n = cipher.checkInto(data, out, offset)
+  encrypt = cipher.encryptWords
+  unpack, pack = cipher.blockStruct.unpack_from, cipher.blockStruct.pack_into
+  chain = bytesToWords(iv)
+  for pos in xrange(0, n, cipher.blockSize):
+    chain = encrypt([w ^ c for w, c in zip(unpack(data, pos), chain)])
+    pack(out, offset + pos, *chain)
+  return n
+
+def decrypt_into(cipher, data, out, offset=0, mode=ECB, iv=None):
+  """decrypt_blocks() from any buffer into out, see encrypt_into."""
+  checkInput(cipher, '', mode, iv, TTABLE)
+  if mode == ECB:
+    return cipher.decrypt_into(data, out, offset)
+  if mode == CTR:
+    return ctrInto(cipher, data, out, offset, iv)
+  n = cipher.checkInto(data, out, offset)
+  decrypt = cipher.decryptWords
+  unpack, pack = cipher.blockStruct.unpack_from, cipher.blockStruct.pack_into
+  chain = bytesToWords(iv)
+  for pos in xrange(0, n, cipher.blockSize):
+    # Read before writing, out may be data.
+    block = unpack(data, pos)
+    pack(out, offset + pos, *[w ^ c for w, c in zip(decrypt(block), chain)])
+    chain = block
+  return n
+
+def decrypt_blocks(cipher, data, mode=ECB, iv=None, padding=False,
+                   engine=TTABLE):
+  """Decrypts a whole buffer with cipher, a Rijndael context.
+
+  In CBC mode all blocks are decrypted independently first, and the
+  chaining XOR with the previous ciphertext block is applied in a second
+  pass.
+  """
+  checkInput(cipher, data, mode, iv, engine)
+  if mode == CTR:
+    out = ctr(cipher, data, iv, engine)
+  elif engine == NUMPY:
+    numpyEngine = NumpyEngine(cipher)
+    out = bytearray(numpyEngine.decrypt(numpyEngine.toBlocks(data)).tobytes())
+  else:
+    nb = cipher.nb
+    decrypt = cipher.decryptWords
+    words = bytesToWords(data)
+    out = [0] * len(words)
+    for i in range(0, len(words), nb):
+      out[i:i+nb] = decrypt(words[i:i+nb])
+    if mode == CBC:
+      chain = bytesToWords(iv) + words[:-nb]
+      out = [o ^ c for o, c in zip(out, chain)]
+    out = wordsToBytes(out)
+  if padding:
+    out = pkcs7Unpad(out, cipher.blockSize)
+  return out
+
+def throughput(function, size, repeat=3):
+  """Returns the best throughput of function(data) in MB/s."""
+  data = bytearray(os.urandom(size))
+  best = None
+  for i in range(0, repeat):
+    start = time.time()
+    function(data)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return size / best / 1e6
+
+
+if __name__ == '__main__':
+  cipher = Rijndael(bytearray(range(16)))
+  iv = bytearray(16)
+  size = 1 << 16
+  print "ECB encrypt: %.3f MB/s" % throughput(
+    lambda d: encrypt_blocks(cipher, d), size)
+  print "CBC encrypt: %.3f MB/s" % throughput(
+    lambda d: encrypt_blocks(cipher, d, CBC, iv), size)
+  print "CTR: %.3f MB/s" % throughput(lambda d: ctr(cipher, d, iv), size)
+  print "CTR (bitslice): %.3f MB/s" % throughput(
+    lambda d: ctr(cipher, d, iv, BITSLICE), size)
+  try:
+    print "ECB encrypt (numpy): %.3f MB/s" % throughput(
+      lambda d: encrypt_blocks(cipher, d, engine=NUMPY), size)
+    print "CTR (numpy): %.3f MB/s" % throughput(
+      lambda d: ctr(cipher, d, iv, NUMPY), size)
+  except RuntimeError as e:
+    print "numpy engine unavailable:", e
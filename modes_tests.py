@@ -0,0 +1,168 @@
+from aes_tests import parseHex
+import aes
+import aesnumpy
+import modes
+
+import array
+import mmap
+import os
+import unittest
+
+# NIST SP 800-38A, F.1.1 and F.2.1
+key = parseHex("2b7e151628aed2a6abf7158809cf4f3c")
+iv = parseHex("000102030405060708090a0b0c0d0e0f")
+plaintext = parseHex("6bc1bee22e409f96e93d7e117393172a"
+                     "ae2d8a571e03ac9c9eb76fac45af8e51")
+ecbCiphertext = parseHex("3ad77bb40d7a3660a89ecaf32466ef97"
+                         "f5d3d58503b9699de785895a96fdbaaf")
+cbcCiphertext = parseHex("7649abac8119b246cee98e9b12e9197d"
+                         "5086cb9b507219ee95db113a917678b2")
+# NIST SP 800-38A, F.5.1
+ctrIV = parseHex("f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff")
+ctrCiphertext = parseHex("874d6191b620e3261bef6864990db6ce"
+                         "9806f66b7970fdff8617187bb9fffdff")
+
+class ModesTests(unittest.TestCase):
+  def setUp(self):
+    self.cipher = aes.Rijndael(key)
+
+  def test_ecb(self):
+    self.assertEqual(ecbCiphertext, modes.encrypt_blocks(self.cipher, plaintext))
+    self.assertEqual(plaintext, modes.decrypt_blocks(self.cipher, ecbCiphertext))
+
+  def test_cbc(self):
+    self.assertEqual(cbcCiphertext, modes.encrypt_blocks(
+      self.cipher, plaintext, modes.CBC, iv))
+    self.assertEqual(plaintext, modes.decrypt_blocks(
+      self.cipher, cbcCiphertext, modes.CBC, iv))
+
+  def test_padding(self):
+    msg = bytearray("attack at dawn")
+    ct = modes.encrypt_blocks(self.cipher, msg, modes.CBC, iv, padding=True)
+    self.assertEqual(16, len(ct))
+    self.assertEqual(msg, modes.decrypt_blocks(
+      self.cipher, ct, modes.CBC, iv, padding=True))
+
+  def test_pkcs7(self):
+    self.assertEqual(bytearray([4] * 4), modes.pkcs7Pad(bytearray(), 4))
+    self.assertEqual(bytearray("ab"), modes.pkcs7Unpad(bytearray("ab\x02\x02"), 4))
+    self.assertRaises(ValueError, modes.pkcs7Unpad, bytearray("ab\x01\x02"), 4)
+    self.assertRaises(ValueError, modes.pkcs7Unpad, bytearray("abc\x05"), 4)
+
+  def test_bad_input(self):
+    self.assertRaises(ValueError, modes.encrypt_blocks, self.cipher, bytearray(15))
+    self.assertRaises(ValueError, modes.encrypt_blocks, self.cipher,
+                      bytearray(16), modes.CBC)
+
+  def test_ctr(self):
+    self.assertEqual(ctrCiphertext, modes.encrypt_blocks(
+      self.cipher, plaintext, modes.CTR, ctrIV))
+    self.assertEqual(plaintext[:21], modes.decrypt_blocks(
+      self.cipher, ctrCiphertext[:21], modes.CTR, ctrIV))
+
+class IntoTests(unittest.TestCase):
+  def setUp(self):
+    self.cipher = aes.Rijndael(key)
+
+  def test_buffers(self):
+    expected = modes.encrypt_blocks(self.cipher, plaintext)
+    mapped = mmap.mmap(-1, len(plaintext))
+    mapped[:] = bytes(plaintext)
+    for data in [bytes(plaintext), plaintext, memoryview(plaintext),
+                 array.array('B', plaintext), array.array('I', bytes(plaintext)),
+                 mapped]:
+      for out in [bytearray(40), array.array('B', [0] * 40),
+                  memoryview(bytearray(40)), mmap.mmap(-1, 40)]:
+        self.assertEqual(32, self.cipher.encrypt_into(data, out, 8))
+        self.assertEqual(expected, bytearray(out)[8:])
+
+  def test_in_place(self):
+    for mode, modeIV, ciphertext in [(modes.ECB, None, ecbCiphertext),
+                                     (modes.CBC, iv, cbcCiphertext),
+                                     (modes.CTR, ctrIV, ctrCiphertext)]:
+      buf = bytearray(plaintext)
+      modes.encrypt_into(self.cipher, buf, buf, 0, mode, modeIV)
+      self.assertEqual(ciphertext, buf)
+      modes.decrypt_into(self.cipher, buf, buf, 0, mode, modeIV)
+      self.assertEqual(plaintext, buf)
+
+  def test_ctr_partial_block(self):
+    data = os.urandom(37)
+    out = bytearray(40)
+    self.assertEqual(37, modes.encrypt_into(self.cipher, data, out, 3,
+                                            modes.CTR, ctrIV))
+    self.assertEqual(modes.ctr(self.cipher, data, ctrIV), out[3:])
+    self.assertEqual(bytearray(3), out[:3])
+
+  def test_bad_input(self):
+    self.assertRaises(ValueError, self.cipher.encrypt_into, plaintext[:20],
+                      bytearray(32))
+    self.assertRaises(ValueError, self.cipher.encrypt_into, plaintext,
+                      bytearray(40), 9)
+    self.assertRaises(ValueError, modes.encrypt_into, self.cipher, plaintext,
+                      bytearray(32), 0, modes.CBC)
+    self.assertRaises(TypeError, self.cipher.encrypt_into, plaintext,
+                      bytes(plaintext))
+
+@unittest.skipIf(aesnumpy.numpy is None, "numpy is not installed")
+class NumpyEngineTests(unittest.TestCase):
+  def test_ecb_matches_ttable(self):
+    for blockSize, keySize in [(16, 16), (20, 32), (32, 24)]:
+      cipher = aes.Rijndael(bytearray(os.urandom(keySize)), blockSize)
+      data = bytearray(os.urandom(4 * blockSize))
+      ct = modes.encrypt_blocks(cipher, data)
+      self.assertEqual(ct, modes.encrypt_blocks(cipher, data,
+                                                engine=modes.NUMPY))
+      self.assertEqual(data[:blockSize], modes.decrypt_blocks(
+        cipher, ct[:blockSize], engine=modes.NUMPY))
+
+  def test_ctr_matches_ttable(self):
+    cipher = aes.Rijndael(key)
+    self.assertEqual(ctrCiphertext, modes.encrypt_blocks(
+      cipher, plaintext, modes.CTR, ctrIV, engine=modes.NUMPY))
+    # The low 64 bits of the counter wrap after the first block.
+    iv = parseHex("00000000000000ffffffffffffffffff")
+    data = bytearray(os.urandom(50))
+    self.assertEqual(modes.ctr(cipher, data, iv),
+                     modes.ctr(cipher, data, iv, modes.NUMPY))
+
+  def test_cbc_unsupported(self):
+    self.assertRaises(ValueError, modes.encrypt_blocks, aes.Rijndael(key),
+                      plaintext, modes.CBC, iv, engine=modes.NUMPY)
+
+@unittest.skipIf(aesnumpy.numpy is None, "numpy is not installed")
+class MultiKeyEngineTests(unittest.TestCase):
+  def test_matches_contexts(self):
+    for blockSize in (16, 20, 32):
+      engine = aesnumpy.MultiKeyEngine(blockSize)
+      # Mixed key sizes come back in the order of the input.
+      keys = [os.urandom(4 * (4 + i % 5)) for i in range(0, 23)]
+      blocks = [os.urandom(blockSize) for i in range(0, 23)]
+      out = engine.encrypt_blocks(keys, blocks)
+      self.assertEqual([aes.Rijndael(bytearray(k), blockSize).encrypt_block(
+        bytearray(b)) for k, b in zip(keys, blocks)], out)
+      self.assertEqual([bytearray(b) for b in blocks],
+                       engine.decrypt_blocks(keys, out))
+
+  def test_expand_keys(self):
+    engine = aesnumpy.MultiKeyEngine(24)
+    keys = [bytearray(os.urandom(32)) for i in range(0, 5)]
+    roundKeys = engine.expandKeys(aesnumpy.numpy.array(keys))
+    for i, key in enumerate(keys):
+      expanded = aes.expandKey(key, 6)[1]
+      self.assertEqual(bytearray().join(expanded),
+                       bytearray(roundKeys[:, i].tobytes()))
+
+  def test_bad_input(self):
+    engine = aesnumpy.MultiKeyEngine()
+    self.assertRaises(ValueError, engine.encrypt_blocks, [key], [])
+    self.assertRaises(ValueError, engine.encrypt_blocks, [key], [key[:15]])
+    self.assertRaises(ValueError, engine.encrypt_blocks, [key[:15]], [key])
+    self.assertRaises(ValueError, aesnumpy.MultiKeyEngine, 15)
+
+  def test_key_expansion_report(self):
+    report = aesnumpy.keyExpansionReport(4, 4, [1, 8])
+    self.assertEqual([1, 8], [r['keys'] for r in report])
+
+if __name__ == '__main__':
+    unittest.main()
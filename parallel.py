@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# Multi-process driver for the parallelizable modes.
+#
+# The input is cut into chunks of whole blocks that are encrypted by a
+# multiprocessing pool. The Rijndael context, including its expanded key,
+# is handed to every worker once by the pool initializer, so a task only
+# carries its chunk and the IV or counter it starts at. Results come back
+# through imap and are therefore in input order.
+
+from aes import Rijndael
+import hashlib
+import modes
+import multiprocessing
+import os
+import time
+
+DefaultChunkSize = 1 << 16
+
+# Cipher context and engine of a worker process, set by initWorker.
+workerCipher = None
+workerEngine = None
+
+def initWorker(cipher, engine):
+  global workerCipher, workerEngine
+  workerCipher = cipher
+  workerEngine = engine
+
+def runChunk(task):
+  encrypt, mode, chunk, iv = task
+  if encrypt:
+    return modes.encrypt_blocks(workerCipher, chunk, mode, iv,
+                                engine=workerEngine)
+  return modes.decrypt_blocks(workerCipher, chunk, mode, iv,
+                              engine=workerEngine)
+
+
+class ParallelCipher(object):
+  """Runs ECB, CTR and CBC decryption of one cipher context on a pool."""
+  def __init__(self, cipher, workers=None, chunkSize=DefaultChunkSize,
+               engine=modes.TTABLE):
+    if chunkSize < cipher.blockSize:
+      raise ValueError("chunk size %d is smaller than a block" % chunkSize)
+    self.cipher = cipher
+    self.engine = engine
+    self.workers = workers or multiprocessing.cpu_count()
+    self.chunkSize = chunkSize - chunkSize % cipher.blockSize
+    self.pool = multiprocessing.Pool(self.workers, initWorker,
+                                     (cipher, engine))
+
+  def tasks(self, data, encrypt, mode, iv):
+    blockSize = self.cipher.blockSize
+    for start in range(0, len(data), self.chunkSize):
+      chunk = bytes(data[start:start + self.chunkSize])
+      if mode == modes.CTR:
+        chunkIV = modes.counterAt(iv, start / blockSize, blockSize)
+      elif mode == modes.CBC:
+        chunkIV = bytes(data[start - blockSize:start]) if start else iv
+      else:
+        chunkIV = None
+      yield (encrypt, mode, chunk, chunkIV)
+
+  def run(self, data, encrypt, mode, iv):
+    if mode == modes.CBC and encrypt:
+      raise ValueError("CBC encryption is sequential and can't be parallelized")
+    modes.checkInput(self.cipher, data, mode, iv, self.engine)
+    return bytearray().join(
+      self.pool.imap(runChunk, self.tasks(data, encrypt, mode, iv)))
+
+  def encrypt(self, data, mode=modes.ECB, iv=None):
+    return self.run(data, True, mode, iv)
+
+  def decrypt(self, data, mode=modes.ECB, iv=None):
+    return self.run(data, False, mode, iv)
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def scalingReport(cipher, size, workerCounts, mode=modes.CTR,
+                  chunkSize=DefaultChunkSize):
+  """Times encryption of size bytes for each worker count.
+
+  Returns one dict per worker count with the elapsed seconds, the speedup
+  over a single worker and the scaling efficiency, which is the speedup
+  divided by the worker count. The single worker run is timed as well if
+  workerCounts lacks it. sha256 is the digest of the ciphertext, which
+  must not depend on the worker count.
+  """
+  data = bytearray(os.urandom(size))
+  iv = bytearray(cipher.blockSize)
+  seconds = {}
+  digests = {}
+  for workers in sorted(set([1] + list(workerCounts))):
+    with ParallelCipher(cipher, workers, chunkSize) as p:
+      start = time.time()
+      out = p.encrypt(data, mode, iv)
+      seconds[workers] = time.time() - start
+    digests[workers] = hashlib.sha256(out).hexdigest()
+  report = []
+  for workers in workerCounts:
+    elapsed = seconds[workers]
+    speedup = seconds[1] / elapsed
+    report.append({'workers': workers, 'seconds': elapsed,
+                   'MB/s': size / elapsed / 1e6, 'speedup': speedup,
+                   'efficiency': speedup / workers,
+                   'sha256': digests[workers]})
+  return report
+
+
+if __name__ == '__main__':
+  cipher = Rijndael(bytearray(range(16)))
+  counts = sorted(set([1, 2, multiprocessing.cpu_count()]))
+  for r in scalingReport(cipher, 1 << 20, counts):
+    print "%(workers)2d workers: %(MB/s).3f MB/s, speedup %(speedup).2f, " \
+      "efficiency %(efficiency).2f" % r
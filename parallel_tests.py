@@ -0,0 +1,45 @@
+from modes_tests import key, iv, plaintext, cbcCiphertext
+import aes
+import modes
+import parallel
+
+import os
+import unittest
+
+class ParallelTests(unittest.TestCase):
+  def setUp(self):
+    self.cipher = aes.Rijndael(key)
+    self.data = bytearray(os.urandom(16 * 37 + 5))
+
+  def test_ecb_and_ctr_match_modes(self):
+    data = self.data[:16 * 37]
+    with parallel.ParallelCipher(self.cipher, 3, 64) as p:
+      self.assertEqual(modes.encrypt_blocks(self.cipher, data),
+                       p.encrypt(data))
+      self.assertEqual(modes.ctr(self.cipher, self.data, iv),
+                       p.encrypt(self.data, modes.CTR, iv))
+
+  def test_cbc_decrypt(self):
+    with parallel.ParallelCipher(self.cipher, 2, 16) as p:
+      self.assertEqual(plaintext, p.decrypt(cbcCiphertext, modes.CBC, iv))
+      self.assertRaises(ValueError, p.encrypt, plaintext, modes.CBC, iv)
+    # Rejected before any task reaches the (closed) pool.
+    p = parallel.ParallelCipher(self.cipher, 1, 16, modes.NUMPY)
+    p.close()
+    self.assertRaises(ValueError, p.decrypt, cbcCiphertext, modes.CBC, iv)
+
+  def test_counter_at(self):
+    self.assertEqual('\x00' * 15 + '\x02', modes.counterAt('\xff' * 16, 3, 16))
+
+  def test_scaling_report(self):
+    report = parallel.scalingReport(self.cipher, 4096, [1, 2, 3],
+                                    chunkSize=1024)
+    self.assertEqual([1, 2, 3], [r['workers'] for r in report])
+    self.assertEqual(1.0, report[0]['efficiency'])
+    # Every worker count encrypted the same data to the same ciphertext.
+    self.assertEqual(1, len(set([r['sha256'] for r in report])))
+    report = parallel.scalingReport(self.cipher, 4096, [2], chunkSize=1024)
+    self.assertEqual([2], [r['workers'] for r in report])
+
+if __name__ == '__main__':
+    unittest.main()
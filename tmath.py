@@ -2,8 +2,16 @@
 # -*- coding: utf-8 -*-
 # Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
 
+from lrucache import LRUCache
+
+# Default number of results a memoized field keeps per operation.
+DefaultMemoCapacity = 1024
 
 class Field(object):
+  # LRU caches of mulInv and longDiv results, see memoize().
+  inverseCache = None
+  divCache = None
+
   def plusID(self):
     raise NotImplementedError
 
@@ -17,8 +25,68 @@ class Field(object):
     raise NotImplementedError
 
   def longDiv(self, a, b):
+    """Returns (quotient, reminder) of a / b."""
+    cache = self.divCache
+    if cache is None:
+      return self.computeLongDiv(a, b)
+    key = (a, b)
+    res = cache.get(key)
+    if res is None:
+      res = self.computeLongDiv(a, b)
+      # Elements are mutable, so neither keys nor results are shared.
+      cache.put((a.clone(), b.clone()), (res[0].clone(), res[1].clone()))
+      return res
+    return (res[0].clone(), res[1].clone())
+
+  def computeLongDiv(self, a, b):
     raise NotImplementedError
 
+  def batchMulInv(self, elements):
+    """Inverses of all elements, with zero mapped to zero.
+
+    Montgomery's trick: the prefix products a_0 * ... * a_i are inverted
+    once, and walking back every inverse is peeled off with two
+    multiplications, 3n multiplications and one mulInv in total.
+    """
+    # prefixes[i] is the product of the non-zero elements before i.
+    prefixes = []
+    acc = self.mulID()
+    for a in elements:
+      prefixes.append(acc)
+      if not a.isPlusID():
+        acc = self.mul(acc, a)
+    inv = acc.mulInv()
+    res = [None] * len(elements)
+    for i in range(len(elements) - 1, -1, -1):
+      a = elements[i]
+      if a.isPlusID():
+        res[i] = self.plusID()
+      else:
+        res[i] = self.mul(inv, prefixes[i])
+        inv = self.mul(inv, a)
+    return res
+
+  def memoize(self, capacity=DefaultMemoCapacity):
+    """Keeps the last capacity results of mulInv and longDiv.
+
+    Off by default. The caches belong to this field object, so elements
+    must be hashable and equal elements must hash alike. They are
+    LRUCaches and may be shared between threads.
+    """
+    self.inverseCache = LRUCache(capacity)
+    self.divCache = LRUCache(capacity)
+
+  def unmemoize(self):
+    self.inverseCache = None
+    self.divCache = None
+
+  def memoStats(self):
+    """Hit and miss counts of the caches, None if not memoized."""
+    if self.inverseCache is None:
+      return None
+    return {'mulInv': self.inverseCache.stats(),
+            'longDiv': self.divCache.stats()}
+
   def __str__(self):
     raise NotImplementedError
 
@@ -27,6 +95,8 @@ class Field(object):
 
 
 class FieldElement(object):
+  __slots__ = ('field',)
+
   def __init__(self, field):
     self.field = field
 
@@ -63,33 +133,69 @@ class FieldElement(object):
     """Scalar power"""
     return self.opN(scalar, self.field.mulID(), self.field.mul)
 
+  def mulInv(self):
+    cache = self.field.inverseCache
+    if cache is None:
+      return self.computeMulInv()
+    res = cache.get(self)
+    if res is None:
+      res = self.computeMulInv()
+      cache.put(self.clone(), res.clone())
+      return res
+    return res.clone()
+
+  def computeMulInv(self):
+    raise NotImplementedError
+
   def __eq__(self, other):
     raise NotImplementedError
 
+  def __ne__(self, other):
+    return not self == other
+
+
+# Z(n) up to this order shares one element per value.
+InternMaxOrder = 256
 
 class Z(Field):
-  """Implementation of the mathemical set Z/nZ."""
+  """Implementation of the mathemical set Z/nZ.
+
+  Small fields intern their elements: every operation returns the shared
+  element of its result instead of allocating a new one. Interned
+  elements are immutable.
+  """
   def __init__(self, order):
     super(Z, self).__init__()
     self.order = order
+    # elements[v] is the shared element of value v, or None if order is
+    # larger than InternMaxOrder.
+    self.elements = None
+    if order <= InternMaxOrder:
+      self.elements = [ZElement(v, self) for v in range(0, order)]
+
+  def element(self, value):
+    """The element of value, shared if this field interns them."""
+    if self.elements is not None:
+      return self.elements[value % self.order]
+    return ZElement(value, self)
 
   def getOrder(self):
     return self.order
 
   def plusID(self):
-    return ZElement(0, self)
+    return self.element(0)
 
   def plus(self, a, b):
     if a.field == b.field:
-      return ZElement(a.value + b.value, self)
+      return self.element(a.value + b.value)
     else:
-      raise Error, 'Trying to add ZElements from different Z classes'
+      raise ValueError('Trying to add ZElements from different Z classes')
 
   def mulID(self):
-    return ZElement(1, self)
+    return self.element(1)
 
   def mul(self, a, b):
-    return ZElement(a.value * b.value, self)
+    return self.element(a.value * b.value)
 
   def __str__(self):
     return "Z(%d)" % self.order
@@ -98,13 +204,15 @@ class Z(Field):
     return "Z(%d)" % self.order
 
   def fromInt(self, i):
-    return ZElement(i, self)
+    return self.element(i)
 
   def enum(self, i):
-    return (ZElement(i % self.order, self), i/self.order)
+    return (self.element(i), i/self.order)
 
 
 class ZElement(FieldElement):
+  __slots__ = ('value',)
+
   def __init__(self, value, field):
     super(ZElement, self).__init__(field)
     self.value = value % field.order
@@ -115,22 +223,36 @@ class ZElement(FieldElement):
   def __repr__(self):
     return "%(v)d" % {'v':self.value, 's':self.field }
 
+  def isPlusID(self):
+    return self.value == 0
+
+  def isMulID(self):
+    return self.value == 1 % self.field.order
+
   def setValue(self, value):
+    if self.field.elements is not None:
+      raise TypeError("elements of %s are interned and can't be modified" %
+                      self.field)
     self.value = value % self.field.order
     return self
 
   def plusInv(self):
-    return ZElement(self.field.order - self.value, self.field)
+    return self.field.element(self.field.order - self.value)
 
-  def mulInv(self):
+  def computeMulInv(self):
     return self.scalarPow(self.field.order - 2)
 
   def clone(self):
+    if self.field.elements is not None:
+      return self
     return ZElement(self.value, self.field)
 
   def __eq__(self, a):
     return self.value == a.value
 
+  def __hash__(self):
+    return hash(self.value)
+
   def toInt(self):
     return self.value
 
@@ -143,6 +265,8 @@ class POF(Field):
   def __init__(self, field):
     super(POF, self).__init__()
     self.field = field
+    # Shared coefficient returned by getCoefficient. Don't modify it.
+    self.zero = field.plusID()
 
   def plus(self, a, b):
     newp = a.clone()
@@ -161,7 +285,7 @@ class POF(Field):
             b.getCoefficient(k2)))
     return newp
 
-  def longDiv(self, dividend, divisor):
+  def computeLongDiv(self, dividend, divisor):
     """Divides dividend by divisor."""
 
     # Divides
@@ -234,6 +358,8 @@ class POF(Field):
     return res
 
 class POFElement(FieldElement):
+  __slots__ = ('pof', 'c')
+
   def __init__(self, pof):
     super(POFElement, self).__init__(pof)
     self.pof = pof
@@ -249,7 +375,7 @@ class POFElement(FieldElement):
     return self
 
   def getCoefficient(self, n):
-    return self.c.get(n, self.pof.field.plusID())
+    return self.c.get(n, self.pof.zero)
 
   def addToCoefficient(self, n, i):
     return self.setCoefficient(n, self.pof.field.plus(self.getCoefficient(n), i))
@@ -264,6 +390,13 @@ class POFElement(FieldElement):
   def nonZeroCoefficients(self):
     return self.c.keys()
 
+  def isPlusID(self):
+    # Zero coefficients are never stored.
+    return not self.c
+
+  def isMulID(self):
+    return len(self.c) == 1 and 0 in self.c and self.c[0].isMulID()
+
   def plusInv(self):
     newp = self.pof.plusID()
     for i in self.nonZeroCoefficients():
@@ -304,8 +437,15 @@ class POFElement(FieldElement):
     return pol
 
   def __eq__(self, other):
+    if not isinstance(other, POFElement):
+      return NotImplemented
     return self.c == other.c
 
+  def __hash__(self):
+    # The bitmask of the nonzero coefficients, as BinaryPOFElement
+    # hashes, so that equal polynomials of both classes hash alike.
+    return hash(sum([1 << k for k in self.c]))
+
   def toEL(self):
     """Get coefficient list in underlying field from polynomial."""
     # FIXME: This seems horribly complicated.
@@ -325,12 +465,74 @@ class POFElement(FieldElement):
       res *= self.field.getOrder()
     return res
 
+# GFPOF builds log/antilog tables for binary fields up to this degree.
+LogTableMaxDegree = 16
+
 class GFPOF(POF):
   """Implementation of a Galois field."""
-  def __init__(self, field, rp):
+  def __init__(self, field, rp, logTables=True):
     # Field is coefficent field.
     super(GFPOF, self).__init__(field)
     self.rp = rp
+    # Polynomial ring of rp, in which mulInv runs ExtEuclidean.
+    self.ring = POF(field)
+    # log and exp are the log/antilog tables over a generator of the
+    # multiplicative group, or None if this field uses the generic
+    # arithmetic. Elements are indexed by their coefficient bits.
+    self.log = None
+    self.exp = None
+    if (logTables and isinstance(field, Z) and field.getOrder() == 2 and
+        2 <= rp.getDegree() <= LogTableMaxDegree):
+      self.buildLogTables()
+
+  def buildLogTables(self):
+    tables = logTables(self.toBits(self.rp), self.rp.getDegree())
+    if tables is not None:
+      self.exp, self.log, self.order = tables
+
+  def toBits(self, a):
+    """Coefficient bits of a polynomial over Z(2)."""
+    bits = 0
+    for k in a.nonZeroCoefficients():
+      bits |= 1 << k
+    return bits
+
+  def fromBits(self, bits):
+    res = self.plusID()
+    one = self.field.mulID()
+    k = 0
+    while bits:
+      if bits & 1:
+        res.c[k] = one
+      bits = bits >> 1
+      k += 1
+    return res
+
+  def batchMulInv(self, elements):
+    # With log tables every inverse is a single lookup.
+    if self.exp is not None:
+      return [self.plusID() if a.isPlusID() else a.mulInv() for a in elements]
+    return super(GFPOF, self).batchMulInv(elements)
+
+  def memoize(self, capacity=DefaultMemoCapacity):
+    """Also memoizes longDiv of ring, which mulInv runs ExtEuclidean in."""
+    super(GFPOF, self).memoize(capacity)
+    self.ring.memoize(capacity)
+
+  def unmemoize(self):
+    super(GFPOF, self).unmemoize()
+    self.ring.unmemoize()
+
+  def memoStats(self):
+    stats = super(GFPOF, self).memoStats()
+    if stats is not None:
+      stats['ring.longDiv'] = self.ring.memoStats()['longDiv']
+    return stats
+
+  def mulBitsTable(self, a, b):
+    if a == 0 or b == 0:
+      return 0
+    return self.exp[self.log[a] + self.log[b]]
 
   def plusID(self):
     return GFPOFElement(self)
@@ -338,6 +540,10 @@ class GFPOF(POF):
   def mul(self, a, b):
     """Multiplies two polynomials and applies the reduction polynomial."""
 
+    # Small binary fields look the product up in their log tables.
+    if self.exp is not None:
+      return self.fromBits(self.mulBitsTable(self.toBits(a), self.toBits(b)))
+
     # We classically think about polynomial multiplication as:
     #
     # (a_3 x^3 + a_2 x^2 + a_1 x + a_0) * (b_3 x^3 + b_2 x^2 + b_1 x + b_0) as
@@ -395,6 +601,8 @@ class GFPOF(POF):
 
 
 class GFPOFElement(POFElement):
+  __slots__ = ()
+
   def __init__(self, pof):
     super(GFPOFElement, self).__init__(pof)
     self.pof = pof
@@ -405,14 +613,33 @@ class GFPOFElement(POFElement):
       raise ValueError("can't set coefficient larger than the reduction polynomial's degree.")
     return super(GFPOFElement, self).setCoefficient(n, c)
 
-  def mulInv(self):
-    return ExtEuclidean(POF(self.pof.field), self.pof.rp, self)[2]
+  def computeMulInv(self):
+    gf = self.pof
+    if gf.exp is not None:
+      a = gf.toBits(self)
+      if a == 0:
+        raise ZeroDivisionError("zero has no multiplicative inverse")
+      return gf.fromBits(gf.exp[gf.order - gf.log[a]])
+    return ExtEuclidean(gf.ring, gf.rp, self)[2]
+
+  def scalarPow(self, scalar):
+    gf = self.pof
+    if gf.exp is not None:
+      a = gf.toBits(self)
+      if a == 0:
+        return gf.mulID() if scalar == 0 else gf.plusID()
+      return gf.fromBits(gf.exp[(gf.log[a] * scalar) % gf.order])
+    return super(GFPOFElement, self).scalarPow(scalar)
 
   def xtime(self):
     """Multiplies the polynomial by x.
 
     It is a building block of the multiplication algorithm mul.
     """
+    gf = self.pof
+    if gf.exp is not None:
+      return gf.fromBits(gf.mulBitsTable(gf.toBits(self), 2))
+
     result = self.pof.plusID()
 
     # The polynomial
@@ -442,6 +669,242 @@ class GFPOFElement(POFElement):
 
 
 
+class BinaryPOF(POF):
+  """Polynomials over Z(2) packed into the bits of one integer.
+
+  This is a drop-in replacement for POF(Z(2)). Bit k of an element holds
+  the coefficient of x^k, so addition is XOR, multiplication is carry-less
+  shift-and-XOR and the degree is given by bit_length.
+  """
+  def __init__(self, field):
+    if not isinstance(field, Z) or field.getOrder() != 2:
+      raise ValueError("BinaryPOF needs Z(2) as coefficient field, got %s" %
+                       field)
+    super(BinaryPOF, self).__init__(field)
+    # Shared coefficients returned by getCoefficient, next to self.zero.
+    # Don't modify them.
+    self.one = field.mulID()
+
+  def fromBits(self, bits):
+    return BinaryPOFElement(self, bits)
+
+  def plusID(self):
+    return self.fromBits(0)
+
+  def mulID(self):
+    return self.fromBits(1)
+
+  def plus(self, a, b):
+    return self.fromBits(a.bits ^ b.bits)
+
+  def mul(self, a, b):
+    a = a.bits
+    b = b.bits
+    if a < b:
+      a, b = b, a
+    res = 0
+    while b:
+      if b & 1:
+        res ^= a
+      a = a << 1
+      b = b >> 1
+    return self.fromBits(res)
+
+  def computeLongDiv(self, dividend, divisor):
+    """Divides dividend by divisor, see POF.computeLongDiv."""
+    reminder = dividend.bits
+    d = divisor.bits
+    if not d:
+      raise ZeroDivisionError("polynomial division by zero")
+    dlen = d.bit_length()
+    quotient = 0
+    while reminder.bit_length() >= dlen:
+      xtimes = reminder.bit_length() - dlen
+      quotient |= 1 << xtimes
+      reminder ^= d << xtimes
+    return (self.fromBits(quotient), self.fromBits(reminder))
+
+  def fromEL(self, lst):
+    """Create polynomial from field coefficient list."""
+    bits = 0
+    for i in range(0, len(lst)):
+      if not lst[i].isPlusID():
+        bits |= 1 << i
+    return self.fromBits(bits)
+
+  def fromInt(self, i):
+    return self.fromBits(i)
+
+
+class BinaryPOFElement(FieldElement):
+  __slots__ = ('pof', 'bits')
+
+  def __init__(self, pof, bits=0):
+    super(BinaryPOFElement, self).__init__(pof)
+    self.pof = pof
+    self.bits = bits
+
+  def isPlusID(self):
+    return self.bits == 0
+
+  def isMulID(self):
+    return self.bits == 1
+
+  def setCoefficient(self, n, c):
+    """Sets coefficient of x^n."""
+    if c.isPlusID():
+      self.bits &= ~(1 << n)
+    else:
+      self.bits |= 1 << n
+    return self
+
+  def getCoefficient(self, n):
+    return self.pof.one if self.bits >> n & 1 else self.pof.zero
+
+  def addToCoefficient(self, n, i):
+    if not i.isPlusID():
+      self.bits ^= 1 << n
+    return self
+
+  def getDegree(self):
+    return self.bits.bit_length() - 1 if self.bits else None
+
+  def nonZeroCoefficients(self):
+    bits = self.bits
+    return [k for k in range(0, bits.bit_length()) if bits >> k & 1]
+
+  def plusInv(self):
+    # -1 = 1 in Z(2)
+    return self.clone()
+
+  def clone(self):
+    return self.pof.fromBits(self.bits)
+
+  def xtime(self):
+    return self.pof.fromBits(self.bits << 1)
+
+  def toEL(self):
+    """Get coefficient list in underlying field from polynomial."""
+    field = self.pof.field
+    return [field.fromInt(self.bits >> k & 1)
+            for k in range(0, self.bits.bit_length())]
+
+  def toInt(self):
+    return self.bits
+
+  def __eq__(self, other):
+    if isinstance(other, BinaryPOFElement):
+      return self.bits == other.bits
+    if not isinstance(other, POFElement):
+      return NotImplemented
+    for k, c in other.c.items():
+      if not c.isMulID():
+        return False
+    return self.bits == sum([1 << k for k in other.c])
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.bits)
+
+  def __str__(self):
+    return self.__repr__()
+
+  def __repr__(self):
+    terms = []
+    for k in self.nonZeroCoefficients():
+      if k == 0:
+        terms.append("1")
+      elif k == 1:
+        terms.append(" x")
+      else:
+        terms.append(" x^%d" % k)
+    return " + ".join(terms) if terms else "0"
+
+
+class BinaryGFPOF(BinaryPOF):
+  """Galois field GF(2^n) on the bit representation of BinaryPOF.
+
+  This is a drop-in replacement for GFPOF(Z(2), rp). Fields of degree up
+  to LogTableMaxDegree use log tables, larger ones such as GF(2^128) or
+  GF(2^233) multiply with mulBits.
+  """
+  def __init__(self, field, rp, logTables=True):
+    super(BinaryGFPOF, self).__init__(field)
+    if isinstance(rp, BinaryPOFElement):
+      rpBits = rp.bits
+    else:
+      rpBits = sum([1 << k for k in rp.nonZeroCoefficients()])
+    self.rp = BinaryPOF(field).fromBits(rpBits)
+    self.rpBits = rpBits
+    self.degree = rpBits.bit_length() - 1
+    self.exp = None
+    self.log = None
+    if logTables and 2 <= self.degree <= LogTableMaxDegree:
+      self.buildLogTables()
+
+  def buildLogTables(self):
+    tables = logTables(self.rpBits, self.degree)
+    if tables is not None:
+      self.exp, self.log, self.order = tables
+
+  def fromBits(self, bits):
+    return BinaryGFPOFElement(self, bits)
+
+  def fromInt(self, i):
+    if i >> self.degree:
+      raise ValueError("can't set coefficient larger than the reduction polynomial's degree.")
+    return self.fromBits(i)
+
+  def mul(self, a, b):
+    """Multiplies two polynomials and applies the reduction polynomial."""
+    a = a.bits
+    b = b.bits
+    if self.exp is not None:
+      if a == 0 or b == 0:
+        return self.fromBits(0)
+      return self.fromBits(self.exp[self.log[a] + self.log[b]])
+    return self.fromBits(mulBits(a, b, self.rpBits, self.degree))
+
+  def batchMulInv(self, elements):
+    if self.exp is not None:
+      return [self.plusID() if a.isPlusID() else a.mulInv() for a in elements]
+    return super(BinaryGFPOF, self).batchMulInv(elements)
+
+
+class BinaryGFPOFElement(BinaryPOFElement):
+  __slots__ = ()
+
+  def setCoefficient(self, n, c):
+    if n >= self.pof.degree:
+      raise ValueError("can't set coefficient larger than the reduction polynomial's degree.")
+    return super(BinaryGFPOFElement, self).setCoefficient(n, c)
+
+  def computeMulInv(self):
+    gf = self.pof
+    if self.bits == 0:
+      raise ZeroDivisionError("zero has no multiplicative inverse")
+    if gf.exp is not None:
+      return gf.fromBits(gf.exp[gf.order - gf.log[self.bits]])
+    return gf.fromBits(ExtEuclidean(gf.rp.pof, gf.rp, self)[2].bits)
+
+  def scalarPow(self, scalar):
+    gf = self.pof
+    if gf.exp is not None:
+      if self.bits == 0:
+        return gf.mulID() if scalar == 0 else gf.plusID()
+      return gf.fromBits(gf.exp[(gf.log[self.bits] * scalar) % gf.order])
+    return super(BinaryGFPOFElement, self).scalarPow(scalar)
+
+  def xtime(self):
+    """Multiplies the polynomial by x and applies the reduction polynomial."""
+    bits = self.bits << 1
+    if bits >> self.pof.degree:
+      bits ^= self.pof.rpBits
+    return self.pof.fromBits(bits)
+
+
 def ExtEuclidean(field, a, b):
   """Extended Euclidean algorithm."""
   n1 = a
@@ -462,10 +925,194 @@ def ExtEuclidean(field, a, b):
     x1 = x2
     y0 = y1
     y1 = y2
+    if ActiveProfiler is not None:
+      ActiveProfiler.count('ExtEuclidean.iteration', field)
     (q, r) = field.longDiv(n1, n2)
 #    print "n1:",n1," n2:",n2," q:",q," r:",r, " x2: ", x2 #, " y2:",y2
   return [n2, x1, y1];
 
+def logTables(rp, n):
+  """Log/antilog tables of the binary field with reduction polynomial bits rp.
+
+  Finds a generator and tabulates its powers and their logarithms. The
+  powers are computed with mulBits, the same shift-and-reduce scheme as
+  GFPOF.mul. Returns (exp, log, order), where exp is doubled so that
+  exp[log[a] + log[b]] needs no reduction modulo order, or None if rp is
+  not irreducible and so has no generator.
+  """
+  order = (1 << n) - 1
+  for g in range(2, 1 << n):
+    exp = [1]
+    a = mulBits(1, g, rp, n)
+    while a != 1 and len(exp) < order:
+      exp.append(a)
+      a = mulBits(a, g, rp, n)
+    if a != 1:
+      # In a field every non-zero element returns to 1.
+      return None
+    if len(exp) == order:
+      break
+  else:
+    return None
+  log = [None] * (1 << n)
+  for k in range(0, order):
+    log[exp[k]] = k
+  return (exp + exp, log, order)
+
+def mulBits(a, b, rp, n):
+  """Multiplies coefficient bits of polynomials over Z(2) modulo rp.
+
+  rp are the bits of the reduction polynomial and n its degree. This is
+  the shift-and-reduce multiplication of GFPOF.mul on integers.
+  """
+  res = 0
+  while b:
+    if b & 1:
+      res ^= a
+    b = b >> 1
+    a = a << 1
+    if a >> n:
+      a ^= rp
+  return res
+
+# Field operation profiling. FieldProfiler is a context manager that,
+# while active, replaces the methods in ProfiledMethods with counting
+# wrappers and counts every element constructed. Nothing is patched
+# outside of it, so profiling costs nothing when it is off.
+#
+# Counts are kept per stage, operation and field instance. The stage is
+# set by ProfileStage blocks, which aes.py puts around the code that uses
+# field arithmetic.
+
+# The profiler in effect, or None.
+ActiveProfiler = None
+
+# (class, method) pairs counted by FieldProfiler. Operations are named
+# after the class that defines them, without the compute prefix of the
+# uncached implementations.
+ProfiledMethods = [
+  (Z, 'plus'), (Z, 'mul'), (ZElement, 'plusInv'), (ZElement, 'computeMulInv'),
+  (POF, 'plus'), (POF, 'mul'), (POF, 'computeLongDiv'),
+  (POFElement, 'plusInv'), (POFElement, 'xtime'),
+  (GFPOF, 'mul'), (GFPOFElement, 'computeMulInv'), (GFPOFElement, 'xtime'),
+  (BinaryPOF, 'plus'), (BinaryPOF, 'mul'), (BinaryPOF, 'computeLongDiv'),
+  (BinaryPOFElement, 'xtime'),
+  (BinaryGFPOF, 'mul'), (BinaryGFPOFElement, 'computeMulInv'),
+  (BinaryGFPOFElement, 'xtime'),
+  (Field, 'batchMulInv'), (GFPOF, 'batchMulInv'), (BinaryGFPOF, 'batchMulInv'),
+]
+
+def operationName(cls, method):
+  if method.startswith('compute'):
+    method = method[len('compute')].lower() + method[len('compute') + 1:]
+  return "%s.%s" % (cls.__name__, method)
+
+def fieldLabel(field):
+  """Names a field instance, distinguishing equal fields."""
+  name = repr(field) if isinstance(field, Z) else type(field).__name__
+  return "%s at 0x%x" % (name, id(field))
+
+def countingMethod(function, name):
+  def method(self, *args):
+    field = self if isinstance(self, Field) else self.field
+    ActiveProfiler.count(name, field)
+    return function(self, *args)
+  return method
+
+def countingExtEuclidean(field, a, b):
+  ActiveProfiler.count('ExtEuclidean', field)
+  return plainExtEuclidean(field, a, b)
+
+plainExtEuclidean = ExtEuclidean
+
+def countingInit(self, field):
+  ActiveProfiler.allocated(self)
+  self.field = field
+
+class FieldProfiler(object):
+  """Counts field operations and element allocations while active.
+
+  with FieldProfiler() as profiler:
+    ...
+  print profiler.report()
+  """
+  def __init__(self):
+    self.stage = None
+    self.calls = {}
+    self.allocations = {}
+    self.originals = []
+
+  def count(self, operation, field):
+    key = (self.stage, operation, field)
+    self.calls[key] = self.calls.get(key, 0) + 1
+
+  def allocated(self, element):
+    key = (self.stage, type(element).__name__)
+    self.allocations[key] = self.allocations.get(key, 0) + 1
+
+  def __enter__(self):
+    global ActiveProfiler, ExtEuclidean
+    if ActiveProfiler is not None:
+      raise RuntimeError("a FieldProfiler is already active")
+    ActiveProfiler = self
+    for cls, method in ProfiledMethods:
+      function = cls.__dict__[method]
+      self.originals.append((cls, method, function))
+      setattr(cls, method, countingMethod(function, operationName(cls, method)))
+    self.originals.append((FieldElement, '__init__',
+                           FieldElement.__dict__['__init__']))
+    FieldElement.__init__ = countingInit
+    ExtEuclidean = countingExtEuclidean
+    return self
+
+  def __exit__(self, *exc):
+    global ActiveProfiler, ExtEuclidean
+    for cls, method, function in reversed(self.originals):
+      setattr(cls, method, function)
+    self.originals = []
+    ExtEuclidean = plainExtEuclidean
+    ActiveProfiler = None
+
+  def totals(self):
+    """Calls per operation over all stages and fields."""
+    totals = {}
+    for (stage, operation, field), n in self.calls.items():
+      totals[operation] = totals.get(operation, 0) + n
+    return totals
+
+  def report(self):
+    """Counted calls and allocations, most frequent first.
+
+    calls has one record per stage, operation and field, allocations one
+    per stage and element class.
+    """
+    calls = [{'stage': stage, 'operation': operation,
+              'field': fieldLabel(field), 'calls': n}
+             for (stage, operation, field), n in self.calls.items()]
+    allocations = [{'stage': stage, 'class': name, 'count': n}
+                   for (stage, name), n in self.allocations.items()]
+    calls.sort(key=lambda r: -r['calls'])
+    allocations.sort(key=lambda r: -r['count'])
+    return {'calls': calls, 'allocations': allocations}
+
+class ProfileStage(object):
+  """Charges the field operations of a with block to stage name."""
+  __slots__ = ('name', 'previous')
+
+  def __init__(self, name):
+    self.name = name
+    self.previous = None
+
+  def __enter__(self):
+    if ActiveProfiler is not None:
+      self.previous = ActiveProfiler.stage
+      ActiveProfiler.stage = self.name
+    return self
+
+  def __exit__(self, *exc):
+    if ActiveProfiler is not None:
+      ActiveProfiler.stage = self.previous
+
 def toBin(a):
   """Integer to list of binary values."""
   r = []
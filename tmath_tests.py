@@ -21,5 +21,215 @@ class TmathTests(unittest.TestCase):
         ExtEuclidean(POFZ2, rp, L2POL(toBin(inverse), Z2))[2]))
       self.assertEqual(inverseinverse, i)
 
+  def test_log_tables_match_generic(self):
+    Z2 = Z(2)
+    rp = POF(Z2).fromInt(0x11b)
+    fast = GFPOF(Z2, rp)
+    slow = GFPOF(Z2, rp, logTables=False)
+    self.assertTrue(fast.exp is not None)
+    self.assertTrue(slow.exp is None)
+    for a in range(1, 256, 7):
+      for b in range(1, 256, 11):
+        self.assertEqual(slow.mul(slow.fromInt(a), slow.fromInt(b)),
+                         fast.mul(fast.fromInt(a), fast.fromInt(b)))
+      self.assertEqual(slow.fromInt(a).mulInv(), fast.fromInt(a).mulInv())
+      self.assertEqual(slow.fromInt(a).xtime(), fast.fromInt(a).xtime())
+      self.assertEqual(FieldElement.scalarPow(slow.fromInt(a), 200),
+                       fast.fromInt(a).scalarPow(200))
+    self.assertTrue(fast.mul(fast.fromInt(0), fast.fromInt(5)).isPlusID())
+    self.assertRaises(ZeroDivisionError, fast.fromInt(0).mulInv)
+
+  def test_log_tables_need_irreducible_rp(self):
+    Z2 = Z(2)
+    # x^4 + x^3 + x^2 + 1 = (x + 1)(x^3 + x + 1)
+    self.assertTrue(GFPOF(Z2, POF(Z2).fromInt(0x1d)).exp is None)
+    self.assertTrue(GFPOF(Z2, POF(Z2).fromInt(0x13)).exp is not None)
+
+  def test_binary_pof_matches_pof(self):
+    Z2 = Z(2)
+    generic = POF(Z2)
+    binary = BinaryPOF(Z2)
+    rp = 0x11b
+    for i in range(1, 256, 3):
+      a = ExtEuclidean(generic, generic.fromInt(rp), generic.fromInt(i))
+      b = ExtEuclidean(binary, binary.fromInt(rp), binary.fromInt(i))
+      for x, y in zip(a, b):
+        self.assertEqual(POL2L(x), POL2L(y))
+        self.assertEqual(str(x), str(y))
+    q, r = binary.longDiv(binary.fromInt(0x11b), binary.fromInt(0x1f))
+    self.assertEqual(binary.fromInt(0x11b),
+                     binary.plus(binary.mul(q, binary.fromInt(0x1f)), r))
+    self.assertRaises(ValueError, BinaryPOF, Z(3))
+
+  def test_binary_pof_equality(self):
+    Z2 = Z(2)
+    p = POF(Z2).fromInt(0x57)
+    b = BinaryPOF(Z2).fromInt(0x57)
+    self.assertTrue(p == b and b == p)
+    self.assertFalse(p != b or b != p)
+    self.assertEqual(hash(p), hash(b))
+    self.assertEqual(1, len(set([p, b])))
+    self.assertTrue(b != BinaryPOF(Z2).fromInt(0x56))
+    self.assertTrue(b != POF(Z2).fromInt(0x56))
+    # 3x has the nonzero coefficients of x, but is not x.
+    self.assertTrue(BinaryPOF(Z2).fromInt(2) != POF(Z(7)).fromInt(21))
+    self.assertFalse(b == None)
+    self.assertTrue(b != None)
+
+  def test_binary_gfpof_matches_gfpof(self):
+    Z2 = Z(2)
+    rp = POF(Z2).fromInt(0x11b)
+    generic = GFPOF(Z2, rp, logTables=False)
+    for binary in [BinaryGFPOF(Z2, rp), BinaryGFPOF(Z2, rp, logTables=False)]:
+      for a in range(1, 256, 5):
+        for b in range(1, 256, 13):
+          self.assertEqual(generic.mul(generic.fromInt(a), generic.fromInt(b)),
+                           binary.mul(binary.fromInt(a), binary.fromInt(b)))
+        self.assertEqual(generic.fromInt(a).mulInv(), binary.fromInt(a).mulInv())
+        self.assertEqual(generic.fromInt(a).xtime(), binary.fromInt(a).xtime())
+    self.assertRaises(ValueError, binary.fromInt, 0x100)
+
+  def test_large_binary_field(self):
+    Z2 = Z(2)
+    # GF(2^128) of GCM, cross-checked against the generic implementation.
+    rp = (1 << 128) | 0x87
+    generic = GFPOF(Z2, POF(Z2).fromInt(rp))
+    binary = BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt(rp))
+    a = 0x66e94bd4ef8a2c3b884cfa59ca342b2e
+    b = 0x0388dace60b6a392f328c2b971b2fe78
+    self.assertEqual(generic.mul(generic.fromInt(a), generic.fromInt(b)),
+                     binary.mul(binary.fromInt(a), binary.fromInt(b)))
+    # GF(2^233) with the NIST B-233 trinomial
+    gf233 = BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt((1 << 233) | (1 << 74) | 1))
+    x = gf233.fromInt(0x1234567890abcdef << 150)
+    self.assertTrue(gf233.mul(x, x.mulInv()).isMulID())
+
+  def test_memoize(self):
+    Z2 = Z(2)
+    rp = POF(Z2).fromInt(0x11b)
+    gf = GFPOF(Z2, rp, logTables=False)
+    plain = GFPOF(Z2, rp, logTables=False)
+    self.assertEqual(None, gf.memoStats())
+    gf.memoize(4)
+    for a in [3, 5, 3, 3, 7, 11, 13, 3]:
+      inv = gf.fromInt(a).mulInv()
+      self.assertEqual(plain.fromInt(a).mulInv(), inv)
+      # Cached results are copies that callers may modify.
+      inv.setCoefficient(0, Z2.plusID())
+    stats = gf.memoStats()['mulInv']
+    self.assertEqual((3, 5, 4), (stats['hits'], stats['misses'], stats['size']))
+    # The reduction steps of ExtEuclidean are cached in the ring.
+    self.assertTrue(gf.memoStats()['ring.longDiv']['misses'] > 0)
+    gf.unmemoize()
+    self.assertEqual((None, None), (gf.memoStats(), gf.ring.memoStats()))
+
+    Z7 = Z(7)
+    ring = POF(Z7)
+    ring.memoize()
+    a, b = ring.fromEL(L2EL([3, 0, 2, 5], Z7)), ring.fromEL(L2EL([1, 4], Z7))
+    expected = ring.computeLongDiv(a, b)
+    self.assertEqual(expected, ring.longDiv(a, b))
+    self.assertEqual(expected, ring.longDiv(a.clone(), b.clone()))
+    self.assertEqual(0.5, ring.memoStats()['longDiv']['hitRate'])
+
+    Z7.memoize()
+    self.assertEqual([1, 4, 5, 2, 3, 6],
+                     [Z7.fromInt(a).mulInv().value for a in range(1, 7)])
+    self.assertEqual(Z7.fromInt(3).mulInv(), Z7.fromInt(5))
+    self.assertEqual(1, Z7.memoStats()['mulInv']['hits'])
+    Z7.unmemoize()
+    self.assertEqual(None, Z7.memoStats())
+
+  def test_batch_mul_inv(self):
+    Z2 = Z(2)
+    Z251 = Z(251)
+    rp = POF(Z2).fromInt(0x11b)
+    gcmRp = (1 << 128) | 0x87
+    fields = [
+      (Z251, range(0, 251, 7)),
+      (GFPOF(Z2, rp, logTables=False), [0x57, 0, 0x83, 1, 0, 0xff]),
+      (GFPOF(Z2, rp), range(0, 256, 15)),
+      (BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt(gcmRp)), [3, 0, 1 << 127, 5]),
+    ]
+    for field, values in fields:
+      elements = [field.fromInt(a) for a in values]
+      expected = [a if a.isPlusID() else a.mulInv() for a in elements]
+      self.assertEqual(expected, field.batchMulInv(elements))
+    self.assertEqual([], Z251.batchMulInv([]))
+    self.assertEqual([Z251.plusID()], Z251.batchMulInv([Z251.fromInt(0)]))
+
+  def test_interned_elements(self):
+    Z7 = Z(7)
+    self.assertTrue(Z7.fromInt(10) is Z7.fromInt(3))
+    self.assertTrue(Z7.mul(Z7.fromInt(2), Z7.fromInt(4)) is Z7.mulID())
+    self.assertTrue(Z7.fromInt(3).clone() is Z7.fromInt(3))
+    self.assertRaises(TypeError, Z7.fromInt(3).setValue, 4)
+    self.assertEqual(3, Z7.fromInt(3).value)
+    # Large fields keep mutable, unshared elements.
+    big = Z(InternMaxOrder + 1)
+    a = big.fromInt(3)
+    self.assertFalse(a is big.fromInt(3))
+    self.assertEqual(big.fromInt(4), a.clone().setValue(4))
+    self.assertFalse(hasattr(a, '__dict__'))
+
+  def test_shared_identities(self):
+    Z2 = Z(2)
+    gf = GFPOF(Z2, POF(Z2).fromInt(0x11b), logTables=False)
+    a = gf.fromInt(0x57)
+    # Missing coefficients and identities are shared, not allocated.
+    self.assertTrue(a.getCoefficient(3) is gf.zero)
+    self.assertTrue(Z2.plusID() is gf.zero and Z2.mulID() is Z2.mulID())
+    self.assertTrue(gf.plusID().isPlusID() and gf.mulID().isMulID())
+    self.assertFalse(a.isPlusID() or a.isMulID())
+    self.assertFalse(gf.fromInt(3).isMulID())
+
+  def test_profiler(self):
+    Z2 = Z(2)
+    gf = GFPOF(Z2, POF(Z2).fromInt(0x11b), logTables=False)
+    a, b = gf.fromInt(0x57), gf.fromInt(0x83)
+    logTables = GFPOF(Z2, POF(Z2).fromInt(0x11b))
+    binary = BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt(0x11b))
+    plainMul = GFPOF.mul
+    with FieldProfiler() as profiler:
+      gf.mul(a, b)
+      with ProfileStage('inverse'):
+        a.mulInv()
+      self.assertRaises(RuntimeError, FieldProfiler().__enter__)
+    self.assertTrue(GFPOF.mul == plainMul and ActiveProfiler is None)
+    totals = profiler.totals()
+    self.assertEqual(1, totals['GFPOF.mul'])
+    self.assertEqual(1, totals['ExtEuclidean'])
+    self.assertEqual(totals['POF.longDiv'], totals['ExtEuclidean.iteration'] + 1)
+    calls = profiler.report()['calls']
+    self.assertEqual(set([None, 'inverse']), set([r['stage'] for r in calls]))
+    self.assertEqual(['inverse'], [r['stage'] for r in calls
+                                   if r['operation'] == 'GFPOFElement.mulInv'])
+    self.assertTrue(all(r['field'].startswith('Z(2) at ') for r in calls
+                        if r['operation'] == 'Z.mul'))
+    allocations = profiler.report()['allocations']
+    self.assertTrue(any(r['class'] == 'GFPOFElement' and r['stage'] is None
+                        for r in allocations))
+    # Nothing is counted after the profiler is done.
+    gf.mul(a, b)
+    self.assertEqual(1, profiler.totals()['GFPOF.mul'])
+    # Both take their log table path instead of Field.batchMulInv.
+    with FieldProfiler() as profiler:
+      logTables.batchMulInv([logTables.fromInt(i) for i in (1, 2, 3)])
+      binary.batchMulInv([binary.fromInt(i) for i in (1, 2, 3)])
+    totals = profiler.totals()
+    self.assertEqual(1, totals['GFPOF.batchMulInv'])
+    self.assertEqual(1, totals['BinaryGFPOF.batchMulInv'])
+    self.assertEqual(3, totals['GFPOFElement.mulInv'])
+    self.assertEqual(3, totals['BinaryGFPOFElement.mulInv'])
+    self.assertFalse('Field.batchMulInv' in totals)
+
+  def test_hash(self):
+    Z2 = Z(2)
+    gf = GFPOF(Z2, POF(Z2).fromInt(0x11b))
+    self.assertEqual(hash(gf.fromInt(0x57)), hash(gf.fromInt(0x57)))
+    self.assertEqual(1, len(set([gf.fromInt(0x57), gf.fromInt(0x57)])))
+    self.assertTrue(gf.fromInt(0x57) != gf.fromInt(0x56))
+    self.assertEqual(hash(Z(7).fromInt(10)), hash(Z(7).fromInt(3)))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# Copyright 2004, 2019, Clemens Fruhwirth <clemens@endorphin.org>
+
+# XTS mode, IEEE 1619, for disk images encrypted sector by sector.
+#
+# The key is the data key followed by the tweak key. Block j of sector n
+# is masked with T_j = E(tweak key, n) * x^j in GF(2^128), where a tweak
+# is read as a little-endian integer. T_j+1 is xtime128(T_j), the same
+# shift-and-reduce step as xtime in GFPOFZ2, so the tweaks of a sector
+# cost one multiplication by x each.
+#
+# Sector sizes must be a multiple of the block size; there is no
+# ciphertext stealing. XTSImage works on a memory-mapped image file in
+# place: bulk encryption hands ranges of sectors to a process pool whose
+# workers map the same file and write their sectors directly, and single
+# sectors can be read or rewritten without touching the rest.
+
+from aes import Rijndael, bytesToWords, wordsToBytes
+import mmap
+import multiprocessing
+import struct
+
+# x^128 + x^7 + x^2 + x + 1, Sec 5.2 of IEEE 1619. MAGIC
+XTSPolynomial = (1 << 128) | 0x87
+
+DefaultSectorSize = 512
+DefaultSectorsPerTask = 64
+
+def xtime128(t):
+  """t * x in GF(2^128) modulo XTSPolynomial."""
+  t = t << 1
+  if t >> 128:
+    t ^= XTSPolynomial
+  return t
+
+def tweakBytes(t):
+  """The 16 little-endian bytes of the tweak t."""
+  return struct.pack('<QQ', t & 0xFFFFFFFFFFFFFFFF, t >> 64)
+
+
+class XTS(object):
+  """XTS encryption of sectors in memory."""
+  def __init__(self, key):
+    half = len(key) / 2
+    if len(key) % 2:
+      raise ValueError("XTS key of %d bytes can't be split in two" % len(key))
+    self.dataCipher = Rijndael(key[:half])
+    self.tweakCipher = Rijndael(key[half:])
+
+  def tweakWords(self, sector, count):
+    """Words of the tweaks of the first count blocks of sector."""
+    t = self.tweakCipher.encrypt_block(bytearray(tweakBytes(sector)))
+    t = struct.unpack('<QQ', bytes(t))
+    t = t[0] | t[1] << 64
+    tweaks = []
+    for j in range(0, count):
+      tweaks.append(tweakBytes(t))
+      t = xtime128(t)
+    return bytesToWords(''.join(tweaks))
+
+  def process(self, sector, data, function):
+    if not len(data) or len(data) % 16:
+      raise ValueError("sector length %d is not a positive multiple of 16" %
+                       len(data))
+    words = bytesToWords(bytes(data))
+    tweaks = self.tweakWords(sector, len(words) / 4)
+    out = [0] * len(words)
+    for i in range(0, len(words), 4):
+      t = tweaks[i:i + 4]
+      out[i:i + 4] = [w ^ k for w, k in zip(
+        function([w ^ k for w, k in zip(words[i:i + 4], t)]), t)]
+    return wordsToBytes(out)
+
+  def encryptSector(self, sector, data):
+    return self.process(sector, data, self.dataCipher.encryptWords)
+
+  def decryptSector(self, sector, data):
+    return self.process(sector, data, self.dataCipher.decryptWords)
+
+
+# Image mapping of a worker process, set by initWorker.
+workerImage = None
+
+def initWorker(path, key, sectorSize):
+  global workerImage
+  workerImage = XTSImage(path, key, sectorSize, workers=0)
+
+def runSectors(task):
+  first, count, decrypt = task
+  workerImage.processSectors(first, count, decrypt)
+  workerImage.map.flush()
+  return count
+
+
+class XTSImage(object):
+  """An image file encrypted with XTS in place, sector by sector."""
+  def __init__(self, path, key, sectorSize=DefaultSectorSize, workers=None,
+               sectorsPerTask=DefaultSectorsPerTask):
+    if sectorSize <= 0 or sectorSize % 16:
+      raise ValueError("sector size %d is not a positive multiple of 16" %
+                       sectorSize)
+    self.xts = XTS(key)
+    self.path = path
+    self.key = key
+    self.sectorSize = sectorSize
+    self.workers = workers
+    self.sectorsPerTask = sectorsPerTask
+    self.file = open(path, 'r+b')
+    try:
+      self.map = mmap.mmap(self.file.fileno(), 0)
+    except (ValueError, mmap.error):
+      self.file.close()
+      raise ValueError("can't map %s, is it empty?" % path)
+    if len(self.map) % sectorSize:
+      self.close()
+      raise ValueError("image size %d is not a multiple of the sector size %d"
+                       % (len(self.map), sectorSize))
+    self.sectors = len(self.map) / sectorSize
+
+  def checkSector(self, sector):
+    if not 0 <= sector < self.sectors:
+      raise IndexError("sector %d out of range 0..%d" %
+                       (sector, self.sectors - 1))
+
+  def readSector(self, sector):
+    """Decrypts and returns one sector."""
+    self.checkSector(sector)
+    start = sector * self.sectorSize
+    return self.xts.decryptSector(sector,
+                                  self.map[start:start + self.sectorSize])
+
+  def writeSector(self, sector, data):
+    """Encrypts data into one sector, leaving all others alone."""
+    self.checkSector(sector)
+    if len(data) != self.sectorSize:
+      raise ValueError("sector data has %d bytes, expected %d" %
+                       (len(data), self.sectorSize))
+    start = sector * self.sectorSize
+    self.map[start:start + self.sectorSize] = bytes(
+      self.xts.encryptSector(sector, data))
+
+  def processSectors(self, first, count, decrypt):
+    """Encrypts or decrypts count sectors from first in place."""
+    function = self.xts.decryptSector if decrypt else self.xts.encryptSector
+    size = self.sectorSize
+    for sector in range(first, first + count):
+      start = sector * size
+      self.map[start:start + size] = bytes(
+        function(sector, self.map[start:start + size]))
+
+  def tasks(self, decrypt):
+    for first in range(0, self.sectors, self.sectorsPerTask):
+      yield (first, min(self.sectorsPerTask, self.sectors - first), decrypt)
+
+  def run(self, decrypt):
+    if self.workers == 0:
+      self.processSectors(0, self.sectors, decrypt)
+    else:
+      # Workers write through their own mapping of the file, which is
+      # shared with ours.
+      self.map.flush()
+      pool = multiprocessing.Pool(self.workers, initWorker,
+                                  (self.path, self.key, self.sectorSize))
+      try:
+        for count in pool.imap_unordered(runSectors, self.tasks(decrypt)):
+          pass
+      finally:
+        pool.close()
+        pool.join()
+    self.map.flush()
+
+  def encrypt(self):
+    """Encrypts the whole plaintext image in place."""
+    self.run(False)
+
+  def decrypt(self):
+    """Decrypts the whole image in place."""
+    self.run(True)
+
+  def close(self):
+    self.map.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -0,0 +1,92 @@
+from aes_tests import parseHex
+from tmath import Z, BinaryPOF, BinaryGFPOF
+import xts
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# IEEE 1619-2007, Annex B, vectors 1 to 4
+vectors = [
+  # key, data unit sequence number, plaintext, ciphertext
+  (bytearray(32), 0, bytearray(32),
+   parseHex("917cf69ebd68b2ec9b9fe9a3eadda692cd43d2f59598ed858c02c2652fbf922e")),
+  (parseHex("11" * 16 + "22" * 16), 0x3333333333, parseHex("44" * 32),
+   parseHex("c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0")),
+  (parseHex("fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0" + "22" * 16), 0x3333333333,
+   parseHex("44" * 32),
+   parseHex("af85336b597afc1a900b2eb21ec949d292df4c047e0b21532186a5971a227a89")),
+]
+key4 = parseHex("27182818284590452353602874713526"
+                "31415926535897932384626433832795")
+
+class XTSTests(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'image')
+    self.plain = os.urandom(512 * 10)
+    with open(self.path, 'wb') as f:
+      f.write(self.plain)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_vectors(self):
+    for key, sector, p, c in vectors:
+      self.assertEqual(c, xts.XTS(key).encryptSector(sector, p))
+      self.assertEqual(p, xts.XTS(key).decryptSector(sector, c))
+    # Only the first block of vector 4, which has 512 bytes.
+    c = xts.XTS(key4).encryptSector(0, bytearray(range(256)) * 2)
+    self.assertEqual(parseHex("27a7479befa1d476489f308cd4cfa6e2"), c[:16])
+
+  def test_xtime_matches_tmath(self):
+    Z2 = Z(2)
+    gf = BinaryGFPOF(Z2, BinaryPOF(Z2).fromInt(xts.XTSPolynomial))
+    for t in (1, 1 << 127, (1 << 128) - 1, 0x1234567890abcdef << 64):
+      self.assertEqual(gf.fromInt(t).xtime().bits, xts.xtime128(t))
+
+  def test_image(self):
+    key = bytearray(os.urandom(32))
+    expected = bytearray().join(
+      [xts.XTS(key).encryptSector(n, self.plain[512 * n:512 * (n + 1)])
+       for n in range(0, 10)])
+    for workers in (0, 2):
+      with xts.XTSImage(self.path, key, workers=workers,
+                        sectorsPerTask=3) as image:
+        image.encrypt()
+      with open(self.path, 'rb') as f:
+        self.assertEqual(expected, bytearray(f.read()))
+      with xts.XTSImage(self.path, key, workers=workers) as image:
+        self.assertEqual(self.plain[512 * 4:512 * 5], image.readSector(4))
+        image.decrypt()
+      with open(self.path, 'rb') as f:
+        self.assertEqual(self.plain, f.read())
+
+  def test_write_single_sector(self):
+    key = bytearray(os.urandom(64))
+    with xts.XTSImage(self.path, key, workers=0) as image:
+      image.encrypt()
+    with open(self.path, 'rb') as f:
+      before = f.read()
+    data = os.urandom(512)
+    with xts.XTSImage(self.path, key) as image:
+      image.writeSector(7, data)
+      self.assertEqual(data, image.readSector(7))
+      self.assertRaises(IndexError, image.writeSector, 10, data)
+      self.assertRaises(ValueError, image.writeSector, 1, data[1:])
+    with open(self.path, 'rb') as f:
+      after = f.read()
+    self.assertEqual(before[:512 * 7], after[:512 * 7])
+    self.assertEqual(before[512 * 8:], after[512 * 8:])
+    self.assertNotEqual(before[512 * 7:512 * 8], after[512 * 7:512 * 8])
+
+  def test_bad_input(self):
+    self.assertRaises(ValueError, xts.XTS, bytearray(33))
+    self.assertRaises(ValueError, xts.XTS(bytearray(32)).encryptSector, 0,
+                      bytearray(20))
+    self.assertRaises(ValueError, xts.XTSImage, self.path, bytearray(32), 24)
+    self.assertRaises(ValueError, xts.XTSImage, self.path, bytearray(32), 1536)
+
+if __name__ == '__main__':
+    unittest.main()